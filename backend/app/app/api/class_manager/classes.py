@@ -11,13 +11,14 @@ from typing import Any
 
 from fastapi import APIRouter, Depends, Body, Path, Query
 from fastapi.responses import JSONResponse
-from redis import Redis
 from sqlalchemy.engine import Row
 from sqlalchemy.orm import Session
 
 from app import crud, schemas
 from app.api import deps
 from app.constants import DBConst, RespError
+from app.core.reference import reference
+from app.core.sms_captcha import VerifyResult, sms_captcha_store
 from app.exceptions import BizHTTPException
 from app.models import Apply4Class, Class, ClassMember
 
@@ -27,19 +28,32 @@ router = APIRouter()
 TELEPHONE_REGEX = r'^1[358]\d{9}$|^147\d{8}$|^179\d{8}$'
 
 
+def check_sms_captcha_lock(
+    telephone: str = Body(..., regex=TELEPHONE_REGEX, description='电话号码'),
+) -> str:
+    """
+    检查手机号是否因验证失败次数过多被锁定，只读取失败次数，不消耗验证码
+    须在其他依赖之前声明，锁定期间的请求不再查询用户上下文和班级
+    """
+    if sms_captcha_store.is_locked(telephone):
+        raise BizHTTPException(*RespError.CAPTCHA_ATTEMPTS_EXCEEDED)
+    return telephone
+
+
 def validate_sms_captcha(
     captcha: int = Body(..., description='验证码'),
-    redis: Redis = Depends(deps.get_redis),
     telephone: str = Body(..., regex=TELEPHONE_REGEX, description='电话号码'),
 ) -> int:
     """
-    校验短信验证码
+    校验短信验证码，比较、删除验证码和失败计数在 Redis 中一次完成
+    校验通过后验证码即被删除，须在其他校验依赖之后声明，
+    班级码、学科等输入有误时不消耗验证码；锁定由 check_sms_captcha_lock 提前检查
     """
-    key_name = f'sms_captcha_{telephone}'
-    correct_captcha = redis.get(key_name)
-    if not correct_captcha or str(captcha) != correct_captcha:
+    result = sms_captcha_store.verify(telephone, captcha)
+    if result == VerifyResult.LOCKED:
+        raise BizHTTPException(*RespError.CAPTCHA_ATTEMPTS_EXCEEDED)
+    if result != VerifyResult.CORRECT:
         raise BizHTTPException(*RespError.INCORRECT_CAPTCHA)
-    redis.delete(key_name)
     return captcha
 
 
@@ -57,31 +71,31 @@ def get_class_by_code(
 
 
 def get_subject(
-    db: Session = Depends(deps.get_db),
     subject_id: int = Body(..., description='任教科目')
 ):
     """
     校验学科是否存在
     """
-    if not crud.subject.subject_exists(db, subject_id):
+    if subject_id not in reference.get().subject_ids:
         raise BizHTTPException(*RespError.INVALID_PARAMETER)
     return subject_id
 
 
 def get_family_relation(
-    db: Session = Depends(deps.get_db),
     family_relation: str = Body(..., description='亲属关系'),
 ) -> str:
     """
     校验亲属关系是否存在
     """
-    if not crud.sys_config.family_relation_exists(db, family_relation):
+    if not reference.get().config_exists(DBConst.FAMILY_RELATION,
+                                         family_relation):
         raise BizHTTPException(*RespError.INVALID_PARAMETER)
     return family_relation
 
 
 @router.post('/teachers/join_request', summary='提交教师端入班申请')
 def teacher_apply_into_class(
+    __: str = Depends(check_sms_captcha_lock),
     db: Session = Depends(deps.get_db),
     token: schemas.TokenPayload = Depends(deps.get_activated),
     name: str = Body(..., description='姓名'),
@@ -157,6 +171,7 @@ def teacher_apply_into_class(
 
 @router.post('/students/join_request', summary='提交学生端入班申请')
 def student_apply_into_class(
+    __: str = Depends(check_sms_captcha_lock),
     db: Session = Depends(deps.get_db),
     token: schemas.TokenPayload = Depends(deps.get_activated),
     name: str = Body(..., description='姓名'),
@@ -231,9 +246,9 @@ def get_family_members(
 
 
 @router.get('/{class_code}/', summary='获取邀请入班的小程序码')
-def get_family_members(
+def get_invitation_wxacode(
     token: schemas.TokenPayload = Depends(deps.get_activated),
-    redis: Redis = Depends(deps.get_redis),
+    access_token: str = Depends(deps.get_wx_access_token),
 ) -> Any:
     """
     获取邀请入班的小程序码
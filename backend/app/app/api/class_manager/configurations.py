@@ -5,16 +5,17 @@
 
 """
 路径函数 - 配置相关
+配置数据读取进程内的基础数据注册表，不查询数据库
 """
 
 from typing import Any
 
 from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
 
-from app import crud, schemas
+from app import schemas
 from app.api import deps
 from app.constants import DBConst
+from app.core.reference import reference
 
 
 router = APIRouter()
@@ -22,21 +23,19 @@ router = APIRouter()
 
 @router.get('/subjects', summary='查询学科配置')
 def get_subjects(
-    db: Session = Depends(deps.get_db),
     _: schemas.TokenPayload = Depends(deps.get_activated)
 ) -> Any:
     """
     查询学科配置
     """
-    return crud.subject.all(db)
+    return reference.get().subjects
 
 
 @router.get('/family_relations', summary='查询亲属关系配置')
 def get_family_relations(
-    db: Session = Depends(deps.get_db),
     _: schemas.TokenPayload = Depends(deps.get_activated)
 ) -> Any:
     """
     查询亲属关系配置
     """
-    return crud.sys_config.get_config_by_type(db, type_=DBConst.FAMILY_RELATION)
+    return reference.get().get_configs(DBConst.FAMILY_RELATION)
@@ -7,14 +7,10 @@
 路径函数 - 登录验证相关
 """
 
-import json
-from datetime import timedelta
 from typing import Dict
 
-import requests
 from fastapi import APIRouter, Depends, Path
 from loguru import logger
-from pydantic import ValidationError
 from sqlalchemy.orm import Session
 
 from app import crud, schemas
@@ -22,8 +18,9 @@ from app.api import deps
 from app.constants import RespError
 from app.core import security
 from app.core.config import settings
+from app.core.user_context import user_context_cache
+from app.core.wechat import wechat_client
 from app.exceptions import BizHTTPException
-from app.schemas import Code2SessionMsg
 
 
 router = APIRouter()
@@ -50,47 +47,32 @@ def get_access_token(
     接受code，提交code到微信 auth.code2Session 接口，获取用户 openid、session_key 等信息
     若数据库 user 表无用户数据则新建用户数据
     用户的 id、openid、session_key 将被写入Token，其中 openid 和 session_key 写入前会进行加密
+    用户上下文（当前班级成员id、是否停用）及其版本号也会被写入Token
     """
-    error = None
-    params = {
-        'appid': settings.MINI_PROGRAM_APP_ID,
-        'secret': settings.MINI_PROGRAM_APP_SECRET,
-        'js_code': code,
-        'grant_type': 'authorization_code',
-    }
-
     # 请求微信 auth.code2session 接口
-    resp = requests.get(settings.CODE2SESSION_URL, params=params)
-    try:
-        resp_msg = Code2SessionMsg(**json.loads(resp.text))
-    except (ValidationError, json.JSONDecodeError):
-        error = resp_msg = 1
-    if error or not resp_msg.openid or not resp_msg.session_key:
+    resp_msg = wechat_client.code2session(code)
+    if not resp_msg.openid or not resp_msg.session_key:
         logger.error(f'rid={request_id} code to session failed,'
-                     f'status code={resp.status_code} message={resp.text}')
+                     f'errcode={resp_msg.errcode} errmsg={resp_msg.errmsg}')
         error = CODE2SESSION_ERROR_MAP.get(resp_msg.errcode,
                                            RespError.AUTHENTICATE_FAILED)
         raise BizHTTPException(*error)
 
-    # 查询该openid的用户是否已在数据库内，若无则新建用户数据
-    user = crud.user.is_openid_exists(db, resp_msg.openid)
-    if not user:
-        new_user = schemas.UserCreate(openid=resp_msg.openid)
-        user = crud.user.create(db, obj_in=new_user)
+    # 查询该openid的用户，若无则新建用户数据
+    user = crud.user.get_or_create_by_openid(db, resp_msg.openid)
 
-    # Token过期时间
-    access_token_expires = timedelta(
-        minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES
-    )
-    # 加密openid
-    flag = security.AESCrypto.encrypt(resp_msg.openid,
-                                      settings.AES_KEY, settings.AES_IV)
-    # 加密session_key
-    sub_sign = security.AESCrypto.encrypt(resp_msg.session_key,
-                                          settings.AES_KEY, settings.AES_IV)
+    # 用户上下文及其版本号来自同一行数据，写入版本号后 Token 中的用户上下文才会被使用
+    context = None
+    if settings.ACCESS_TOKEN_EMBED_CONTEXT:
+        user_context_cache.publish_version(user.id, user.ctx_version)
+        context = schemas.MemberContextClaim(
+            mid=user.current_member_id,
+            dis=user.is_delete,
+            ver=user.ctx_version,
+        )
     data = {
-        'access_token': security.create_access_token(
-            user.id, flag, sub_sign, access_token_expires
+        'access_token': security.token_issuer.issue(
+            user.id, resp_msg.openid, resp_msg.session_key, context
         ),
         'token_type': 'bearer',
     }
@@ -5,15 +5,18 @@
 
 """
 路径函数 - 页面相关
+响应缓存在进程内（pages_cache），页面图片、首页菜单变更后缓存失效，
+响应头携带 ETag，客户端携带 If-None-Match 且内容未变更时返回 304
 """
 
 from typing import Any
 
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, Query, Request
 from sqlalchemy.orm import Session
 
 from app import crud, schemas
 from app.api import deps
+from app.core.response_cache import pages_cache
 
 
 router = APIRouter()
@@ -24,16 +27,21 @@ HOMEPAGE_MENU_NUMBER_LIMIT = 8
 
 @router.get('/startup_pages', summary='获取启动页图片', description='获取启动页图片')
 def get_startup_page(
+    request: Request,
     db: Session = Depends(deps.get_db),
 ) -> Any:
     """
     获取启用中的启动页图片路径
     """
-    return crud.entrance_page.get_startup_activated(db)
+    return pages_cache.response(
+        request, 'startup_pages',
+        lambda: crud.entrance_page.get_startup_activated(db),
+    )
 
 
 @router.get('/guidance_pages', summary='获取引导页图片', description='获取引导页图片')
 def get_guidance_pages(
+    request: Request,
     db: Session = Depends(deps.get_db),
     limit: int = Query(ENTRANCE_PAGE_LIMIT, description='数量'),
 ) -> Any:
@@ -42,11 +50,15 @@ def get_guidance_pages(
     """
     if not limit or limit <= 0 or limit > ENTRANCE_PAGE_LIMIT:
         limit = ENTRANCE_PAGE_LIMIT
-    return crud.entrance_page.get_guidance_activated(db, limit=limit)
+    return pages_cache.response(
+        request, ('guidance_pages', limit),
+        lambda: crud.entrance_page.get_guidance_activated(db, limit=limit),
+    )
 
 
 @router.get('/homepage_menus', summary='获取首页菜单', description='获取首页菜单')
 def get_homepage_menus(
+    request: Request,
     db: Session = Depends(deps.get_db),
     _: schemas.TokenPayload = Depends(deps.get_activated),
     limit: int = Query(HOMEPAGE_MENU_NUMBER_LIMIT, description='数量'),
@@ -56,5 +68,8 @@ def get_homepage_menus(
     """
     if not limit or limit <= 0 or limit > HOMEPAGE_MENU_NUMBER_LIMIT:
         limit = HOMEPAGE_MENU_NUMBER_LIMIT
-    homepage_menus = crud.homepage_menu.get_activated(db, limit)
-    return homepage_menus
+    return pages_cache.response(
+        request, ('homepage_menus', limit),
+        lambda: crud.homepage_menu.get_activated(db, limit),
+        private=True,
+    )
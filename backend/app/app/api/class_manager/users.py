@@ -11,14 +11,14 @@ import secrets
 
 from fastapi import APIRouter, Depends, Body
 from fastapi.responses import JSONResponse
-from redis import Redis
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app import crud, schemas
 from app.api import deps
 from app.constants import RespError
 from app.core.celery_app import celery_app
 from app.core.config import settings
+from app.core.sms_captcha import sms_captcha_store
 from app.exceptions import BizHTTPException
 
 
@@ -28,48 +28,48 @@ TELEPHONE_REGEX = r'^1[358]\d{9}$|^147\d{8}$|^179\d{8}$'
 
 
 @router.get('/info', summary='查询用户基本信息')
-def get_user_basic_info(
-    db: Session = Depends(deps.get_db),
-    token: schemas.TokenPayload = Depends(deps.get_activated),
+async def get_user_basic_info(
+    db: AsyncSession = Depends(deps.get_async_db),
+    token: schemas.TokenPayload = Depends(deps.get_activated_async),
 ):
     """
     查询用户在 当前所在班级的 信息
     """
     user_id = int(token.sub)
     cur_member_id = token.user.current_member_id
-    return crud.class_member.get_current_class_member(db, user_id, cur_member_id)
+    return await crud.class_member.get_current_class_member_async(
+        db, user_id, cur_member_id
+    )
 
 
 @router.post('/telephone/sms_captcha/request', summary='请求手机短信验证码')
 def send_sms_captcha(
     request_id: int = Depends(deps.get_request_id),
     _: schemas.TokenPayload = Depends(deps.get_activated),
-    redis: Redis = Depends(deps.get_redis),
     telephone: str = Body(..., regex=TELEPHONE_REGEX, description='电话号码'),
 ) -> JSONResponse:
     """
     通过短信发送手机号验证码
     """
-    # 从Redis获取该手机号对应的 send_flag，
-    # 若 send_flag 已存在则判定为发送过于频繁，此时不予发送短信
-    send_flag = redis.get(f'send_flag_{telephone}')
-    if send_flag:
-        raise BizHTTPException(*RespError.USER_REQUESTS_TOO_FREQUENTLY)
     # 生成随机验证码
     captcha = secrets.randbelow(999999)
+    # 检查并写入 send_flag、存储验证码 在 Redis 中原子地完成，
+    # 若 send_flag 已存在则判定为发送过于频繁，此时不予发送短信
+    if not sms_captcha_store.issue(telephone, captcha):
+        raise BizHTTPException(*RespError.USER_REQUESTS_TOO_FREQUENTLY)
     # 向celery推送短信发送任务
-    celery_app.send_task(
-        'worker.send_sms_captcha',
-        args=[
-            request_id,
-            telephone,
-            captcha,
-            settings.SMS_CAPTCHA_EXPIRE_SECONDS // 60,
-        ]
-    )
-    # 存储 send_flag 和 验证码 到Redis
-    redis.setex(f'send_flag_{telephone}', settings.SEND_SMS_INTERVAL_SECONDS, 1)
-    redis.setex(
-        f'sms_captcha_{telephone}', settings.SMS_CAPTCHA_EXPIRE_SECONDS, captcha
-    )
+    try:
+        celery_app.send_task(
+            'app.worker.send_sms_captcha',
+            args=[
+                request_id,
+                telephone,
+                captcha,
+                settings.SMS_CAPTCHA_EXPIRE_SECONDS // 60,
+            ]
+        )
+    except Exception:
+        # 短信未发送，允许立即重新请求
+        sms_captcha_store.revoke(telephone)
+        raise
     return JSONResponse()
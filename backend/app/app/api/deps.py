@@ -1,4 +1,4 @@
-from typing import Generator
+from typing import AsyncGenerator, Generator
 
 from fastapi import Depends, Request
 from fastapi.security import HTTPBearer
@@ -6,19 +6,28 @@ from fastapi.security.http import HTTPAuthorizationCredentials
 from jose import jwt
 from pydantic import ValidationError
 from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 from app import crud, schemas
 from app.constants import RespError
 from app.core import security
-from app.core.config import settings
-from app.db.session import SessionLocal
+from app.core.stats import Stats
+from app.core.user_context import user_context_cache
+from app.core.wechat import access_token_provider
+from app.db.async_redis import async_redis
+from app.db.async_session import AsyncSessionLocal
+from app.db.session import LazySession
 from app.db.redis import redis
 from app.exceptions import BizHTTPException
 
 
 reusable_oauth2 = HTTPBearer(auto_error=False)
 
+# 数据库会话统计  request: 声明了 get_db 的请求数  untouched: 其中未使用数据库的请求数
+db_stats = Stats('db_session')
+
 
 def get_request_id(request: Request) -> str:
     """
@@ -30,13 +39,15 @@ def get_request_id(request: Request) -> str:
 def get_db() -> Generator:
     """
     获取数据库连接
+    返回的会话在首次使用时才创建，未使用数据库的请求不占用连接池中的连接
     """
-    db = None
+    db = LazySession()
     try:
-        db = SessionLocal()
         yield db
     finally:
-        db.close() if db else ...
+        db.close()
+        db_stats.incr('request')
+        db_stats.incr('untouched') if not db.touched else ...
 
 
 def get_redis() -> Redis:
@@ -46,26 +57,59 @@ def get_redis() -> Redis:
     return redis
 
 
-def get_token(
-    db: Session = Depends(get_db),
-    credentials: HTTPAuthorizationCredentials = Depends(reusable_oauth2)
+def get_wx_access_token() -> str:
+    """
+    获取微信接口调用凭证 access_token
+    依次读取进程内缓存、Redis，都没有时刷新，不依赖 Celery beat 定时刷新
+    """
+    return access_token_provider.get()
+
+
+async def get_async_db() -> AsyncGenerator:
+    """
+    获取异步数据库连接
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def get_async_redis() -> AsyncRedis:
+    """
+    获取异步Redis连接
+    """
+    return async_redis
+
+
+def decode_token(
+    credentials: HTTPAuthorizationCredentials
 ) -> schemas.TokenPayload:
     """
-    校验Token，校验Token用户存在数据库中，返回Token payload
+    校验并解析Token，返回Token payload
     """
     if not credentials:
         raise BizHTTPException(*RespError.FORBIDDEN)
     try:
-        payload = jwt.decode(
-            credentials.credentials, settings.SECRET_KEY,
-            algorithms=[security.ALGORITHM], audience='ClassManager'
-        )
-        token = schemas.TokenPayload(**payload)
+        return security.decode_access_token(credentials.credentials)
     except jwt.ExpiredSignatureError:
         raise BizHTTPException(*RespError.TOKEN_EXPIRED)
     except (jwt.JWTError, ValidationError):
         raise BizHTTPException(*RespError.INVALID_TOKEN)
-    user = crud.user.get_basic_info(db, user_id=token.sub)
+
+
+def get_token(
+    db: Session = Depends(get_db),
+    credentials: HTTPAuthorizationCredentials = Depends(reusable_oauth2)
+) -> schemas.TokenPayload:
+    """
+    校验Token，校验Token用户存在数据库中，返回Token payload
+    Token中携带的用户上下文未过期时直接使用，否则从用户上下文缓存中读取
+    """
+    token = decode_token(credentials)
+    user = user_context_cache.get(
+        token.sub,
+        lambda: crud.user.get_basic_info(db, user_id=token.sub),
+        claim=token.ctx,
+    )
     if not user:
         raise BizHTTPException(*RespError.USER_NOT_FOUND)
     token.user = user
@@ -81,3 +125,33 @@ def get_activated(
     if token.user.is_delete:
         raise BizHTTPException(*RespError.USER_DISABLED)
     return token
+
+
+async def get_token_async(
+    db: AsyncSession = Depends(get_async_db),
+    credentials: HTTPAuthorizationCredentials = Depends(reusable_oauth2)
+) -> schemas.TokenPayload:
+    """
+    get_token 的异步版本，供异步路径函数使用
+    """
+    token = decode_token(credentials)
+    user = await user_context_cache.get_async(
+        token.sub,
+        lambda: crud.user.get_basic_info_async(db, user_id=int(token.sub)),
+        claim=token.ctx,
+    )
+    if not user:
+        raise BizHTTPException(*RespError.USER_NOT_FOUND)
+    token.user = user
+    return token
+
+
+async def get_activated_async(
+    token: schemas.TokenPayload = Depends(get_token_async)
+) -> schemas.TokenPayload:
+    """
+    get_activated 的异步版本，供异步路径函数使用
+    """
+    if token.user.is_delete:
+        raise BizHTTPException(*RespError.USER_DISABLED)
+    return token
@@ -18,6 +18,11 @@ class DBConst(Const):
     # -------------- 学校信息表 school 相关 --------------
     SYNC_FROM_API = '1'  # 标识学校数据来源于 API网关同步
 
+    # ---------- 无法识别的学校表 school_quarantine 相关 ----------
+    AREA_NOT_FOUND = '1'   # 所属地区不存在
+    AREA_AMBIGUOUS = '2'   # 所属地区不唯一
+    STAGE_NOT_FOUND = '3'  # 学段不存在
+
     # -------------- 全国地区表 region 相关 --------------
     PROVINCE = '1'  # 省级行政区
     CITY = '2'      # 地级行政区
@@ -66,3 +66,6 @@ class RespError(Const):
         400, 'Too many apply in class', '同一班级申请数量超过上限'
     )
     INCORRECT_CAPTCHA = Response(400, 'Incorrect captcha', '验证码错误')
+    CAPTCHA_ATTEMPTS_EXCEEDED = Response(
+        403, 'Too many incorrect captcha attempts', '验证码错误次数过多，请稍后再试'
+    )
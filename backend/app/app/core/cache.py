@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Date: 2021/8/27
+# Author: gray
+
+"""
+进程内缓存
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+
+from app.core.stats import Stats
+
+
+_MISSING = object()
+
+
+class LocalCache(object):
+    """
+    带过期时间的 LRU 缓存，线程安全
+    缓存项数量超过 maxsize 时淘汰最久未使用的缓存项
+    缓存项写入 ttl 秒后过期，过期的缓存项在下次读取时删除
+    命中、未命中次数记录在 stats 中
+
+    Examples
+    --------
+    cache = LocalCache('user_context', maxsize=1024, ttl=10)
+    cache.set(1, 'value')
+    cache.get(1)  # 'value'
+    """
+    def __init__(self, name: str, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stats = Stats(name)
+        self._data: 'OrderedDict[Hashable, Tuple[float, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        读取缓存项，不存在或已过期时返回 default
+        """
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                self.stats.incr('miss')
+                return default
+            expire_at, value = item
+            if expire_at <= time.monotonic():
+                del self._data[key]
+                self.stats.incr('miss')
+                return default
+            self._data.move_to_end(key)
+        self.stats.incr('hit')
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """
+        写入缓存项，ttl 为空时使用缓存默认的过期时间
+        """
+        expire_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expire_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
@@ -5,4 +5,13 @@ from app.core.config import settings
 
 celery_app = Celery("worker", broker=settings.CELERY_BROKER_URL)
 
-celery_app.conf.task_routes = {"app.worker.send_sms_captcha": "main-queue"}
+# I/O 密集型任务（请求腾讯云短信、微信接口）发送到 io-queue，由线程池 worker 执行；
+# CPU 密集型任务（同步学校数据、重新匹配学校）发送到 cpu-queue，由 prefork worker 执行
+# 启动参数见 worker-start.sh，未配置路由的任务发送到 cpu-queue
+celery_app.conf.task_routes = {
+    "app.worker.send_sms_captcha": "io-queue",
+    "app.worker.get_wx_mini_program_access_token": "io-queue",
+    "app.worker.sync_school_data": "cpu-queue",
+    "app.worker.retry_quarantined_schools": "cpu-queue",
+}
+celery_app.conf.task_default_queue = "cpu-queue"
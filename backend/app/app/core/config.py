@@ -15,8 +15,47 @@ class Settings(BaseSettings):
     # 短信发送 时间间隔、超时时间
     SEND_SMS_INTERVAL_SECONDS: int = 1 * 60
     SMS_CAPTCHA_EXPIRE_SECONDS: int = 5 * 60
+    # 短信验证码 错误次数上限、达到上限后的锁定时间（锁定期间验证失败，已发送的验证码作废）
+    SMS_CAPTCHA_MAX_ATTEMPTS: int = 5
+    SMS_CAPTCHA_LOCKOUT_SECONDS: int = 15 * 60
     # Token有效期 60 * 24 * 7 minutes = 7 days
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 7
+    # 已校验Token缓存 进程内缓存容量、缓存时间上限（同时受Token过期时间限制）
+    ACCESS_TOKEN_CACHE_SIZE: int = 10000
+    ACCESS_TOKEN_CACHE_SECONDS: int = 60 * 60
+    # 签发Token时是否在Token中携带用户上下文（当前班级成员id、是否停用）
+    ACCESS_TOKEN_EMBED_CONTEXT: bool = True
+    # 用户上下文缓存 进程内缓存容量、进程内缓存过期时间、Redis缓存过期时间
+    USER_CONTEXT_LOCAL_CACHE_SIZE: int = 10000
+    USER_CONTEXT_LOCAL_CACHE_SECONDS: int = 10
+    USER_CONTEXT_CACHE_EXPIRE_SECONDS: int = 60 * 60
+    # 页面图片、首页菜单响应缓存 进程内版本号缓存时间、客户端缓存时间（Cache-Control max-age）
+    PAGES_CACHE_VERSION_SECONDS: int = 5
+    PAGES_CACHE_MAX_AGE_SECONDS: int = 60
+    # 基础数据（学科、系统配置、全国地区）检查版本号的时间间隔
+    REFERENCE_DATA_CHECK_SECONDS: int = 10
+    # 进程内计数器（数据库会话、限流等）写入日志的时间间隔，不大于0时不输出
+    STATS_LOG_INTERVAL_SECONDS: int = 5 * 60
+    # 接口限流 是否启用、滑动窗口时长
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_WINDOW_SECONDS: int = 60
+    # 各接口窗口时间内的请求数上限，登录按客户端IP，其他接口按用户id（无有效Token时按IP）
+    RATE_LIMIT_LOGIN: int = 20
+    RATE_LIMIT_JOIN_REQUEST: int = 10
+    RATE_LIMIT_CLASS_CODE_QUERY: int = 20
+    RATE_LIMIT_SMS_CAPTCHA: int = 5
+    # 可信代理（Traefik）的地址或网段，来自可信代理的请求按 X-Forwarded-For 确定客户端IP
+    # 默认只信任本机，部署时须设置为 Traefik 所在网络的网段；不要信任整个私有网段，
+    # 否则同一内网的其他主机、容器可伪造 X-Forwarded-For 绕过按IP的限流
+    # 环境变量为 JSON 格式的列表 e.g: '["127.0.0.1", "10.0.1.0/24"]'
+    RATE_LIMIT_TRUSTED_PROXIES: List[str] = ['127.0.0.1', '::1']
+
+    @validator("RATE_LIMIT_TRUSTED_PROXIES", pre=True)
+    def assemble_trusted_proxies(cls, v: Union[str, List[str]]) -> Union[List[str], str]:  # noqa
+        if isinstance(v, str) and not v.startswith("["):
+            return [i.strip() for i in v.split(",") if i.strip()]
+        return v
+
     SERVER_NAME: str
     SERVER_HOST: AnyHttpUrl
     # BACKEND_CORS_ORIGINS is a JSON-formatted list of origins
@@ -96,6 +135,16 @@ class Settings(BaseSettings):
     SYNC_SCHOOL_API_ID: str
     SYNC_SCHOOL_PAGE_SIZE: int
     SYNC_SCHOOL_URL: AnyHttpUrl
+    # 同步学校数据 同时进行中的分页请求数、单页重试次数、请求超时时间
+    SYNC_SCHOOL_CONCURRENCY: int = 8
+    SYNC_SCHOOL_MAX_RETRIES: int = 3
+    SYNC_SCHOOL_TIMEOUT_SECONDS: int = 10
+    # 同步学校数据时 每批更新到数据库的学校数，与每页数量无关
+    SYNC_SCHOOL_BATCH_SIZE: int = 1000
+    # 同步学校数据定时任务 每天运行的时刻（时）、锁的过期时间、中断的同步进度的保留时间
+    SYNC_SCHOOL_CRON_HOUR: int = 3
+    SYNC_SCHOOL_LOCK_SECONDS: int = 10 * 60
+    SYNC_SCHOOL_CHECKPOINT_EXPIRE_SECONDS: int = 2 * 24 * 60 * 60
 
     MINI_PROGRAM_APP_ID: str
     MINI_PROGRAM_APP_SECRET: str
@@ -104,6 +153,17 @@ class Settings(BaseSettings):
     WX_ACCESS_TOKEN_EXPIRES: int
     WX_ACCESS_TOKEN_UPDATE_OFFSET: int
     WXACODE_GET_UNLIMITED_URL: HttpUrl
+    # 请求微信接口 连接超时、读取超时、系统繁忙重试次数、连接池大小
+    WX_CONNECT_TIMEOUT_SECONDS: float = 3
+    WX_READ_TIMEOUT_SECONDS: float = 5
+    WX_MAX_RETRIES: int = 2
+    WX_POOL_SIZE: int = 20
+    # 请求微信接口熔断 连续失败次数阈值、熔断时间
+    WX_BREAKER_FAILURE_THRESHOLD: int = 5
+    WX_BREAKER_RESET_SECONDS: int = 30
+    # 刷新微信 access_token 锁的过期时间、等待其他进程刷新的最长时间
+    WX_ACCESS_TOKEN_LOCK_SECONDS: int = 30
+    WX_ACCESS_TOKEN_LOCK_WAIT_SECONDS: int = 10
 
     LOG_LEVEL: str
     CELERY_BROKER_URL: str
@@ -126,6 +186,13 @@ class Settings(BaseSettings):
     TENCENT_CLOUD_SMS_SDK_APPID: str
     TENCENT_CLOUD_SMS_TEMPLATE_ID: str
     TENCENT_CLOUD_SMS_SIGN: str
+    # 腾讯云短信 接入地域域名、长连接空闲超过该时间后重新连接
+    TENCENT_CLOUD_SMS_ENDPOINT: str = 'sms.tencentcloudapi.com'
+    SMS_CLIENT_IDLE_SECONDS: float = 30
+    # 短信合并发送 等待时间、每次请求的手机号数上限（腾讯云上限200）、同时进行的请求数
+    SMS_DISPATCH_MAX_WAIT_SECONDS: float = 0.3
+    SMS_DISPATCH_BATCH_SIZE: int = 200
+    SMS_DISPATCH_CONCURRENCY: int = 4
 
     class Config:
         case_sensitive = True
@@ -7,26 +7,287 @@
 内部相关业务逻辑
 """
 
+import ijson
 import json
-import pandas as pd
 import requests
 import time
+from collections import Counter, defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from hashlib import md5
 from loguru import logger
-from typing import List, Tuple
+from redis import Redis
+from redis.exceptions import LockError
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import HTTPError
+from typing import (
+    Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple,
+)
+from uuid import uuid4
 
 from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session
-from sqlalchemy.sql import text
+from sqlalchemy.sql import literal_column, text, tuple_
 
 from app.constants import DBConst
 from app.core.config import settings
-from app.crud import region, sys_config
-from app.models import School
-from app.schemas.sync_school import SyncSchoolRespContent, SyncSchool
+from app.core.reference import reference
+from app.core.stats import Stats
+from app.db.redis import redis
+from app.models import School, SchoolQuarantine
+from app.schemas.sync_school import SyncSchool
 
 
 DISABLED_SCHOOL = 0  # 已停用，软删除标识
+# 从 API网关同步的学校字段，任一字段变化时才更新学校数据
+SYNCED_SCHOOL_FIELDS = (
+    'name', 'region_code', 'address', 'study_stage', 'parent_org_id',
+    'curr_cpscode', 'data_source',
+)
+
+# 无法识别的学校的原因，用于日志
+QUARANTINE_REASONS = {
+    DBConst.AREA_NOT_FOUND: 'area_not_found',
+    DBConst.AREA_AMBIGUOUS: 'area_ambiguous',
+    DBConst.STAGE_NOT_FOUND: 'stage_not_found',
+}
+
+# 全量重新同步学校数据时使用的临时表，事务结束时删除
+SCHOOL_STAGING_TABLE = 'school_sync_staging'
+# matched 为假的行为无法识别的学校，只有 school_id、reason、data，
+# 写入 school_quarantine 表，并用于判断学校是否仍存在
+SCHOOL_STAGING_COLUMNS = (
+    ('matched', 'school_id') + SYNCED_SCHOOL_FIELDS + ('reason', 'data')
+)
+SCHOOL_STAGING_DDL = f"""
+CREATE TEMPORARY TABLE {SCHOOL_STAGING_TABLE} (
+    seq bigserial,
+    matched boolean NOT NULL,
+    school_id bigint NOT NULL,
+    name varchar,
+    region_code integer,
+    address varchar,
+    study_stage varchar,
+    parent_org_id bigint,
+    curr_cpscode integer,
+    data_source varchar(2),
+    reason varchar(2),
+    data jsonb
+) ON COMMIT DROP
+"""
+SCHOOL_MERGE_SQL = f"""
+WITH merged AS (
+    INSERT INTO school (school_id, {', '.join(SYNCED_SCHOOL_FIELDS)})
+    SELECT DISTINCT ON (school_id) school_id, {', '.join(SYNCED_SCHOOL_FIELDS)}
+    FROM {SCHOOL_STAGING_TABLE}
+    WHERE matched
+    ORDER BY school_id, seq DESC
+    ON CONFLICT (school_id) DO UPDATE SET
+        {', '.join(f'{field} = excluded.{field}' for field in SYNCED_SCHOOL_FIELDS)},
+        is_delete = false,
+        update_time = CURRENT_TIMESTAMP
+    WHERE (
+        {', '.join(f'school.{field}' for field in SYNCED_SCHOOL_FIELDS)},
+        school.is_delete
+    ) IS DISTINCT FROM (
+        {', '.join(f'excluded.{field}' for field in SYNCED_SCHOOL_FIELDS)},
+        false
+    )
+    RETURNING xmax = 0 AS inserted
+)
+SELECT
+    count(*) FILTER (WHERE inserted),
+    count(*) FILTER (WHERE NOT inserted),
+    (SELECT count(DISTINCT school_id) FROM {SCHOOL_STAGING_TABLE} WHERE matched)
+FROM merged
+"""
+SCHOOL_SOFT_DELETE_SQL = f"""
+UPDATE school SET is_delete = true, update_time = CURRENT_TIMESTAMP
+WHERE data_source = :data_source
+    AND NOT is_delete
+    AND NOT EXISTS (
+        SELECT 1 FROM {SCHOOL_STAGING_TABLE} staging
+        WHERE staging.school_id = school.school_id
+    )
+"""
+SCHOOL_QUARANTINE_RESOLVE_SQL = f"""
+DELETE FROM school_quarantine
+WHERE school_id IN (SELECT school_id FROM {SCHOOL_STAGING_TABLE} WHERE matched)
+"""
+SCHOOL_QUARANTINE_MERGE_SQL = f"""
+INSERT INTO school_quarantine (school_id, reason, data, run_id)
+SELECT DISTINCT ON (school_id) school_id, reason, data, :run_id
+FROM {SCHOOL_STAGING_TABLE}
+WHERE NOT matched
+ORDER BY school_id, seq DESC
+ON CONFLICT (school_id) DO UPDATE SET
+    reason = excluded.reason,
+    data = excluded.data,
+    run_id = excluded.run_id,
+    update_time = CURRENT_TIMESTAMP
+"""
+
+
+def copy_text(value) -> str:
+    """
+    转换为 COPY 文本格式的字段值
+    """
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    return (
+        str(value).replace('\\', '\\\\').replace('\t', '\\t')
+        .replace('\n', '\\n').replace('\r', '\\r')
+    )
+
+
+class CopyStream(object):
+    """
+    将 bytes 迭代器包装为 COPY FROM STDIN 读取的文件对象，按需从迭代器读取数据
+    迭代器抛出的异常保存在 error 中
+    """
+    def __init__(self, chunks: Iterator[bytes]) -> None:
+        self.error: Optional[Exception] = None
+        self._chunks = chunks
+        self._buffer = b''
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buffer) < size:
+            try:
+                chunk = next(self._chunks, None)
+            except Exception as e:
+                self.error = e
+                raise
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+class SyncSchoolError(Exception):
+    """
+    同步学校数据失败
+    """
+
+
+class AreaIndex(object):
+    """
+    区县级行政区索引，同步学校数据时匹配学校所属地区
+    按 名称 及 (名称, 父级行政区名称) 查找行政区编码
+    """
+    def __init__(self, areas: Iterable[Tuple[int, str, str]]) -> None:
+        by_name = defaultdict(list)
+        by_name_parent = defaultdict(list)
+        for code, name, parent_name in areas:
+            by_name[name].append(int(code))
+            by_name_parent[(name, parent_name)].append(int(code))
+        self._by_name = {k: tuple(v) for k, v in by_name.items()}
+        self._by_name_parent = {k: tuple(v) for k, v in by_name_parent.items()}
+
+    def match(self, area_name: str, city_name: str) -> Optional[int]:
+        """
+        匹配行政区编码，按名称匹配到多个行政区时再按父级行政区名称匹配，
+        无法唯一确定时返回 None
+        """
+        codes = self.candidates(area_name, city_name)
+        if len(codes) != 1:
+            return None
+        return codes[0]
+
+    def candidates(self, area_name: str, city_name: str) -> Tuple[int, ...]:
+        """
+        返回可能的行政区编码，按名称匹配到多个行政区时再按父级行政区名称筛选，
+        按父级行政区名称筛选后没有匹配的，返回按名称匹配到的全部行政区
+        """
+        codes = self._by_name.get(area_name, ())
+        if len(codes) > 1:
+            codes = self._by_name_parent.get((area_name, city_name), codes)
+        return codes
+
+
+class SchoolPage(object):
+    """
+    一页 API网关 学校数据，迭代时从响应体流式解析学校，不读取完整的响应体
+    响应体只能读取一次，迭代结束后 total_page 为总页数
+
+    Raises
+    ------
+    SyncSchoolError : 读取响应体失败，或响应报文格式错误
+    """
+    LIST_PREFIX = 'data.list.item'
+    TOTAL_PAGE_PREFIX = 'data.totalPage'
+
+    def __init__(self, page_no: int, resp: requests.Response) -> None:
+        self.page_no = page_no
+        self.resp = resp
+        self.total_page: Optional[int] = None
+
+    def __iter__(self) -> Iterator[SyncSchool]:
+        try:
+            # 按 Content-Encoding 解压
+            self.resp.raw.decode_content = True
+            for item in ijson.items(self._events(), self.LIST_PREFIX):
+                yield SyncSchool(**item)
+        except (requests.RequestException, HTTPError, ijson.JSONError) as e:
+            raise SyncSchoolError(
+                f'read school page {self.page_no} failed: '
+                f'{e.__class__.__name__}'
+            ) from e
+        finally:
+            self.resp.close()
+        if self.total_page is None:
+            raise SyncSchoolError(
+                f'read school page {self.page_no} failed: totalPage missing'
+            )
+
+    def _events(self) -> Iterator[Tuple[str, str, object]]:
+        # 总页数可能在学校列表之前或之后，解析事件经过时取出
+        for prefix, event, value in ijson.parse(self.resp.raw):
+            if prefix == self.TOTAL_PAGE_PREFIX and event == 'number':
+                self.total_page = int(value)
+            yield prefix, event, value
+
+
+class SchoolBatch(NamedTuple):
+    """
+    一批待更新到数据库的学校数据，按行数分批，一批可能包含多页的数据
+
+    Attributes
+    ----------
+    rows : 已识别待更新到数据库的学校
+    quarantined : 无法识别的启用中学校，
+        [{'school_id': schoolId, 'reason': 原因, 'data': API网关 返回的学校数据}]
+    pages : 本批数据更新到数据库后全部完成的分页，[(页码, 总页数)]
+    """
+    rows: List[dict]
+    quarantined: List[dict]
+    pages: List[Tuple[int, int]]
+
+    @property
+    def size(self) -> int:
+        return len(self.rows) + len(self.quarantined)
+
+
+def build_stage_index(stages: Iterable[Tuple[str, str]]) -> Dict[str, str]:
+    """
+    构建 学段名称 -> 学段配置key 的索引，同名的学段无法唯一确定，不加入索引
+
+    Parameters
+    ----------
+    stages : 学段配置项 (key, 学段名称)
+    """
+    index = {}
+    duplicated = set()
+    for key, stage_name in stages:
+        if stage_name in index:
+            duplicated.add(stage_name)
+        index[stage_name] = key
+    for stage_name in duplicated:
+        del index[stage_name]
+    return index
 
 
 class APIGateway(object):
@@ -37,7 +298,10 @@ class APIGateway(object):
     @staticmethod
     def list_school(
         page_size: int = settings.SYNC_SCHOOL_PAGE_SIZE,
-        curr_page: int = 1
+        curr_page: int = 1,
+        session: Optional[requests.Session] = None,
+        url: str = settings.SYNC_SCHOOL_URL,
+        stream: bool = False,
     ) -> requests.Response:
         """
         调用一次API网关 列出学校信息 接口，获取一页学校信息，返回响应对象
@@ -46,6 +310,9 @@ class APIGateway(object):
         ----------
         page_size : 单次请求时，数据分页的一页的数据量
         curr_page : 单次请求时，数据分页的页码
+        session : 复用连接的会话，为空时每次请求新建连接
+        url : 接口地址
+        stream : 是否只读取响应头，响应体由调用方读取
         """
         # signature=md5(apiId+accessKeyID+accessKeySecret+appKey+appSecret+timestamp)
         timestamp = str(int(time.time()))
@@ -66,130 +333,631 @@ class APIGateway(object):
             'pageSize': page_size,
             'currPage': curr_page,
         }
-        return requests.get(settings.SYNC_SCHOOL_URL, headers=headers, params=params)  # noqa
+        return (session or requests).get(
+            url, headers=headers, params=params,
+            timeout=settings.SYNC_SCHOOL_TIMEOUT_SECONDS, stream=stream,
+        )
+
+    @classmethod
+    def sync_school_data(
+        cls,
+        db: Session,
+        fetcher: Optional['SchoolPageFetcher'] = None,
+        start_page: int = 1,
+        on_page: Optional[Callable[[int, int, Counter], None]] = None,
+        run_id: Optional[str] = None,
+    ) -> Counter:
+        """
+        通过API网关接口同步学校数据并更新到数据库，
+        返回 新增、更新、未变化、无法识别 的学校数
+        学校数据经 iter_school_batches 流式解析、按行数分批，逐批更新到数据库，
+        更新数据库的同时获取后续分页
+        无法识别的学校写入 school_quarantine 表，同一次同步中每所学校只写入一次，
+        之前无法识别、本次已识别的学校移出 school_quarantine 表
+
+        Parameters
+        ----------
+        start_page : 起始页码，从中断的同步继续时使用
+        on_page : 每页全部更新到数据库后调用，参数为 (页码, 总页数, 本次已同步的学校数)
+        run_id : 同步的运行id，从中断的同步继续时与中断前一致，为空时生成
+
+        Raises
+        ------
+        SyncSchoolError : 某一页重试后仍获取失败，该页之前的分页已更新到数据库，
+            该页中已分批的部分学校可能也已更新
+        """
+        fetcher = fetcher or SchoolPageFetcher()
+        run_id = run_id or uuid4().hex
+        sys_area, sys_stage = cls.build_indexes()
+
+        started = time.perf_counter()
+        counts = Counter(inserted=0, updated=0, unchanged=0, quarantined=0)
+        reasons = Counter()
+        total_page = 0
+        for batch in cls.iter_school_batches(
+            fetcher, sys_area, sys_stage, start_page
+        ):
+            counts.update(cls.update_school_data(db, batch.rows))
+            cls.update_quarantine(db, batch, run_id)
+            counts['quarantined'] += len(batch.quarantined)
+            reasons.update(school['reason'] for school in batch.quarantined)
+            for page_no, total_page in batch.pages:
+                if on_page is not None:
+                    on_page(page_no, total_page, counts)
+        logger.info(f'school data synchronized, pages={total_page} '
+                    f'start page={start_page} '
+                    f'inserted={counts["inserted"]} '
+                    f'updated={counts["updated"]} '
+                    f'unchanged={counts["unchanged"]} '
+                    f'elapsed={time.perf_counter() - started:.1f}s '
+                    f'stats={fetcher.stats.snapshot()}')
+        cls._log_quarantined(run_id, reasons)
+        return counts
+
+    @classmethod
+    def resync_school_data(
+        cls,
+        db: Session,
+        soft_delete: bool = False,
+        fetcher: Optional['SchoolPageFetcher'] = None,
+        run_id: Optional[str] = None,
+    ) -> Counter:
+        """
+        全量重新同步学校数据，
+        返回 新增、更新、未变化、停用、无法识别 的学校数及写入临时表的行数
+        所有分页的学校数据通过 COPY 写入临时表，再由一条语句合并到 school 表，
+        无法识别的学校合并到 school_quarantine 表，
+        在同一个事务中完成，失败时回滚，school 表不变
+
+        临时表中同一 school_id 有多行时以最后一页的为准，与逐页同步的结果一致
+        soft_delete 为真时，API网关 已不存在或已停用的学校标记为删除，
+        无法识别的学校不会被标记为删除，本次未出现的学校移出 school_quarantine 表
+
+        Raises
+        ------
+        SyncSchoolError : 某一页重试后仍获取失败
+        """
+        fetcher = fetcher or SchoolPageFetcher()
+        run_id = run_id or uuid4().hex
+        sys_area, sys_stage = cls.build_indexes()
+        started = time.perf_counter()
+        counts = Counter(inserted=0, updated=0, unchanged=0, deleted=0,
+                         quarantined=0, rows=0)
+        reasons = Counter()
+
+        def iter_rows() -> Iterator[bytes]:
+            for batch in cls.iter_school_batches(fetcher, sys_area, sys_stage):
+                reasons.update(school['reason'] for school in batch.quarantined)
+                yield cls._copy_batch(batch, counts)
+
+        try:
+            connection = db.connection()
+            connection.execute(text(SCHOOL_STAGING_DDL))
+            stream = CopyStream(iter_rows())
+            cursor = connection.connection.cursor()
+            try:
+                cursor.copy_expert(
+                    f'COPY {SCHOOL_STAGING_TABLE} '
+                    f'({", ".join(SCHOOL_STAGING_COLUMNS)}) FROM STDIN',
+                    stream,
+                )
+            except Exception:
+                # 获取分页失败时抛出原始异常
+                if stream.error is not None:
+                    raise stream.error
+                raise
+            finally:
+                cursor.close()
+            connection.execute(text(f'ANALYZE {SCHOOL_STAGING_TABLE}'))
+
+            inserted, updated, merged = connection.execute(
+                text(SCHOOL_MERGE_SQL)
+            ).one()
+            connection.execute(text(SCHOOL_QUARANTINE_RESOLVE_SQL))
+            connection.execute(text(SCHOOL_QUARANTINE_MERGE_SQL),
+                               {'run_id': run_id})
+            if soft_delete:
+                counts['deleted'] = connection.execute(
+                    text(SCHOOL_SOFT_DELETE_SQL),
+                    {'data_source': DBConst.SYNC_FROM_API},
+                ).rowcount
+                db.query(SchoolQuarantine).filter(
+                    SchoolQuarantine.run_id != run_id
+                ).delete(synchronize_session=False)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+        counts['inserted'] = inserted
+        counts['updated'] = updated
+        counts['unchanged'] = merged - inserted - updated
+        elapsed = time.perf_counter() - started
+        logger.info(f'school data resynchronized, rows={counts["rows"]} '
+                    f'inserted={inserted} updated={updated} '
+                    f'unchanged={counts["unchanged"]} '
+                    f'deleted={counts["deleted"]} elapsed={elapsed:.1f}s '
+                    f'rows/s={counts["rows"] / elapsed:.0f}')
+        cls._log_quarantined(run_id, reasons)
+        return counts
 
     @classmethod
-    def sync_school_data(cls, db: Session) -> None:
+    def retry_quarantined_schools(
+        cls, db: Session, batch_size: int = settings.SYNC_SCHOOL_BATCH_SIZE
+    ) -> Counter:
         """
-        通过API网关接口同步学校数据并更新到数据库
+        用当前的 地区、学段 配置重新匹配 school_quarantine 表中的学校，不请求 API网关，
+        返回 已识别、仍无法识别 的学校数
+        已识别的学校更新到数据库并移出 school_quarantine 表，仍无法识别的学校更新原因
         """
-        # 查询 全国地区、学段 相关的系统配置
-        sys_area = region.get_area_tree(db)
-        sys_area = pd.DataFrame(
-            sys_area, columns=['code', 'name', 'parent_name']
+        sys_area, sys_stage = cls.build_indexes()
+        counts = Counter(resolved=0, remaining=0)
+        last_id = 0
+        while True:
+            quarantined = db.query(
+                SchoolQuarantine.id, SchoolQuarantine.reason,
+                SchoolQuarantine.data,
+            ).filter(
+                SchoolQuarantine.id > last_id
+            ).order_by(SchoolQuarantine.id).limit(batch_size).all()
+            if not quarantined:
+                break
+            last_id = quarantined[-1].id
+
+            resolved_ids, rows, changed = [], [], []
+            for id_, reason, data in quarantined:
+                row, new_reason = cls.match_school(
+                    SyncSchool(**data), sys_area, sys_stage
+                )
+                if row is not None:
+                    resolved_ids.append(id_)
+                    rows.append(row)
+                elif new_reason != reason:
+                    changed.append({'id': id_, 'reason': new_reason})
+            cls.update_school_data(db, rows)
+            db.query(SchoolQuarantine).filter(
+                SchoolQuarantine.id.in_(resolved_ids)
+            ).delete(synchronize_session=False)
+            db.bulk_update_mappings(SchoolQuarantine, changed)
+            db.commit()
+            counts['resolved'] += len(resolved_ids)
+            counts['remaining'] += len(quarantined) - len(resolved_ids)
+        logger.info(f'quarantined schools retried, '
+                    f'resolved={counts["resolved"]} '
+                    f'remaining={counts["remaining"]}')
+        return counts
+
+    @staticmethod
+    def build_indexes() -> Tuple[AreaIndex, Dict[str, str]]:
+        """
+        从基础数据注册表构建 全国地区、学段 索引，不查询数据库
+        地区、学段配置变更后须调用 reference.bump，各进程重新加载后才会使用新的配置
+        """
+        data = reference.get()
+        sys_area = AreaIndex(
+            (code, name, parent_name)
+            for code, (name, parent_name) in data.areas.items()
         )
-        sys_stage = sys_config.get_config_by_type(
-            db, DBConst.SCHOOL_STUDY_STAGE
+        sys_stage = build_stage_index(
+            (item['key'], item['value'])
+            for item in data.get_configs(DBConst.SCHOOL_STUDY_STAGE)
         )
-        sys_stage = pd.DataFrame(sys_stage, columns=['key', 'stage_name'])
-
-        # 调用接口，获取 总页数 和 第一页学校数据
-        resp = cls.list_school()
-        total_page, school_list = cls.preprocess_resp(resp, sys_area, sys_stage)
-        # 第一页学校数据 更新到数据库
-        cls.update_school_data(db, school_list)
-        if total_page < 2:
-            return
-        # 从第二页开始获取学校数据并更新到数据库
-        for page_no in range(2, total_page + 1):
-            resp = cls.list_school(curr_page=page_no)
-            _, school_list = cls.preprocess_resp(resp, sys_area, sys_stage)
-            cls.update_school_data(db, school_list)
+        return sys_area, sys_stage
 
-    @staticmethod
-    def preprocess_resp(
-        resp: requests.Response, sys_area: pd.DataFrame, sys_stage: pd.DataFrame
-    ) -> Tuple[int, List[dict]]:
-        """
-        预处理 API网关接口返回的响应数据
-        匹配 所属地区、学段 信息
-        """
-        # 结构化响应数据
-        resp_content = json.loads(resp.text)
-        content = SyncSchoolRespContent(**resp_content)
-        total_page: int = content.data.totalPage
-        school_list: List[SyncSchool] = content.data.list
-
-        # 匹配学校的 所属地区、学段
-        invalid_list: List[SyncSchool] = []  # 无法识别的学校
-        valid_list: List[dict] = []          # 已识别待更新到数据库的学校
-        for school in school_list:
-            if school.status == DISABLED_SCHOOL:
-                continue
-            match_area = sys_area[sys_area['name'] == school.areaName]
-            if len(match_area) > 1:
-                match_area = sys_area[
-                    (sys_area['name'] == school.areaName)
-                    & (sys_area['parent_name'] == school.cityName)
-                    ]
-            if len(match_area) != 1:
-                invalid_list.append(school)
-                continue
-            region_code = int(match_area.iloc[0]['code'])
-
-            stages = []
-            stage_list = school.periodName.split(',')
-            for stage in stage_list:
-                match_stage = sys_stage[sys_stage['stage_name'] == stage]
-                if len(match_stage) != 1:
-                    invalid_list.append(school)
+    @classmethod
+    def iter_school_batches(
+        cls,
+        fetcher: 'SchoolPageFetcher',
+        sys_area: AreaIndex,
+        sys_stage: Dict[str, str],
+        start_page: int = 1,
+        batch_size: int = settings.SYNC_SCHOOL_BATCH_SIZE,
+    ) -> Iterator[SchoolBatch]:
+        """
+        学校数据同步管道: 获取分页 -> 流式解析 -> 匹配所属地区、学段 -> 按行数分批
+        按页码顺序返回一批批学校数据，每批不超过 batch_size 行，
+        内存占用只与 batch_size、fetcher 的并发数有关，与每页数量无关
+        最后一批可能为空，只包含最后完成的分页
+
+        Raises
+        ------
+        SyncSchoolError : 某一页重试后仍获取失败，或响应报文格式错误，
+            抛出前先返回失败页之前已完成、尚未返回的分页
+        """
+        batch = SchoolBatch([], [], [])
+
+        def read(page: SchoolPage) -> Iterator[SchoolBatch]:
+            nonlocal batch
+            for school in fetcher.read(page):
+                if school.status == DISABLED_SCHOOL:
                     continue
-                stage_key = match_stage.iloc[0]['key']
-                stages.append(stage_key)
-            study_stage = ','.join(stages)
-
-            valid_list.append(
-                {
-                    'name': school.schoolName,
-                    'region_code': region_code,
-                    'address': school.address,
-                    'study_stage': study_stage,
-                    'school_id': school.schoolId,
-                    'parent_org_id': school.parentOrgId,
-                    'curr_cpscode': school.currCpscode,
-                    'data_source': DBConst.SYNC_FROM_API,
-                }
+                row, reason = cls.match_school(school, sys_area, sys_stage)
+                if row is None:
+                    batch.quarantined.append({
+                        'school_id': school.schoolId,
+                        'reason': reason,
+                        'data': school.dict(),
+                    })
+                else:
+                    batch.rows.append(row)
+                if batch.size >= batch_size:
+                    yield batch
+                    batch = SchoolBatch([], [], [])
+            batch.pages.append((page.page_no, page.total_page))
+
+        try:
+            # 起始页的响应中才有总页数
+            first = SchoolPage(start_page,
+                               fetcher.fetch(start_page, stream=True))
+            yield from read(first)
+            for page_no, resp in fetcher.iter_pages(
+                start_page + 1, first.total_page, stream=True
+            ):
+                yield from read(SchoolPage(page_no, resp))
+        except SyncSchoolError:
+            # 失败页之前已完成的分页先返回，调用方更新到数据库后可从失败页继续
+            if batch.pages:
+                yield batch
+            raise
+        yield batch
+
+    @staticmethod
+    def match_school(
+        school: SyncSchool, sys_area: AreaIndex, sys_stage: Dict[str, str]
+    ) -> Tuple[Optional[dict], Optional[str]]:
+        """
+        匹配学校的 所属地区、学段，返回 (待更新到数据库的学校数据, None)，
+        无法识别时返回 (None, 原因)，原因见 DBConst.AREA_NOT_FOUND 等
+        """
+        codes = sys_area.candidates(school.areaName, school.cityName)
+        if not codes:
+            return None, DBConst.AREA_NOT_FOUND
+        if len(codes) > 1:
+            return None, DBConst.AREA_AMBIGUOUS
+
+        stages = []
+        for stage in school.periodName.split(','):
+            stage_key = sys_stage.get(stage)
+            if stage_key is None:
+                return None, DBConst.STAGE_NOT_FOUND
+            stages.append(stage_key)
+
+        return {
+            'name': school.schoolName,
+            'region_code': codes[0],
+            'address': school.address,
+            'study_stage': ','.join(stages),
+            'school_id': school.schoolId,
+            'parent_org_id': school.parentOrgId,
+            'curr_cpscode': school.currCpscode,
+            'data_source': DBConst.SYNC_FROM_API,
+        }, None
+
+    @staticmethod
+    def _copy_batch(batch: SchoolBatch, counts: Counter) -> bytes:
+        """
+        一批学校数据转换为 COPY 文本格式
+        """
+        lines = []
+        for school in batch.rows:
+            values = [True, school['school_id']]
+            values.extend(school[field] for field in SYNCED_SCHOOL_FIELDS)
+            values.extend((None, None))
+            lines.append('\t'.join(map(copy_text, values)))
+        for school in batch.quarantined:
+            values = [False, school['school_id']]
+            values.extend([None] * len(SYNCED_SCHOOL_FIELDS))
+            values.append(school['reason'])
+            values.append(json.dumps(school['data'], ensure_ascii=False))
+            lines.append('\t'.join(map(copy_text, values)))
+        counts['rows'] += len(lines)
+        counts['quarantined'] += len(batch.quarantined)
+        data = ''.join(line + '\n' for line in lines)
+        return data.encode('utf8')
+
+    @staticmethod
+    def update_quarantine(
+        db: Session, batch: SchoolBatch, run_id: str
+    ) -> None:
+        """
+        一批学校中无法识别的学校写入 school_quarantine 表，已识别的学校移出该表
+        school_id 已存在且为同一次同步写入的不再更新，每所学校每次同步只写入一次
+        """
+        if batch.rows:
+            db.query(SchoolQuarantine).filter(SchoolQuarantine.school_id.in_(
+                [school['school_id'] for school in batch.rows]
+            )).delete(synchronize_session=False)
+        if batch.quarantined:
+            # 同一批中重复的学校只保留第一个，同一语句不能更新同一行两次
+            values = {}
+            for school in batch.quarantined:
+                values.setdefault(school['school_id'],
+                                  dict(school, run_id=run_id))
+            upsert = insert(SchoolQuarantine).values(list(values.values()))
+            excluded = upsert.excluded
+            upsert = upsert.on_conflict_do_update(
+                index_elements=[SchoolQuarantine.school_id],
+                set_={
+                    'reason': excluded.reason,
+                    'data': excluded.data,
+                    'run_id': excluded.run_id,
+                    'update_time': text('CURRENT_TIMESTAMP'),
+                },
+                where=SchoolQuarantine.run_id != excluded.run_id,
             )
-        # 无法识别的学校数据记录日志
-        if invalid_list:
-            logger.error(f'Unrecognized school data in synchronization: '
-                         f'{invalid_list}\nraw API message: {resp.text}')
-        return total_page, valid_list
+            db.execute(upsert)
+        db.commit()
+
+    @staticmethod
+    def _log_quarantined(run_id: str, reasons: Counter) -> None:
+        if not reasons:
+            return
+        summary = ' '.join(
+            f'{QUARANTINE_REASONS.get(reason, reason)}={count}'
+            for reason, count in sorted(reasons.items())
+        )
+        logger.warning(f'unrecognized schools quarantined, run_id={run_id} '
+                       f'total={sum(reasons.values())} {summary}')
 
     @staticmethod
     def update_school_data(
         db: Session, school_list: List[dict]
-    ) -> None:
+    ) -> Counter:
         """
-        更新学校数据到数据库
+        更新学校数据到数据库，返回 新增、更新、未变化 的学校数
         该部分数据来源于 API网关同步，school_id 是学校数据在数据源端的唯一标识
         school_id 字段有唯一索引
-        如果 school_id 已存在则更新该条记录的数据，如不存在则插入新记录
+        如果 school_id 已存在且同步字段有变化则更新该条记录的数据，如不存在则插入新记录，
+        同步字段均未变化的记录不更新，不产生新的行版本
+        school_list 中 school_id 重复的学校以最后一个为准，只计数一次
         """
+        counts = Counter(inserted=0, updated=0, unchanged=0)
+        if not school_list:
+            return counts
+        # 一批可能包含多页的数据，重复的学校只保留最后一个（与逐页更新的结果一致），
+        # 同一语句不能更新同一行两次
+        school_list = list({
+            school['school_id']: school for school in school_list
+        }.values())
         batch_upsert = insert(School).values(school_list)
+        excluded = batch_upsert.excluded
+        set_ = {field: excluded[field] for field in SYNCED_SCHOOL_FIELDS}
+        set_['update_time'] = text('CURRENT_TIMESTAMP')
         batch_upsert = batch_upsert.on_conflict_do_update(
             index_elements=[School.school_id],
-            set_={
-                'name': batch_upsert.excluded.name,
-                'region_code': batch_upsert.excluded.region_code,
-                'address': batch_upsert.excluded.address,
-                'study_stage': batch_upsert.excluded.study_stage,
-                'parent_org_id': batch_upsert.excluded.parent_org_id,
-                'curr_cpscode': batch_upsert.excluded.curr_cpscode,
-                'data_source': batch_upsert.excluded.data_source,
-                'update_time': text('CURRENT_TIMESTAMP'),
-            }
+            set_=set_,
+            where=tuple_(
+                *(School.__table__.c[field] for field in SYNCED_SCHOOL_FIELDS)
+            ).is_distinct_from(
+                tuple_(*(excluded[field] for field in SYNCED_SCHOOL_FIELDS))
+            ),
+        ).returning(
+            # 新插入的行 xmax 为 0，未变化的行不会返回
+            literal_column('xmax = 0').label('inserted')
         )
-        db.execute(batch_upsert)
+        rows = db.execute(batch_upsert).all()
         db.commit()
+        inserted = sum(1 for row in rows if row.inserted)
+        counts['inserted'] = inserted
+        counts['updated'] = len(rows) - inserted
+        counts['unchanged'] = len(school_list) - len(rows)
+        return counts
+
+
+class SchoolPageFetcher(object):
+    """
+    并发获取 API网关 学校数据分页
+    所有请求复用同一个会话的长连接，同时进行中的请求数不超过 concurrency，
+    请求失败、读取响应体失败时退避重试，iter_pages 按页码顺序返回响应
+
+    统计项:
+        request : 请求次数
+        retry   : 重试次数
+    """
+    def __init__(
+        self,
+        url: str = settings.SYNC_SCHOOL_URL,
+        page_size: int = settings.SYNC_SCHOOL_PAGE_SIZE,
+        concurrency: int = settings.SYNC_SCHOOL_CONCURRENCY,
+        max_retries: int = settings.SYNC_SCHOOL_MAX_RETRIES,
+        backoff: float = 0.5,
+    ) -> None:
+        self.url = url
+        self.page_size = page_size
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.stats = Stats('sync_school_fetch')
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def fetch(self, page_no: int, stream: bool = False) -> requests.Response:
+        """
+        获取一页学校数据，网络错误、超时、HTTP 错误状态码时重试
+        stream 为真时只读取响应头，响应体由调用方读取，读取完或关闭响应后连接才归还连接池
+
+        Raises
+        ------
+        SyncSchoolError : 重试 max_retries 次后仍失败
+        """
+        for attempt in range(self.max_retries + 1):
+            self.stats.incr('request')
+            try:
+                resp = APIGateway.list_school(
+                    self.page_size, page_no, session=self.session,
+                    url=self.url, stream=stream,
+                )
+                if not resp.ok:
+                    resp.close()
+                resp.raise_for_status()
+                return resp
+            except requests.RequestException as e:
+                if attempt == self.max_retries:
+                    raise SyncSchoolError(
+                        f'fetch school page {page_no} failed: '
+                        f'{e.__class__.__name__}'
+                    ) from e
+                logger.warning(f'fetch school page {page_no} failed, '
+                               f'attempt={attempt + 1} '
+                               f'error={e.__class__.__name__}')
+            self.stats.incr('retry')
+            time.sleep(self.backoff * 2 ** attempt)
+
+    def read(self, page: SchoolPage) -> Iterator[SyncSchool]:
+        """
+        流式读取一页学校数据，读取响应体失败或响应报文格式错误时重新获取该页，
+        跳过已返回的学校继续读取，与 fetch 一样最多重试 max_retries 次
+
+        Raises
+        ------
+        SyncSchoolError : 重试 max_retries 次后仍失败
+        """
+        returned = 0
+        for attempt in range(self.max_retries + 1):
+            try:
+                for i, school in enumerate(page):
+                    if i >= returned:
+                        returned += 1
+                        yield school
+                return
+            except SyncSchoolError as e:
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(f'read school page {page.page_no} failed, '
+                               f'attempt={attempt + 1} error={e}')
+            self.stats.incr('retry')
+            time.sleep(self.backoff * 2 ** attempt)
+            page.resp = self.fetch(page.page_no, stream=True)
+
+    def iter_pages(
+        self, start: int, end: int, stream: bool = False
+    ) -> Iterator[Tuple[int, requests.Response]]:
+        """
+        并发获取 start 至 end 页（包含 end），按页码顺序返回 (页码, 响应)
+        调用方处理当前页时，后续 concurrency 页在后台获取
+        某一页获取失败时，在按顺序返回到该页时抛出 SyncSchoolError，不再返回后续分页
+        stream 为真时后台只获取响应头，未读取的响应体留在连接中
+        """
+        page_numbers = iter(range(start, end + 1))
+        with ThreadPoolExecutor(self.concurrency) as executor:
+            pending = deque()
+
+            def submit_next() -> None:
+                page_no = next(page_numbers, None)
+                if page_no is not None:
+                    pending.append(
+                        (page_no,
+                         executor.submit(self.fetch, page_no, stream))
+                    )
+
+            for _ in range(self.concurrency):
+                submit_next()
+            try:
+                while pending:
+                    page_no, future = pending.popleft()
+                    resp = future.result()
+                    submit_next()
+                    yield page_no, resp
+            finally:
+                # 不再返回的响应关闭，归还连接
+                for _, future in pending:
+                    if not future.cancel():
+                        future.add_done_callback(_close_response)
+
+
+def _close_response(future: Future) -> None:
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+class ResumableSchoolSync(object):
+    """
+    可从中断处继续的学校数据同步，供定时任务调用
+    每页更新到数据库后，在 Redis 中保存同步进度（运行id、最后完成的页码、已同步的学校数），
+    同步中断后再次运行时从下一页继续，同步完成后删除进度
+    同一时间只有一个同步在运行，锁的过期时间在每页完成后重置
+    """
+    CHECKPOINT_KEY = 'school_sync_checkpoint'
+    LOCK_KEY = 'school_sync_lock'
+    COUNT_FIELDS = ('inserted', 'updated', 'unchanged', 'quarantined')
+
+    def __init__(
+        self, redis_: Redis, lock_timeout: int, checkpoint_expire: int
+    ) -> None:
+        self.redis = redis_
+        self.lock_timeout = lock_timeout
+        self.checkpoint_expire = checkpoint_expire
+
+    def run(
+        self, db: Session, fetcher: Optional['SchoolPageFetcher'] = None
+    ) -> Optional[Counter]:
+        """
+        运行同步，返回本轮同步（包括中断前）新增、更新、未变化的学校数，
+        已有同步在运行时返回 None
+        """
+        lock = self.redis.lock(self.LOCK_KEY, timeout=self.lock_timeout)
+        if not lock.acquire(blocking=False):
+            logger.warning('school data synchronization is already running')
+            return None
+        try:
+            run_id, start_page, previous = self.load_checkpoint()
+            logger.info(f'school data synchronization started, '
+                        f'run_id={run_id} start page={start_page}')
+
+            def on_page(page_no: int, total_page: int, counts: Counter):
+                total = previous.copy()
+                total.update(counts)
+                self.redis.hset(self.CHECKPOINT_KEY, mapping={
+                    'run_id': run_id,
+                    'last_page': page_no,
+                    'total_page': total_page,
+                    **{field: total[field] for field in self.COUNT_FIELDS},
+                })
+                self.redis.expire(self.CHECKPOINT_KEY, self.checkpoint_expire)
+                lock.reacquire()
+
+            counts = APIGateway.sync_school_data(
+                db, fetcher, start_page=start_page, on_page=on_page,
+                run_id=run_id,
+            )
+            self.redis.delete(self.CHECKPOINT_KEY)
+            total = previous.copy()
+            total.update(counts)
+            logger.info(f'school data synchronization finished, '
+                        f'run_id={run_id} counts={dict(total)}')
+            return total
+        finally:
+            try:
+                lock.release()
+            except LockError:
+                logger.warning('school data synchronization lock expired')
+
+    def load_checkpoint(self) -> Tuple[str, int, Counter]:
+        """
+        读取同步进度，返回 (运行id, 起始页码, 已同步的学校数)，没有进度时开始新的同步
+        """
+        checkpoint = self.redis.hgetall(self.CHECKPOINT_KEY)
+        if not checkpoint:
+            return uuid4().hex, 1, Counter()
+        previous = Counter({
+            field: int(checkpoint.get(field, 0)) for field in self.COUNT_FIELDS
+        })
+        return (
+            checkpoint['run_id'], int(checkpoint['last_page']) + 1, previous
+        )
+
+
+school_sync = ResumableSchoolSync(
+    redis,
+    lock_timeout=settings.SYNC_SCHOOL_LOCK_SECONDS,
+    checkpoint_expire=settings.SYNC_SCHOOL_CHECKPOINT_EXPIRE_SECONDS,
+)
 
 
 if __name__ == '__main__':
     from app.db.session import SessionLocal
 
-    pd.set_option('display.max_rows', 50)
-    pd.set_option('display.max_columns', 500)
-    pd.set_option('display.width', 1000)
-
     session = SessionLocal()
     APIGateway.sync_school_data(session)
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Date: 2021/9/3
+# Author: gray
+
+"""
+接口限流
+按接口配置限流策略，以用户id或客户端IP为维度，在 Redis 有序集合上实现滑动窗口，
+每个请求一次 Lua 脚本调用；以纯 ASGI 中间件实现，被拒绝的请求不进入路由，
+不解析请求体，不创建数据库会话
+"""
+
+import ipaddress
+import re
+import secrets
+from typing import Iterable, List, NamedTuple, Optional, Pattern, Tuple
+
+from jose import JWTError
+from loguru import logger
+from pydantic import ValidationError
+from redis.asyncio import Redis as AsyncRedis
+from redis.exceptions import RedisError
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app import schemas
+from app.constants import RespError
+from app.core import security
+from app.core.config import settings
+from app.core.stats import Stats
+from app.db.async_redis import async_redis
+
+
+# 滑动窗口，时间取 Redis 服务器时间（微秒），各进程、各主机的时钟偏差不影响计数
+# 窗口内请求数未达上限时记录本次请求，返回 {1, 剩余次数}；
+# 否则不记录，返回 {0, 最早的请求移出窗口所需的秒数}
+SLIDING_WINDOW = """
+local now = redis.call('TIME')
+local now_us = tonumber(now[1]) * 1000000 + tonumber(now[2])
+local window_us = tonumber(ARGV[1]) * 1000000
+local limit = tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now_us - window_us)
+local count = redis.call('ZCARD', KEYS[1])
+if count < limit then
+    redis.call('ZADD', KEYS[1], now_us, now_us .. ARGV[3])
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+    return {1, limit - count - 1}
+end
+local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+return {0, math.ceil((tonumber(oldest[2]) + window_us - now_us) / 1000000)}
+"""
+
+
+class RatePolicy(NamedTuple):
+    """
+    限流策略
+
+    Attributes
+    ----------
+    name : 策略名，用于 Redis key 和统计项，多个接口使用同一策略时共享计数
+    limit : 窗口时间内的请求数上限
+    window : 窗口时长，秒
+    by_user : 是否按用户id限流，否则按客户端IP；请求无有效Token时按客户端IP
+    """
+    name: str
+    limit: int
+    window: int
+    by_user: bool = True
+
+
+class RateLimiter(object):
+    """
+    接口限流器
+    按 (请求方法, 路径模板) 匹配限流策略，路径模板中的 {参数} 匹配任意一段路径
+    Redis 不可用、未启用（enabled 为 False）时不限流
+    服务部署在反向代理之后，来自 trusted_proxies 的请求按 X-Forwarded-For（没有时按
+    X-Real-IP）确定客户端IP，从右向左跳过可信代理，取第一个不可信的地址
+
+    统计项（由 stats_reporter 定期写入日志）:
+        allowed : 放行
+        limited : 拒绝
+        limited_{策略名} : 该策略拒绝
+        redis_error : Redis不可用
+    """
+    KEY_PREFIX = 'rate_limit_'
+
+    def __init__(
+        self, redis_: AsyncRedis, enabled: bool = True,
+        trusted_proxies: Iterable[str] = (),
+    ) -> None:
+        self.enabled = enabled
+        self.trusted_proxies = [ipaddress.ip_network(proxy, strict=False)
+                                for proxy in trusted_proxies]
+        self.stats = Stats('rate_limit')
+        self._script = redis_.register_script(SLIDING_WINDOW)
+        self._routes: List[Tuple[str, Pattern, RatePolicy]] = []
+
+    def add(self, method: str, path: str, policy: RatePolicy) -> None:
+        """
+        为接口添加限流策略
+        """
+        pattern = re.compile(
+            re.sub(r'\\{\w+\\}', '[^/]+', re.escape(path)) + '$'
+        )
+        self._routes.append((method.upper(), pattern, policy))
+
+    def match(self, method: str, path: str) -> Optional[RatePolicy]:
+        """
+        返回接口的限流策略，未配置或未启用时返回 None
+        """
+        if not self.enabled:
+            return None
+        for method_, pattern, policy in self._routes:
+            if method_ == method and pattern.match(path):
+                return policy
+        return None
+
+    async def hit(
+        self, policy: RatePolicy, identity: str
+    ) -> Tuple[bool, int]:
+        """
+        记录一次请求，返回 (是否放行, 放行时为剩余次数，拒绝时为建议重试的等待秒数)
+        """
+        try:
+            allowed, value = await self._script(
+                keys=[f'{self.KEY_PREFIX}{policy.name}_{identity}'],
+                args=[policy.window, policy.limit, secrets.token_hex(4)],
+            )
+        except RedisError:
+            self.stats.incr('redis_error')
+            logger.warning(f'rate limit failed, policy={policy.name}')
+            return True, policy.limit
+        if allowed:
+            self.stats.incr('allowed')
+        else:
+            self.stats.incr('limited')
+            self.stats.incr(f'limited_{policy.name}')
+        return bool(allowed), int(value)
+
+    def identify(self, scope: Scope, policy: RatePolicy) -> str:
+        """
+        返回限流维度，按用户限流且请求携带有效Token时为 user_{用户id}，否则为 ip_{客户端IP}
+        Token只校验签名和过期时间（与 deps.decode_token 一致，结果缓存在进程内），不查询数据库
+        """
+        if policy.by_user:
+            for name, value in scope['headers']:
+                if name != b'authorization':
+                    continue
+                scheme, _, token = value.decode('latin-1').partition(' ')
+                if scheme.lower() != 'bearer' or not token:
+                    break
+                try:
+                    payload = security.decode_access_token(token)
+                except (JWTError, ValidationError):
+                    break
+                return f'user_{payload.sub}'
+        return f'ip_{self.client_ip(scope)}'
+
+    def client_ip(self, scope: Scope) -> str:
+        """
+        返回客户端IP，直接连接的地址不是可信代理时不读取转发请求头
+        """
+        client = scope.get('client')
+        ip = client[0] if client else 'unknown'
+        if not self._is_trusted(ip):
+            return ip
+        forwarded_for = real_ip = None
+        for name, value in scope['headers']:
+            if name == b'x-forwarded-for':
+                # 多个同名请求头按顺序拼接
+                forwarded_for = value if forwarded_for is None \
+                    else forwarded_for + b',' + value
+            elif name == b'x-real-ip':
+                real_ip = value
+        if forwarded_for is not None:
+            hops = [hop.strip() for hop in
+                    forwarded_for.decode('latin-1').split(',') if hop.strip()]
+            for hop in reversed(hops):
+                ip = hop
+                if not self._is_trusted(hop):
+                    break
+        elif real_ip is not None:
+            ip = real_ip.decode('latin-1').strip() or ip
+        return ip
+
+    def _is_trusted(self, ip: str) -> bool:
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return False
+        return any(address in network for network in self.trusted_proxies)
+
+
+class RateLimitMiddleware(object):
+    """
+    限流中间件，超过限流策略的请求返回 USER_REQUESTS_TOO_FREQUENTLY，
+    响应头 Retry-After 为建议重试的等待秒数
+    """
+    def __init__(self, app: ASGIApp, limiter: RateLimiter) -> None:
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        policy = self.limiter.match(scope['method'], scope['path'])
+        if policy is None:
+            return await self.app(scope, receive, send)
+        identity = self.limiter.identify(scope, policy)
+        allowed, value = await self.limiter.hit(policy, identity)
+        if allowed:
+            return await self.app(scope, receive, send)
+        logger.warning(f'rate limited, policy={policy.name} {identity} '
+                       f'{scope["method"]} {scope["path"]}')
+        response = schemas.Response(
+            *RespError.USER_REQUESTS_TOO_FREQUENTLY,
+            headers={'Retry-After': str(value)},
+        )
+        await response(scope, receive, send)
+
+
+def create_rate_limiter(redis_: AsyncRedis = async_redis) -> RateLimiter:
+    """
+    按配置创建限流器
+    """
+    limiter = RateLimiter(redis_, enabled=settings.RATE_LIMIT_ENABLED,
+                          trusted_proxies=settings.RATE_LIMIT_TRUSTED_PROXIES)
+    prefix = settings.CLASS_MANAGER_STR
+    window = settings.RATE_LIMIT_WINDOW_SECONDS
+    login = RatePolicy('login', settings.RATE_LIMIT_LOGIN, window,
+                       by_user=False)
+    join_request = RatePolicy('join_request',
+                              settings.RATE_LIMIT_JOIN_REQUEST, window)
+    class_code_query = RatePolicy('class_code_query',
+                                  settings.RATE_LIMIT_CLASS_CODE_QUERY, window)
+    sms_captcha = RatePolicy('sms_captcha',
+                             settings.RATE_LIMIT_SMS_CAPTCHA, window)
+    limiter.add('GET', f'{prefix}/access_tokens/{{code}}', login)
+    limiter.add('POST', f'{prefix}/classes/teachers/join_request',
+                join_request)
+    limiter.add('POST', f'{prefix}/classes/students/join_request',
+                join_request)
+    limiter.add('POST', f'{prefix}/classes/class_codes/query',
+                class_code_query)
+    limiter.add('POST', f'{prefix}/users/telephone/sms_captcha/request',
+                sms_captcha)
+    return limiter
+
+
+rate_limiter = create_rate_limiter()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Date: 2021/8/31
+# Author: gray
+
+"""
+基础数据注册表
+学科、系统配置、全国地区等极少变更的基础数据，启动时加载到进程内，数据不可变，
+Redis 中的版本号增加后重新加载
+"""
+
+import threading
+import time
+from types import MappingProxyType
+from typing import Callable, FrozenSet, Mapping, Optional, Tuple
+
+from loguru import logger
+from redis import Redis
+from redis.exceptions import RedisError
+from sqlalchemy.orm import Session
+
+from app import crud
+from app.core.config import settings
+from app.core.stats import Stats
+from app.db.redis import redis
+from app.db.session import SessionLocal
+
+
+class ReferenceData(object):
+    """
+    一个版本的基础数据，创建后不再修改
+
+    Attributes
+    ----------
+    version : 加载时的版本号
+    subjects : 未删除的学科，[{'code': 学科id, 'name': 学科名}]
+    subject_ids : 未删除的学科id
+    configs : 按配置类型（DBConst）分组的系统配置项，{type: [{'key': key, 'value': value}]}
+    config_keys : 按配置类型（DBConst）分组的系统配置项key，{type: {key}}
+    areas : 区县级行政区，{编码: (名称, 父级行政区名称)}
+    """
+    def __init__(
+        self, version: int, subjects: list, configs: list, areas: list
+    ) -> None:
+        self.version = version
+        self.subjects: Tuple[Mapping, ...] = tuple(
+            MappingProxyType({'code': code, 'name': name})
+            for code, name in subjects
+        )
+        self.subject_ids: FrozenSet[int] = frozenset(
+            subject['code'] for subject in self.subjects
+        )
+
+        grouped = {}
+        for type_, key, value in configs:
+            grouped.setdefault(str(type_), []).append(
+                MappingProxyType({'key': key, 'value': value})
+            )
+        self.configs: Mapping[str, Tuple[Mapping, ...]] = MappingProxyType({
+            type_: tuple(items) for type_, items in grouped.items()
+        })
+        self.config_keys: Mapping[str, FrozenSet[str]] = MappingProxyType({
+            type_: frozenset(item['key'] for item in items)
+            for type_, items in self.configs.items()
+        })
+
+        self.areas: Mapping[int, Tuple[str, str]] = MappingProxyType({
+            int(code): (name, parent_name)
+            for code, name, parent_name in areas
+        })
+
+    def get_configs(self, type_: str) -> Tuple[Mapping, ...]:
+        """
+        获取配置类型对应的所有配置项
+        """
+        return self.configs.get(type_, ())
+
+    def config_exists(self, type_: str, key: str) -> bool:
+        """
+        配置类型下是否存在 key 对应的配置项
+        """
+        return key in self.config_keys.get(type_, ())
+
+    def area_exists(self, code: int) -> bool:
+        """
+        是否存在编码对应的区县级行政区
+        """
+        return code in self.areas
+
+
+class ReferenceRegistry(object):
+    """
+    基础数据注册表，线程安全
+    get 最多每 check_interval 秒读取一次 Redis 中的版本号，
+    版本号与已加载数据的版本号不一致时重新加载，重新加载期间其他线程继续使用旧数据
+    Redis 不可用时继续使用已加载的数据
+    基础数据变更后须调用 bump，或执行 INCR {version_key}
+
+    统计项:
+        load : 加载次数
+        redis_error : Redis不可用
+    """
+    def __init__(
+        self, redis_: Redis, version_key: str, check_interval: float,
+        session_factory: Callable[[], Session] = SessionLocal,
+    ) -> None:
+        self.redis = redis_
+        self.version_key = version_key
+        self.check_interval = check_interval
+        self.stats = Stats('reference')
+        self._session_factory = session_factory
+        self._data: Optional[ReferenceData] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> ReferenceData:
+        """
+        获取当前版本的基础数据
+        """
+        data = self._data
+        now = time.monotonic()
+        if data is not None and now - self._checked_at < self.check_interval:
+            return data
+        version = self._get_version()
+        if data is not None and (version is None or version == data.version):
+            self._checked_at = now
+            return data
+        with self._lock:
+            # 等待锁期间其他线程可能已重新加载
+            data = self._data
+            if data is None or (version is not None
+                                and version != data.version):
+                data = self.load(version or 0)
+            self._checked_at = now
+            return data
+
+    def load(self, version: Optional[int] = None) -> ReferenceData:
+        """
+        从数据库加载基础数据，version 为空时读取 Redis 中的版本号
+        """
+        if version is None:
+            version = self._get_version() or 0
+        with self._session_factory() as db:
+            data = ReferenceData(
+                version,
+                subjects=crud.subject.all(db),
+                configs=crud.sys_config.all(db),
+                areas=crud.region.get_area_tree(db),
+            )
+        self._data = data
+        self.stats.incr('load')
+        logger.info(f'reference data loaded, version={version} '
+                    f'subjects={len(data.subjects)} areas={len(data.areas)}')
+        return data
+
+    def bump(self) -> None:
+        """
+        版本号加一，各进程最多在 check_interval 秒后重新加载
+        """
+        try:
+            self.redis.incr(self.version_key)
+        except RedisError:
+            self.stats.incr('redis_error')
+            logger.error(f'bump reference data version failed, '
+                         f'key={self.version_key}')
+        self._checked_at = 0.0
+
+    def _get_version(self) -> Optional[int]:
+        try:
+            return int(self.redis.get(self.version_key) or 0)
+        except RedisError:
+            self.stats.incr('redis_error')
+            logger.warning(f'read reference data version failed, '
+                           f'key={self.version_key}')
+            return None
+
+
+reference = ReferenceRegistry(
+    redis,
+    version_key='reference_version',
+    check_interval=settings.REFERENCE_DATA_CHECK_SECONDS,
+)
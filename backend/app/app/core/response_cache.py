@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Date: 2021/8/31
+# Author: gray
+
+"""
+进程内响应缓存
+缓存序列化后的 JSON 响应体，按 Redis 中的内容版本号失效，支持 ETag / If-None-Match
+"""
+
+import hashlib
+import json
+from typing import Any, Callable, Dict, Hashable, NamedTuple, Optional
+
+from fastapi.encoders import jsonable_encoder
+from loguru import logger
+from redis import Redis
+from redis.exceptions import RedisError
+from starlette.requests import Request
+from starlette.responses import Response
+
+from app.core.cache import LocalCache
+from app.core.config import settings
+from app.core.stats import Stats
+from app.db.redis import redis
+
+
+class CachedResponse(NamedTuple):
+    """
+    缓存的响应，version 为生成响应体时的内容版本号
+    """
+    version: Optional[int]
+    body: bytes
+    etag: str
+
+
+class ResponseCache(object):
+    """
+    进程内响应缓存
+    同一 key 的响应体只在内容版本号变化后重新查询、序列化，ETag 为响应体的摘要，
+    请求头 If-None-Match 与 ETag 一致时返回 304，不查询数据库
+
+    内容版本号保存在 Redis 中，数据变更后须调用 bump 使版本号加一，
+    各进程最多每 version_ttl 秒读取一次版本号，即其他进程的缓存最多在 version_ttl 秒后失效
+    Redis 不可用时不使用缓存，每次请求都查询数据库
+
+    统计项:
+        hit  : 缓存命中
+        miss : 缓存未命中，查询数据库
+        not_modified : 返回 304
+        redis_error  : Redis不可用
+    """
+    def __init__(
+        self, name: str, redis_: Redis, version_key: str,
+        version_ttl: float, max_age: int,
+    ) -> None:
+        self.redis = redis_
+        self.version_key = version_key
+        self.max_age = max_age
+        self.stats = Stats(name)
+        self._version = LocalCache(f'{name}_version', maxsize=1,
+                                   ttl=version_ttl)
+        self._entries: Dict[Hashable, CachedResponse] = {}
+
+    def response(
+        self,
+        request: Request,
+        key: Hashable,
+        loader: Callable[[], Any],
+        private: bool = False,
+    ) -> Response:
+        """
+        返回 key 对应的响应，缓存失效时调用 loader 查询数据
+
+        Parameters
+        ----------
+        request : 请求，读取请求头 If-None-Match
+        key : 缓存key，同一路径不同查询参数的响应应使用不同的key
+        loader : 查询响应数据的函数
+        private : 响应是否只能由客户端缓存（需要鉴权的接口）
+        """
+        version = self.get_version()
+        entry = self._entries.get(key)
+        if entry is not None and version is not None \
+                and entry.version == version:
+            self.stats.incr('hit')
+        else:
+            self.stats.incr('miss')
+            entry = self._serialize(version, loader())
+            if version is not None:
+                self._entries[key] = entry
+
+        scope = 'private' if private else 'public'
+        headers = {
+            'ETag': entry.etag,
+            'Cache-Control': f'{scope}, max-age={self.max_age}',
+        }
+        if self._is_not_modified(request, entry.etag):
+            self.stats.incr('not_modified')
+            return Response(status_code=304, headers=headers)
+        return Response(entry.body, media_type='application/json',
+                        headers=headers)
+
+    def get_version(self) -> Optional[int]:
+        """
+        获取内容版本号，Redis 不可用时返回 None
+        """
+        version = self._version.get(self.version_key)
+        if version is not None:
+            return version
+        try:
+            version = int(self.redis.get(self.version_key) or 0)
+        except RedisError:
+            self.stats.incr('redis_error')
+            logger.warning(f'read response cache version failed, '
+                           f'key={self.version_key}')
+            return None
+        self._version.set(self.version_key, version)
+        return version
+
+    def bump(self) -> None:
+        """
+        内容版本号加一，须在数据库事务提交后调用
+        """
+        self._version.clear()
+        try:
+            self.redis.incr(self.version_key)
+        except RedisError:
+            self.stats.incr('redis_error')
+            logger.error(f'bump response cache version failed, '
+                         f'key={self.version_key}')
+
+    def clear(self) -> None:
+        self._version.clear()
+        self._entries.clear()
+
+    @staticmethod
+    def _serialize(version: Optional[int], data: Any) -> CachedResponse:
+        # 与 JSONResponse 的序列化方式一致
+        body = json.dumps(
+            jsonable_encoder(data), ensure_ascii=False, allow_nan=False,
+            indent=None, separators=(',', ':'),
+        ).encode('utf8')
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        return CachedResponse(version, body, etag)
+
+    @staticmethod
+    def _is_not_modified(request: Request, etag: str) -> bool:
+        if_none_match = request.headers.get('if-none-match')
+        if not if_none_match:
+            return False
+        for tag in if_none_match.split(','):
+            tag = tag.strip()
+            if tag.startswith('W/'):
+                tag = tag[2:]
+            if tag == '*' or tag == etag:
+                return True
+        return False
+
+
+# 启动页、引导页图片，首页菜单
+pages_cache = ResponseCache(
+    'pages',
+    redis,
+    version_key='pages_version',
+    version_ttl=settings.PAGES_CACHE_VERSION_SECONDS,
+    max_age=settings.PAGES_CACHE_MAX_AGE_SECONDS,
+)
@@ -3,14 +3,19 @@
 """
 
 import base64
+import hashlib
 import json
+import time
 from datetime import datetime, timedelta
-from typing import Any, Union
+from typing import Any, Iterable, List, NamedTuple, Optional, Union
 
 from Crypto.Cipher import AES
-from jose import jwt
+from Crypto.Util.Padding import pad
+from jose import jwk, jwt
 from passlib.context import CryptContext
 
+from app import schemas
+from app.core.cache import LocalCache
 from app.core.config import settings
 
 
@@ -18,13 +23,23 @@ pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
 
 ALGORITHM = 'HS256'
 BLOCK_SIZE = 16  # Bytes
+ISSUER = 'PrimarySchoolDigitalTeachingCenter'
+AUDIENCE = 'ClassManager'
+
+# 已校验的Token，key 为Token的摘要，value 为校验后的 TokenPayload
+token_cache = LocalCache(
+    'access_token',
+    maxsize=settings.ACCESS_TOKEN_CACHE_SIZE,
+    ttl=settings.ACCESS_TOKEN_CACHE_SECONDS,
+)
 
 
 def create_access_token(
         subject: Union[str, Any],
         flag: str,
         sub_sign: str,
-        expires_delta: timedelta = None
+        expires_delta: timedelta = None,
+        context: Optional[schemas.MemberContextClaim] = None,
 ) -> str:
     """
     生成 JWT Token
@@ -38,6 +53,7 @@ def create_access_token(
         'sub': 主体，此处即用户id,
         'flag': 加密后的 open_id
         'sub_sign': 加密后的 session_key
+        'ctx': 用户上下文，可选，{'mid': 当前班级成员id, 'dis': 是否停用, 'ver': 版本号}
     }
     """
     if expires_delta:
@@ -47,19 +63,135 @@ def create_access_token(
             minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES
         )
     to_encode = {
-        'iss': 'PrimarySchoolDigitalTeachingCenter',
-        'aud': 'ClassManager',
+        'iss': ISSUER,
+        'aud': AUDIENCE,
         'exp': expire,
         'sub': str(subject),
         'flag': flag,
         'sub_sign': sub_sign,
     }
+    if context is not None:
+        to_encode['ctx'] = context.dict()
     encoded_jwt = jwt.encode(
         to_encode, settings.SECRET_KEY, algorithm=ALGORITHM
     )
     return encoded_jwt
 
 
+def decode_access_token(token: str) -> schemas.TokenPayload:
+    """
+    校验并解析 JWT Token，返回 Token payload
+    校验通过的Token缓存在进程内，缓存时间不超过Token的过期时间，
+    同一Token再次校验时跳过签名校验和 payload 结构校验
+
+    Raises
+    ------
+    jwt.ExpiredSignatureError : Token已过期
+    jwt.JWTError : Token无效
+    pydantic.ValidationError : Token payload 结构不正确
+    """
+    digest = hashlib.sha256(token.encode('utf8')).digest()
+    payload = token_cache.get(digest)
+    if payload is None:
+        claims = jwt.decode(
+            token, settings.SECRET_KEY,
+            algorithms=[ALGORITHM], audience=AUDIENCE
+        )
+        payload = schemas.TokenPayload(**claims)
+        ttl = min(claims.get('exp', 0) - time.time(), token_cache.ttl)
+        if ttl > 0:
+            token_cache.set(digest, payload, ttl=ttl)
+    # 调用方会修改返回的 payload（如 user 字段），返回副本
+    return payload.copy()
+
+
+class TokenClaims(NamedTuple):
+    """
+    签发Token所需的用户数据
+    """
+    user_id: int
+    openid: str
+    session_key: str
+    context: Optional[schemas.MemberContextClaim] = None
+
+
+class TokenIssuer(object):
+    """
+    Token 签发器，签发结果与 AESCrypto.encrypt + create_access_token 一致
+    AES 密钥、iv 在创建时转换为 bytes，JWT 签名密钥在创建时构造为 jose 的 HMAC 密钥对象，
+    签发时不再重复转换、构造
+    issue_many 批量签发，一批Token使用同一过期时间，用于批量重新签发等场景
+    """
+    def __init__(
+        self, secret_key: str, aes_key: str, aes_iv: str,
+        expires_delta: timedelta,
+    ) -> None:
+        self.expires_delta = expires_delta
+        self._aes_key = aes_key.encode('utf8')
+        self._aes_iv = aes_iv.encode('utf8')
+        self._signing_key = jwk.construct(secret_key, ALGORITHM)
+
+    def encrypt(self, raw: str) -> str:
+        """
+        AES加密，CBC模式，PKCS7补位，返回Base64编码的字符串
+        """
+        # CBC 模式加密器保存分组间状态，每次加密新建
+        cipher = AES.new(self._aes_key, AES.MODE_CBC, self._aes_iv)
+        encrypted = cipher.encrypt(pad(raw.encode('utf8'), BLOCK_SIZE))
+        return base64.b64encode(encrypted).decode('ascii')
+
+    def issue(
+        self,
+        user_id: int,
+        openid: str,
+        session_key: str,
+        context: Optional[schemas.MemberContextClaim] = None,
+        expires_delta: Optional[timedelta] = None,
+    ) -> str:
+        """
+        签发Token，payload 同 create_access_token
+        """
+        return self._issue(
+            TokenClaims(user_id, openid, session_key, context),
+            self._expire(expires_delta)
+        )
+
+    def issue_many(
+        self,
+        claims: Iterable[TokenClaims],
+        expires_delta: Optional[timedelta] = None,
+    ) -> List[str]:
+        """
+        批量签发Token，返回的Token与 claims 顺序一致
+        """
+        expire = self._expire(expires_delta)
+        return [self._issue(claim, expire) for claim in claims]
+
+    def _expire(self, expires_delta: Optional[timedelta]) -> datetime:
+        return datetime.utcnow() + (expires_delta or self.expires_delta)
+
+    def _issue(self, claims: TokenClaims, expire: datetime) -> str:
+        payload = {
+            'iss': ISSUER,
+            'aud': AUDIENCE,
+            'exp': expire,
+            'sub': str(claims.user_id),
+            'flag': self.encrypt(claims.openid),
+            'sub_sign': self.encrypt(claims.session_key),
+        }
+        if claims.context is not None:
+            payload['ctx'] = claims.context.dict()
+        return jwt.encode(payload, self._signing_key, algorithm=ALGORITHM)
+
+
+token_issuer = TokenIssuer(
+    settings.SECRET_KEY,
+    settings.AES_KEY,
+    settings.AES_IV,
+    expires_delta=timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES),
+)
+
+
 class AESBase(object):
     @staticmethod
     def pad(s, block_size=BLOCK_SIZE):
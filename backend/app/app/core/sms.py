@@ -0,0 +1,366 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Date: 2021/9/3
+# Author: gray
+
+"""
+腾讯云短信发送
+短信任务先进入进程内的缓冲区，等待一小段时间后按 (模板, 模板参数) 分组，
+同一组的手机号合并到一次 SendSms 请求（PhoneNumberSet 最多 200 个），
+各手机号的发送结果按手机号对应回各任务的 request_id 记录日志
+短信客户端由 SmsClientFactory 按进程、线程复用，保持长连接
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from celery.signals import worker_process_shutdown, worker_shutdown
+from loguru import logger
+from tencentcloud.common import credential
+from tencentcloud.common.exception.tencent_cloud_sdk_exception import \
+    TencentCloudSDKException
+from tencentcloud.common.profile.client_profile import ClientProfile
+from tencentcloud.common.profile.http_profile import HttpProfile
+from tencentcloud.sms.v20210111 import models, sms_client
+
+from app.core.config import settings
+from app.core.stats import Stats
+
+
+class SmsJob(NamedTuple):
+    """
+    短信任务，template_id、params 相同的任务合并发送
+    """
+    request_id: str
+    telephone: str
+    template_id: str
+    params: Tuple[str, ...]
+
+
+class SmsResult(NamedTuple):
+    """
+    单个手机号的发送结果，code 为 'Ok' 时发送成功
+    """
+    request_id: str
+    telephone: str
+    code: str
+    message: str
+
+
+def create_sms_client(
+    endpoint: str = None, protocol: str = 'https'
+) -> sms_client.SmsClient:
+    """
+    创建腾讯云短信客户端，客户端持有一个 HTTP 连接，不能在线程间共享
+    CAM密匙查询: https://console.cloud.tencent.com/cam/capi
+    """
+    cred = credential.Credential(settings.TENCENT_CLOUD_SECRET_ID,
+                                 settings.TENCENT_CLOUD_SECRET_KEY)
+    http_profile = HttpProfile(
+        protocol=protocol,
+        endpoint=endpoint or settings.TENCENT_CLOUD_SMS_ENDPOINT,
+        reqMethod='POST',
+        reqTimeout=30,
+        keepAlive=True,
+    )
+    client_profile = ClientProfile()
+    client_profile.signMethod = 'TC3-HMAC-SHA256'
+    client_profile.language = 'en-US'
+    client_profile.httpProfile = http_profile
+    return sms_client.SmsClient(cred, 'ap-guangzhou', client_profile)
+
+
+class SmsClientFactory(object):
+    """
+    腾讯云短信客户端工厂
+    SDK 的客户端持有一个 HTTP 连接，不能在线程间共享，每个线程复用各自的客户端和长连接；
+    客户端在首次使用时创建，fork 后的子进程（Celery prefork worker）重新创建，
+    不使用父进程的连接；密钥、接入域名配置变更后重新创建
+    连接空闲超过 idle_timeout 秒后重新创建客户端，避免使用已被服务端关闭的连接
+    请求出现网络错误后调用 discard，下次使用时重新创建
+
+    统计项:
+        created : 创建客户端
+        reused  : 复用客户端
+        reconnect : 连接空闲超时，重新创建客户端
+    """
+    def __init__(
+        self, endpoint: str = None, protocol: str = 'https',
+        idle_timeout: float = 30,
+    ) -> None:
+        self.endpoint = endpoint
+        self.protocol = protocol
+        self.idle_timeout = idle_timeout
+        self.stats = Stats('sms_client')
+        self._pid = os.getpid()
+        self._local = threading.local()
+
+    def get(self) -> sms_client.SmsClient:
+        """
+        获取当前线程的客户端
+        """
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._local = threading.local()
+        local = self._local
+        config = self._config()
+        now = time.monotonic()
+        client = getattr(local, 'client', None)
+        if client is not None and local.config == config \
+                and now - local.used_at <= self.idle_timeout:
+            self.stats.incr('reused')
+        else:
+            # 连接空闲超时后重新创建客户端，不关闭 SDK 内部的连接（不同 SDK 版本实现不同）
+            self.stats.incr('created' if client is None
+                            or local.config != config else 'reconnect')
+            client = local.client = create_sms_client(
+                endpoint=config[2], protocol=self.protocol
+            )
+            local.config = config
+        local.used_at = now
+        return client
+
+    def discard(self) -> None:
+        """
+        丢弃当前线程的客户端，下次使用时重新创建
+        """
+        self._local.client = None
+
+    def _config(self) -> Tuple[str, str, str]:
+        return (settings.TENCENT_CLOUD_SECRET_ID,
+                settings.TENCENT_CLOUD_SECRET_KEY,
+                self.endpoint or settings.TENCENT_CLOUD_SMS_ENDPOINT)
+
+
+class SmsDispatcher(object):
+    """
+    短信合并发送
+    submit 将任务放入缓冲区后立即返回，后台线程在第一个任务到达 max_wait 秒后
+    （或某一组达到 batch_size 个手机号时）取出缓冲区的全部任务，分组发送，
+    不同组的请求由 concurrency 个线程同时发送，每个线程使用各自的短信客户端
+
+    后台线程在进程内首次 submit 时启动，fork 后的子进程重新启动
+    进程退出前须调用 close 发送缓冲区中的任务（Celery worker 退出时自动调用）
+
+    统计项:
+        submitted : 提交的任务数
+        requests  : SendSms 请求数
+        sent      : 发送成功的任务数
+        failed    : 发送失败的任务数
+    """
+    def __init__(
+        self,
+        client_factory: SmsClientFactory,
+        sdk_app_id: str,
+        sign_name: str,
+        max_wait: float,
+        batch_size: int = 200,
+        concurrency: int = 4,
+    ) -> None:
+        self.client_factory = client_factory
+        self.sdk_app_id = sdk_app_id
+        self.sign_name = sign_name
+        self.max_wait = max_wait
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.stats = Stats('sms')
+        self._reset()
+
+    def _reset(self) -> None:
+        self._pid = os.getpid()
+        self._cond = threading.Condition()
+        self._pending: Dict[Tuple[str, Tuple[str, ...]], List[SmsJob]] = {}
+        self._deadline = 0.0
+        self._full = False
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def submit(self, job: SmsJob) -> None:
+        """
+        提交短信任务
+        """
+        if self._pid != os.getpid():
+            self._reset()
+        with self._cond:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run,
+                                                name='sms-dispatcher',
+                                                daemon=True)
+                self._thread.start()
+            if not self._pending:
+                self._deadline = time.monotonic() + self.max_wait
+            group = self._pending.setdefault((job.template_id, job.params),
+                                             [])
+            group.append(job)
+            self.stats.incr('submitted')
+            if len(group) >= self.batch_size:
+                self._full = True
+            self._cond.notify()
+
+    def flush(self) -> List[SmsResult]:
+        """
+        在当前线程立即发送缓冲区中的任务，返回发送结果
+        """
+        with self._cond:
+            batches = self._take()
+        return self._send_all(batches)
+
+    def close(self) -> None:
+        """
+        发送缓冲区中的任务，停止后台线程
+        """
+        if self._pid != os.getpid():
+            return
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self._closed = False
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                while not self._closed and not self._full:
+                    timeout = self._deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    self._cond.wait(timeout)
+                if not self._pending:
+                    return
+                batches = self._take()
+            try:
+                self._send_all(batches)
+            except Exception:
+                # 后台线程不能因异常退出，否则之后提交的任务不再发送
+                jobs = [job for *_, batch in batches for job in batch]
+                self.stats.incr('failed', len(jobs))
+                logger.exception(f'send sms failed, jobs={len(jobs)} rids='
+                                 f'{",".join(job.request_id for job in jobs)}')
+
+    def _take(self) -> List[Tuple[str, Tuple[str, ...], List[SmsJob]]]:
+        """
+        取出缓冲区中的全部任务，按 (模板, 模板参数) 分组，每组最多 batch_size 个手机号
+        """
+        batches = []
+        for (template_id, params), jobs in self._pending.items():
+            batch, telephones = [], set()
+            for job in jobs:
+                if job.telephone not in telephones \
+                        and len(telephones) >= self.batch_size:
+                    batches.append((template_id, params, batch))
+                    batch, telephones = [], set()
+                batch.append(job)
+                telephones.add(job.telephone)
+            batches.append((template_id, params, batch))
+        self._pending = {}
+        self._full = False
+        return batches
+
+    def _send_all(
+        self, batches: List[Tuple[str, Tuple[str, ...], List[SmsJob]]]
+    ) -> List[SmsResult]:
+        if len(batches) <= 1 or self.concurrency <= 1:
+            results = [self._try_send_batch(*batch) for batch in batches]
+        else:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    self.concurrency, thread_name_prefix='sms-sender'
+                )
+            results = list(self._executor.map(
+                lambda batch: self._try_send_batch(*batch), batches
+            ))
+        return [result for batch in results for result in batch]
+
+    def _try_send_batch(
+        self, template_id: str, params: Tuple[str, ...], jobs: List[SmsJob]
+    ) -> List[SmsResult]:
+        """
+        send_batch 出现未预期的异常时，该组任务记为发送失败，不影响其他组
+        """
+        try:
+            return self.send_batch(template_id, params, jobs)
+        except Exception as e:
+            self.client_factory.discard()
+            results = []
+            for job in jobs:
+                self.stats.incr('failed')
+                logger.exception(f'rid={job.request_id} send sms failed, '
+                                 f'exception={e!r}')
+                results.append(SmsResult(job.request_id, job.telephone,
+                                         type(e).__name__, str(e)))
+            return results
+
+    def send_batch(
+        self, template_id: str, params: Tuple[str, ...], jobs: List[SmsJob]
+    ) -> List[SmsResult]:
+        """
+        以一次 SendSms 请求发送模板、模板参数相同的任务，返回各任务的发送结果
+        """
+        phone_numbers = list(dict.fromkeys(f'+86{job.telephone}'
+                                           for job in jobs))
+        req = models.SendSmsRequest()
+        # 短信应用ID、已审核通过的签名、模板ID，短信控制台: https://console.cloud.tencent.com/smsv2
+        req.SmsSdkAppId = self.sdk_app_id
+        req.SignName = self.sign_name
+        req.TemplateId = template_id
+        req.TemplateParamSet = list(params)
+        # 下发手机号码，采用 E.164 标准，+[国家或地区码][手机号]，最多200个
+        req.PhoneNumberSet = phone_numbers
+        req.ExtendCode = ''
+        req.SenderId = ''
+        self.stats.incr('requests')
+        try:
+            resp = self.client_factory.get().SendSms(req)
+        except TencentCloudSDKException as e:
+            if e.get_code() == 'ClientNetworkError':
+                self.client_factory.discard()
+            logger.error(f'send sms failed, template={template_id} '
+                         f'numbers={len(phone_numbers)} exception={e}')
+            statuses = {}
+            error = (e.get_code() or 'TencentCloudSDKException',
+                     e.get_message())
+        else:
+            statuses = {status.PhoneNumber: status
+                        for status in resp.SendStatusSet or ()}
+            error = ('NoSendStatus', 'send status not returned')
+
+        results = []
+        for job in jobs:
+            status = statuses.get(f'+86{job.telephone}')
+            code, message = (status.Code, status.Message) if status else error
+            results.append(SmsResult(job.request_id, job.telephone,
+                                     code, message))
+            if code == 'Ok':
+                self.stats.incr('sent')
+            else:
+                self.stats.incr('failed')
+                logger.error(f'rid={job.request_id} send sms failed, '
+                             f'code={code} message={message}')
+        return results
+
+
+sms_dispatcher = SmsDispatcher(
+    SmsClientFactory(idle_timeout=settings.SMS_CLIENT_IDLE_SECONDS),
+    sdk_app_id=settings.TENCENT_CLOUD_SMS_SDK_APPID,
+    sign_name=settings.TENCENT_CLOUD_SMS_SIGN,
+    max_wait=settings.SMS_DISPATCH_MAX_WAIT_SECONDS,
+    batch_size=settings.SMS_DISPATCH_BATCH_SIZE,
+    concurrency=settings.SMS_DISPATCH_CONCURRENCY,
+)
+
+
+@worker_process_shutdown.connect(weak=False)
+@worker_shutdown.connect(weak=False)
+def close_sms_dispatcher(**_) -> None:
+    sms_dispatcher.close()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Date: 2021/9/2
+# Author: gray
+
+"""
+短信验证码存储
+发送标记（send_flag_{手机号}）、验证码（sms_captcha_{手机号}）
+和验证失败次数（sms_captcha_fails_{手机号}）保存在 Redis 中，
+检查、写入由 Lua 脚本在 Redis 中原子地完成，每次操作一次往返
+"""
+
+from enum import IntEnum
+
+from redis import Redis
+
+from app.core.config import settings
+from app.core.stats import Stats
+from app.db.redis import redis
+
+
+# 发送标记不存在时写入发送标记和验证码，返回 1；发送标记已存在（发送过于频繁）时返回 0
+ISSUE_CAPTCHA = """
+if redis.call('SET', KEYS[1], 1, 'EX', ARGV[1], 'NX') then
+    redis.call('SET', KEYS[2], ARGV[3], 'EX', ARGV[2])
+    return 1
+end
+return 0
+"""
+
+# 失败次数已达上限时返回 -1；验证码正确时删除验证码和失败次数，返回 1；
+# 否则失败次数加一（第一次失败时设置过期时间），达到上限时作废验证码，返回 0
+VERIFY_CAPTCHA = """
+local fails = tonumber(redis.call('GET', KEYS[2]) or '0')
+if fails >= tonumber(ARGV[2]) then
+    return -1
+end
+local captcha = redis.call('GET', KEYS[1])
+if captcha and captcha == ARGV[1] then
+    redis.call('DEL', KEYS[1], KEYS[2])
+    return 1
+end
+fails = redis.call('INCR', KEYS[2])
+if fails == 1 then
+    redis.call('EXPIRE', KEYS[2], ARGV[3])
+end
+if fails >= tonumber(ARGV[2]) then
+    redis.call('EXPIRE', KEYS[2], ARGV[3])
+    redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class VerifyResult(IntEnum):
+    """
+    验证码校验结果
+    """
+    INCORRECT = 0
+    CORRECT = 1
+    LOCKED = -1
+
+
+class SmsCaptchaStore(object):
+    """
+    短信验证码存储
+    同一手机号 send_interval 秒内只能发送一次，验证码 expire 秒后过期
+    同一手机号验证失败 max_attempts 次后锁定 lockout 秒，锁定期间验证均失败，
+    已发送的验证码作废；失败次数从第一次失败起 lockout 秒后清零
+
+    统计项:
+        issued    : 生成验证码
+        throttled : 发送过于频繁，拒绝
+        correct   : 验证成功
+        incorrect : 验证码错误或已过期
+        locked    : 失败次数达到上限，拒绝
+    """
+    SEND_FLAG_PREFIX = 'send_flag_'
+    CAPTCHA_PREFIX = 'sms_captcha_'
+    FAILS_PREFIX = 'sms_captcha_fails_'
+
+    def __init__(
+        self, redis_: Redis, send_interval: int, expire: int,
+        max_attempts: int, lockout: int,
+    ) -> None:
+        self.redis = redis_
+        self.send_interval = send_interval
+        self.expire = expire
+        self.max_attempts = max_attempts
+        self.lockout = lockout
+        self.stats = Stats('sms_captcha')
+        self._issue_script = redis_.register_script(ISSUE_CAPTCHA)
+        self._verify_script = redis_.register_script(VERIFY_CAPTCHA)
+
+    def issue(self, telephone: str, captcha: int) -> bool:
+        """
+        保存验证码并写入发送标记，返回是否应发送短信，
+        发送标记已存在时不保存验证码，返回 False
+        """
+        issued = self._issue_script(
+            keys=[self._send_flag_key(telephone), self._captcha_key(telephone)],
+            args=[self.send_interval, self.expire, captcha],
+        )
+        self.stats.incr('issued' if issued else 'throttled')
+        return bool(issued)
+
+    def is_locked(self, telephone: str) -> bool:
+        """
+        检查失败次数是否已达上限，只读取失败次数，不消耗验证码
+        """
+        fails = self.redis.get(self._fails_key(telephone))
+        locked = fails is not None and int(fails) >= self.max_attempts
+        if locked:
+            self.stats.incr('locked')
+        return locked
+
+    def verify(self, telephone: str, captcha: int) -> VerifyResult:
+        """
+        校验验证码，验证成功后验证码作废
+        """
+        result = VerifyResult(self._verify_script(
+            keys=[self._captcha_key(telephone), self._fails_key(telephone)],
+            args=[captcha, self.max_attempts, self.lockout],
+        ))
+        self.stats.incr(result.name.lower())
+        return result
+
+    def revoke(self, telephone: str) -> None:
+        """
+        删除发送标记和验证码，短信发送任务发布失败时调用，用户可立即重新请求
+        """
+        self.redis.delete(self._send_flag_key(telephone),
+                          self._captcha_key(telephone))
+
+    def _send_flag_key(self, telephone: str) -> str:
+        return f'{self.SEND_FLAG_PREFIX}{telephone}'
+
+    def _captcha_key(self, telephone: str) -> str:
+        return f'{self.CAPTCHA_PREFIX}{telephone}'
+
+    def _fails_key(self, telephone: str) -> str:
+        return f'{self.FAILS_PREFIX}{telephone}'
+
+
+sms_captcha_store = SmsCaptchaStore(
+    redis,
+    send_interval=settings.SEND_SMS_INTERVAL_SECONDS,
+    expire=settings.SMS_CAPTCHA_EXPIRE_SECONDS,
+    max_attempts=settings.SMS_CAPTCHA_MAX_ATTEMPTS,
+    lockout=settings.SMS_CAPTCHA_LOCKOUT_SECONDS,
+)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Date: 2021/8/27
+# Author: gray
+
+"""
+进程内计数器
+用于统计缓存命中、数据库访问等指标，每个进程（gunicorn worker / celery worker）各自独立计数，
+注册到 stats_reporter 的计数器定期写入日志，汇总各进程的日志即可得到全部进程的计数
+"""
+
+import os
+import threading
+from collections import Counter
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+from app.core.config import settings
+
+
+class Stats(object):
+    """
+    线程安全的具名计数器
+
+    Examples
+    --------
+    stats = Stats('user_context')
+    stats.incr('local_hit')
+    stats.snapshot()  # {'local_hit': 1}
+    """
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._counter = Counter()
+        self._lock = threading.Lock()
+
+    def incr(self, key: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counter[key] += amount
+
+    def get(self, key: str) -> int:
+        return self._counter[key]
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counter)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counter.clear()
+
+    def __repr__(self):
+        return f'<Stats {self.name}: {self.snapshot()}>'
+
+
+class StatsReporter(object):
+    """
+    定期将已注册计数器的快照写入日志，日志带进程号，每个进程各自输出
+    interval 不大于 0 时不启动后台线程
+
+    Examples
+    --------
+    stats_reporter.register(db_stats)
+    stats_reporter.start()
+    """
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self._stats: List[Stats] = []
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def register(self, *stats: Stats) -> None:
+        self._stats.extend(stats)
+
+    def report(self) -> None:
+        """
+        立即输出所有已注册计数器的快照
+        """
+        pid = os.getpid()
+        for stats in self._stats:
+            logger.info(f'stats pid={pid} name={stats.name} '
+                        f'counters={stats.snapshot()}')
+
+    def start(self) -> None:
+        """
+        启动后台线程，每 interval 秒输出一次
+        """
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='stats-reporter', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        停止后台线程，并输出最后一次快照
+        """
+        if self._thread is None:
+            return
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+        self.report()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            self.report()
+
+
+stats_reporter = StatsReporter(settings.STATS_LOG_INTERVAL_SECONDS)
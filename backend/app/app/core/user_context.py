@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Date: 2021/8/27
+# Author: gray
+
+"""
+用户上下文缓存
+鉴权时需要的用户信息（当前班级成员id、是否停用），两级缓存：进程内 LRU -> Redis -> 数据库
+Token 中可以携带签发时的用户上下文及其版本号，版本号与 Redis 中的一致时直接使用 Token 中的用户上下文
+版本号保存在 user 表的 ctx_version 字段，与用户上下文在同一事务中更新，Redis 中保存其副本
+"""
+
+import json
+from typing import Awaitable, Callable, NamedTuple, Optional
+
+from loguru import logger
+from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
+from redis.exceptions import RedisError
+
+from app.core.cache import LocalCache
+from app.core.config import settings
+from app.core.stats import Stats
+from app.db.async_redis import async_redis
+from app.db.redis import redis
+from app.schemas import MemberContextClaim
+
+
+# Redis 中的版本号只增不减，避免并发更新时旧版本号覆盖新版本号
+SET_VERSION_IF_GREATER = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '-1')
+if tonumber(ARGV[1]) > current then
+    redis.call('SET', KEYS[1], ARGV[1])
+    return 1
+end
+return 0
+"""
+
+
+class UserContext(NamedTuple):
+    """
+    鉴权时需要的用户信息，字段与 crud.user.get_basic_info 的查询结果一致
+    """
+    current_member_id: Optional[int]
+    is_delete: bool
+    ctx_version: int = 0
+
+
+class UserContextCache(object):
+    """
+    用户上下文两级缓存
+    先读进程内缓存，未命中读 Redis，仍未命中调用 loader 查询数据库并回填两级缓存
+    get 供同步路径函数使用，get_async 供异步路径函数使用
+    用户数据变更后须调用 invalidate，其他进程的进程内缓存最多在 local_ttl 秒后失效
+
+    每个用户的用户上下文有一个版本号（user.ctx_version），变更用户上下文时版本号加一，
+    Redis 中的版本号由 publish_version 写入
+    Token 中携带的用户上下文（claim）的版本号与 Redis 中的一致时，直接使用 claim，不再读缓存
+    Redis 中没有版本号时不使用 claim
+
+    统计项:
+        claim_hit : 使用Token中的用户上下文
+        local_hit : 进程内缓存命中
+        redis_hit : Redis缓存命中
+        db_load   : 查询数据库
+        redis_error : Redis不可用，降级查询数据库
+    """
+    KEY_PREFIX = 'user_ctx_'
+    VERSION_KEY_PREFIX = 'user_ctx_ver_'
+
+    def __init__(
+        self, redis_: Redis, async_redis_: AsyncRedis,
+        local_size: int, local_ttl: int, redis_ttl: int
+    ) -> None:
+        self.redis = redis_
+        self.async_redis = async_redis_
+        self.redis_ttl = redis_ttl
+        self.local = LocalCache('user_context', maxsize=local_size,
+                                ttl=local_ttl)
+        self.local_version = LocalCache('user_context_version',
+                                        maxsize=local_size, ttl=local_ttl)
+        self.stats = Stats('user_context')
+        self._set_version_script = redis_.register_script(
+            SET_VERSION_IF_GREATER
+        )
+        self._set_version_script_async = async_redis_.register_script(
+            SET_VERSION_IF_GREATER
+        )
+
+    def get(
+        self,
+        user_id: int,
+        loader: Callable[[], Optional[tuple]],
+        claim: Optional[MemberContextClaim] = None,
+    ) -> Optional[UserContext]:
+        """
+        获取用户上下文，用户不存在时返回 None
+
+        Parameters
+        ----------
+        user_id : 用户id
+        loader : 缓存未命中时查询数据库的函数，
+            返回 (current_member_id, is_delete, ctx_version)
+        claim : Token中携带的用户上下文
+        """
+        user_id = int(user_id)
+        if claim is not None and claim.ver == self.get_version(user_id):
+            return self._from_claim(claim)
+        context = self._get_local(user_id)
+        if context is not None:
+            return context
+
+        key = f'{self.KEY_PREFIX}{user_id}'
+        try:
+            cached = self.redis.get(key)
+        except RedisError:
+            cached = self._on_redis_error(user_id)
+        if cached:
+            return self._on_redis_hit(user_id, cached)
+
+        self.stats.incr('db_load')
+        context = self._to_context(loader())
+        if context is None:
+            return None
+        try:
+            self.redis.setex(key, self.redis_ttl, json.dumps(context))
+            self._set_version_script(keys=[self._version_key(user_id)],
+                                     args=[context.ctx_version])
+        except RedisError:
+            self.stats.incr('redis_error')
+        self.local.set(user_id, context)
+        return context
+
+    async def get_async(
+        self,
+        user_id: int,
+        loader: Callable[[], Awaitable[Optional[tuple]]],
+        claim: Optional[MemberContextClaim] = None,
+    ) -> Optional[UserContext]:
+        """
+        获取用户上下文，get 的异步版本，loader 为异步函数
+        """
+        user_id = int(user_id)
+        if claim is not None \
+                and claim.ver == await self.get_version_async(user_id):
+            return self._from_claim(claim)
+        context = self._get_local(user_id)
+        if context is not None:
+            return context
+
+        key = f'{self.KEY_PREFIX}{user_id}'
+        try:
+            cached = await self.async_redis.get(key)
+        except RedisError:
+            cached = self._on_redis_error(user_id)
+        if cached:
+            return self._on_redis_hit(user_id, cached)
+
+        self.stats.incr('db_load')
+        context = self._to_context(await loader())
+        if context is None:
+            return None
+        try:
+            await self.async_redis.setex(key, self.redis_ttl,
+                                         json.dumps(context))
+            await self._set_version_script_async(
+                keys=[self._version_key(user_id)], args=[context.ctx_version]
+            )
+        except RedisError:
+            self.stats.incr('redis_error')
+        self.local.set(user_id, context)
+        return context
+
+    def get_version(self, user_id: int) -> Optional[int]:
+        """
+        获取 Redis 中的用户上下文版本号，没有版本号或 Redis 不可用时返回 None
+        """
+        user_id = int(user_id)
+        version = self.local_version.get(user_id)
+        if version is not None:
+            return version
+        try:
+            version = self.redis.get(self._version_key(user_id))
+        except RedisError:
+            return self._on_redis_error(user_id)
+        return self._on_version_loaded(user_id, version)
+
+    async def get_version_async(self, user_id: int) -> Optional[int]:
+        """
+        获取 Redis 中的用户上下文版本号，get_version 的异步版本
+        """
+        user_id = int(user_id)
+        version = self.local_version.get(user_id)
+        if version is not None:
+            return version
+        try:
+            version = await self.async_redis.get(self._version_key(user_id))
+        except RedisError:
+            return self._on_redis_error(user_id)
+        return self._on_version_loaded(user_id, version)
+
+    def publish_version(self, user_id: int, version: int) -> None:
+        """
+        将数据库中的用户上下文版本号写入 Redis，Redis 中已有更大的版本号时不写入
+        """
+        user_id = int(user_id)
+        self.local_version.delete(user_id)
+        try:
+            self._set_version_script(keys=[self._version_key(user_id)],
+                                     args=[version])
+        except RedisError:
+            self.stats.incr('redis_error')
+            logger.error(f'publish user context version failed, '
+                         f'user_id={user_id} version={version}')
+
+    def invalidate(self, user_id: int, version: int) -> None:
+        """
+        用户上下文变更后使缓存失效并写入新的版本号，须在数据库事务提交后调用
+
+        Parameters
+        ----------
+        user_id : 用户id
+        version : 变更后的用户上下文版本号
+        """
+        user_id = int(user_id)
+        self.local.delete(user_id)
+        try:
+            self.redis.delete(f'{self.KEY_PREFIX}{user_id}')
+        except RedisError:
+            self.stats.incr('redis_error')
+            logger.error(f'invalidate user context failed, user_id={user_id}')
+        self.publish_version(user_id, version)
+
+    def _version_key(self, user_id: int) -> str:
+        return f'{self.VERSION_KEY_PREFIX}{user_id}'
+
+    def _on_version_loaded(
+        self, user_id: int, version: Optional[str]
+    ) -> Optional[int]:
+        if version is None:
+            return None
+        version = int(version)
+        self.local_version.set(user_id, version)
+        return version
+
+    def _from_claim(self, claim: MemberContextClaim) -> UserContext:
+        self.stats.incr('claim_hit')
+        return UserContext(claim.mid, claim.dis, claim.ver)
+
+    def _get_local(self, user_id: int) -> Optional[UserContext]:
+        context = self.local.get(user_id)
+        if context is not None:
+            self.stats.incr('local_hit')
+        return context
+
+    def _on_redis_hit(self, user_id: int, cached: str) -> UserContext:
+        self.stats.incr('redis_hit')
+        context = UserContext(*json.loads(cached))
+        self.local.set(user_id, context)
+        return context
+
+    def _on_redis_error(self, user_id: int) -> None:
+        self.stats.incr('redis_error')
+        logger.warning(f'read user context from redis failed, '
+                       f'user_id={user_id}')
+
+    @staticmethod
+    def _to_context(row: Optional[tuple]) -> Optional[UserContext]:
+        if not row:
+            return None
+        return UserContext(row.current_member_id, row.is_delete,
+                           row.ctx_version)
+
+
+user_context_cache = UserContextCache(
+    redis,
+    async_redis,
+    local_size=settings.USER_CONTEXT_LOCAL_CACHE_SIZE,
+    local_ttl=settings.USER_CONTEXT_LOCAL_CACHE_SECONDS,
+    redis_ttl=settings.USER_CONTEXT_CACHE_EXPIRE_SECONDS,
+)
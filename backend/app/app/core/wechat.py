@@ -0,0 +1,465 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Date: 2021/8/30
+# Author: gray
+
+"""
+微信小程序平台 HTTP 客户端
+连接池复用长连接，显式的连接、读取超时，系统繁忙（errcode=-1）时有限次重试，
+连续失败（网络错误、超时、HTTP 错误状态码、响应报文无法解析、系统繁忙）时熔断，
+熔断期间直接返回系统繁忙，不再请求微信
+
+接口调用凭证 access_token 由 AccessTokenProvider 按需获取、缓存
+"""
+
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import Future
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple, Type, TypeVar
+
+import requests
+from loguru import logger
+from pydantic import BaseModel, ValidationError
+from redis import Redis
+from redis.exceptions import LockError, RedisError
+from requests.adapters import HTTPAdapter
+
+from app.constants import RespError
+from app.core.config import settings
+from app.core.stats import Stats
+from app.exceptions import BizHTTPException
+from app.db.redis import redis
+from app.schemas import Code2SessionMsg, WXAccessTokenMsg
+
+if TYPE_CHECKING:
+    import httpx
+
+
+MsgType = TypeVar('MsgType', bound=BaseModel)
+
+SYSTEM_BUSY = '-1'  # 微信接口 errcode: 系统繁忙，此时请开发者稍候再试
+
+
+class CircuitBreaker(object):
+    """
+    熔断器，线程安全
+    连续失败 failure_threshold 次后熔断，熔断 reset_timeout 秒后放行一次试探请求，
+    试探请求成功则恢复，失败则继续熔断
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int, reset_timeout: float) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """
+        是否放行本次请求
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN \
+                    and time.monotonic() - self._opened_at >= self.reset_timeout:
+                # 熔断时间已过，放行一次试探请求
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self.state = self.CLOSED
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN \
+                    or self._failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class WeChatClient(object):
+    """
+    微信小程序平台接口客户端
+    同一进程内共享一个实例，同步方法供同步路径函数 / Celery 任务使用，*_async 方法供异步路径函数使用
+
+    统计项:
+        request : 请求次数
+        retry   : 系统繁忙重试次数
+        failure : 网络错误、超时、HTTP 错误状态码、响应报文无法解析、系统繁忙次数
+        rejected : 熔断期间拒绝的请求次数
+    """
+    def __init__(
+        self,
+        app_id: str,
+        app_secret: str,
+        code2session_url: str,
+        connect_timeout: float,
+        read_timeout: float,
+        max_retries: int,
+        pool_size: int,
+        breaker: CircuitBreaker,
+        access_token_url: Optional[str] = None,
+    ) -> None:
+        self.app_id = app_id
+        self.app_secret = app_secret
+        self.code2session_url = code2session_url
+        self.access_token_url = access_token_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.pool_size = pool_size
+        self.breaker = breaker
+        self.stats = Stats('wechat')
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        # httpx.AsyncClient 绑定事件循环，首次调用异步方法时创建，
+        # httpx 也在此时导入，不使用异步方法的进程不必导入
+        self._async_client: Optional['httpx.AsyncClient'] = None
+
+    def code2session(self, code: str) -> Code2SessionMsg:
+        """
+        登录凭证校验，调用微信 auth.code2Session 接口
+        """
+        return self.request(
+            self.code2session_url, self._code2session_params(code),
+            Code2SessionMsg
+        )
+
+    async def code2session_async(self, code: str) -> Code2SessionMsg:
+        """
+        登录凭证校验，code2session 的异步版本
+        """
+        return await self.request_async(
+            self.code2session_url, self._code2session_params(code),
+            Code2SessionMsg
+        )
+
+    def get_access_token(self) -> WXAccessTokenMsg:
+        """
+        获取接口调用凭证，调用微信 auth.getAccessToken 接口
+        每次调用都会生成新的 access_token，应通过 AccessTokenProvider 获取
+        """
+        return self.request(
+            self.access_token_url,
+            {
+                'grant_type': 'client_credential',
+                'appid': self.app_id,
+                'secret': self.app_secret,
+            },
+            WXAccessTokenMsg,
+        )
+
+    def request(
+        self, url: str, params: Dict[str, Any], msg_type: Type[MsgType]
+    ) -> MsgType:
+        """
+        发送 GET 请求并解析响应报文，系统繁忙时重试
+
+        Raises
+        ------
+        BizHTTPException : 熔断中、网络错误或超时，RespError.SERVER_TOO_BUSY
+        """
+        for attempt in range(self.max_retries + 1):
+            self._before_request(url)
+            try:
+                resp = self.session.get(url, params=params,
+                                        timeout=self.timeout)
+                status_code, text = resp.status_code, resp.text
+            except requests.RequestException as e:
+                raise self._on_transport_error(url, e)
+            except BaseException:
+                self._on_unexpected_error()
+                raise
+            msg = self._on_response(url, status_code, text, msg_type)
+            if msg.errcode != SYSTEM_BUSY or attempt == self.max_retries:
+                return msg
+            self.stats.incr('retry')
+            time.sleep(self._backoff(attempt))
+
+    async def request_async(
+        self, url: str, params: Dict[str, Any], msg_type: Type[MsgType]
+    ) -> MsgType:
+        """
+        request 的异步版本
+        """
+        import httpx
+
+        client = self._get_async_client()
+        for attempt in range(self.max_retries + 1):
+            self._before_request(url)
+            try:
+                resp = await client.get(url, params=params)
+                status_code, text = resp.status_code, resp.text
+            except httpx.HTTPError as e:
+                raise self._on_transport_error(url, e)
+            except BaseException:
+                self._on_unexpected_error()
+                raise
+            msg = self._on_response(url, status_code, text, msg_type)
+            if msg.errcode != SYSTEM_BUSY or attempt == self.max_retries:
+                return msg
+            self.stats.incr('retry')
+            await asyncio.sleep(self._backoff(attempt))
+
+    async def aclose(self) -> None:
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+    def _code2session_params(self, code: str) -> Dict[str, str]:
+        return {
+            'appid': self.app_id,
+            'secret': self.app_secret,
+            'js_code': code,
+            'grant_type': 'authorization_code',
+        }
+
+    def _get_async_client(self) -> 'httpx.AsyncClient':
+        if self._async_client is None:
+            import httpx
+
+            connect_timeout, read_timeout = self.timeout
+            self._async_client = httpx.AsyncClient(
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                limits=httpx.Limits(max_connections=self.pool_size,
+                                    max_keepalive_connections=self.pool_size),
+            )
+        return self._async_client
+
+    def _before_request(self, url: str) -> None:
+        if not self.breaker.allow():
+            self.stats.incr('rejected')
+            logger.warning(f'request to WX rejected by circuit breaker, '
+                           f'url={url}')
+            raise BizHTTPException(*RespError.SERVER_TOO_BUSY)
+        self.stats.incr('request')
+
+    def _on_transport_error(
+        self, url: str, e: Exception
+    ) -> BizHTTPException:
+        self.stats.incr('failure')
+        self.breaker.record_failure()
+        # 异常信息中可能包含请求参数（appid、secret），只记录异常类型
+        logger.error(f'request to WX failed, url={url} '
+                     f'error={e.__class__.__name__}')
+        return BizHTTPException(*RespError.SERVER_TOO_BUSY)
+
+    def _on_unexpected_error(self) -> None:
+        # 其他异常也记为失败，否则熔断器会停留在半开状态，不再放行请求
+        self.stats.incr('failure')
+        self.breaker.record_failure()
+
+    def _on_response(
+        self, url: str, status_code: int, text: str, msg_type: Type[MsgType]
+    ) -> MsgType:
+        # HTTP 错误状态码（如网关 5xx）、无法解析的响应报文记为失败
+        failed = not 200 <= status_code < 300
+        try:
+            msg = msg_type(**json.loads(text))
+        except (ValidationError, json.JSONDecodeError, TypeError):
+            failed = True
+            msg = msg_type()
+        if failed:
+            logger.error(f'unexpected WX response, url={url} '
+                         f'status code={status_code} message={text}')
+        if failed or msg.errcode == SYSTEM_BUSY:
+            self.stats.incr('failure')
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return msg
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        return 0.1 * 2 ** attempt
+
+
+class AccessTokenProvider(object):
+    """
+    微信接口调用凭证 access_token，线程安全
+    get 依次读取进程内缓存、Redis，都不存在（或已过期）时刷新:
+    持有 Redis 锁的进程请求微信接口，写入 Redis，其他进程等待锁释放后从 Redis 读取；
+    同一进程内同时调用 get 的线程共享一次读取、刷新的结果（包括异常）
+    Redis、进程内缓存的过期时间为微信返回的 expires_in 减去 refresh_ahead 秒，
+    新 access_token 生成后旧的在 5 分钟内仍可用，refresh 只在 Redis 中的剩余有效时间少于
+    refresh_ahead 秒时刷新，refresh_ahead 不超过 300 秒时不影响其他进程正在使用的旧 token
+    不依赖 Celery beat 定时刷新；Redis 不可用时直接请求微信，只缓存在进程内
+
+    统计项:
+        local_hit : 进程内缓存命中
+        redis_hit : Redis 命中
+        shared    : 等待同一进程内其他线程的结果
+        refresh   : 请求微信接口刷新
+        failure   : 刷新失败
+        redis_error : Redis不可用
+    """
+    KEY = 'wx_access_token'
+    LOCK_KEY = 'wx_access_token_lock'
+
+    def __init__(
+        self, client: WeChatClient, redis_: Redis, refresh_ahead: int,
+        lock_timeout: float, wait_timeout: float,
+    ) -> None:
+        self.client = client
+        self.redis = redis_
+        self.refresh_ahead = refresh_ahead
+        self.lock_timeout = lock_timeout
+        self.wait_timeout = wait_timeout
+        self.stats = Stats('wx_access_token')
+        # (access_token, 过期时刻 time.monotonic())
+        self._local: Optional[Tuple[str, float]] = None
+        self._flight: Optional[Future] = None
+        self._lock = threading.Lock()
+
+    def get(self) -> str:
+        """
+        获取 access_token
+
+        Raises
+        ------
+        BizHTTPException : 刷新失败、等待其他进程刷新超时，RespError.SERVER_TOO_BUSY
+        """
+        token = self._get_local()
+        if token is not None:
+            self.stats.incr('local_hit')
+            return token
+        with self._lock:
+            flight = self._flight
+            leader = flight is None
+            if leader:
+                flight = self._flight = Future()
+        if not leader:
+            self.stats.incr('shared')
+            return flight.result()
+        try:
+            token = self._get_redis()
+            if token is None:
+                token = self._refresh(force=False)
+            flight.set_result(token)
+            return token
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._flight = None
+
+    def refresh(self) -> str:
+        """
+        提前刷新 access_token，供定时任务调用
+        Redis 中的 access_token 剩余有效时间不少于 refresh_ahead 秒时不刷新，直接返回：
+        其他进程的进程内缓存最多缓存到 Redis 中的过期时间，只在最后 refresh_ahead 秒内刷新，
+        旧 access_token 被微信作废（新的生成约 5 分钟后）前，进程内缓存已过期
+        """
+        return self._refresh(force=True)
+
+    def _refresh(self, force: bool) -> str:
+        try:
+            lock = self.redis.lock(self.LOCK_KEY, timeout=self.lock_timeout,
+                                   blocking_timeout=self.wait_timeout)
+            acquired = lock.acquire()
+        except RedisError:
+            self.stats.incr('redis_error')
+            logger.warning('acquire WX access token lock failed')
+            return self._request(store=False)
+        try:
+            # 等待锁期间其他进程可能已刷新
+            token = self._get_redis(
+                min_ttl=self.refresh_ahead if force else 0
+            )
+            if token is not None:
+                return token
+            if not acquired:
+                logger.error('wait for WX access token refresh timeout')
+                raise BizHTTPException(*RespError.SERVER_TOO_BUSY)
+            return self._request(store=True)
+        finally:
+            if acquired:
+                try:
+                    lock.release()
+                except (LockError, RedisError):
+                    logger.warning('release WX access token lock failed')
+
+    def _request(self, store: bool) -> str:
+        self.stats.incr('refresh')
+        msg = self.client.get_access_token()
+        if not msg.access_token or not msg.expires_in:
+            self.stats.incr('failure')
+            logger.error(f'get WX access token failed, '
+                         f'errcode={msg.errcode} errmsg={msg.errmsg}')
+            raise BizHTTPException(*RespError.SERVER_TOO_BUSY)
+        ttl = max(msg.expires_in - self.refresh_ahead, 1)
+        if store:
+            try:
+                self.redis.set(self.KEY, msg.access_token, ex=ttl)
+            except RedisError:
+                self.stats.incr('redis_error')
+                logger.warning('save WX access token failed')
+        self._set_local(msg.access_token, ttl)
+        logger.info(f'WX access token refreshed, expires_in={msg.expires_in}')
+        return msg.access_token
+
+    def _get_local(self) -> Optional[str]:
+        local = self._local
+        if local is not None and local[1] > time.monotonic():
+            return local[0]
+        return None
+
+    def _set_local(self, token: str, ttl: float) -> None:
+        self._local = (token, time.monotonic() + ttl)
+
+    def _get_redis(self, min_ttl: float = 0) -> Optional[str]:
+        """
+        读取 Redis 中的 access_token，同时以剩余过期时间写入进程内缓存，
+        剩余过期时间小于 min_ttl 秒时视为不存在
+        """
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            token, pttl = pipe.get(self.KEY).pttl(self.KEY).execute()
+        except RedisError:
+            self.stats.incr('redis_error')
+            logger.warning('read WX access token failed')
+            return None
+        # 未设置过期时间（pttl 为 -1）的 access_token 来自旧版本的定时任务，视为不存在
+        if not token or pttl <= 0 or pttl < min_ttl * 1000:
+            return None
+        self.stats.incr('redis_hit')
+        self._set_local(token, pttl / 1000)
+        return token
+
+
+wechat_client = WeChatClient(
+    app_id=settings.MINI_PROGRAM_APP_ID,
+    app_secret=settings.MINI_PROGRAM_APP_SECRET,
+    code2session_url=settings.CODE2SESSION_URL,
+    connect_timeout=settings.WX_CONNECT_TIMEOUT_SECONDS,
+    read_timeout=settings.WX_READ_TIMEOUT_SECONDS,
+    max_retries=settings.WX_MAX_RETRIES,
+    pool_size=settings.WX_POOL_SIZE,
+    breaker=CircuitBreaker(
+        failure_threshold=settings.WX_BREAKER_FAILURE_THRESHOLD,
+        reset_timeout=settings.WX_BREAKER_RESET_SECONDS,
+    ),
+    access_token_url=settings.WX_ACCESS_TOKEN_URL,
+)
+
+access_token_provider = AccessTokenProvider(
+    wechat_client,
+    redis,
+    refresh_ahead=settings.WX_ACCESS_TOKEN_UPDATE_OFFSET,
+    lock_timeout=settings.WX_ACCESS_TOKEN_LOCK_SECONDS,
+    wait_timeout=settings.WX_ACCESS_TOKEN_LOCK_WAIT_SECONDS,
+)
@@ -10,6 +10,8 @@ CRUD模块 - 学校相关 非复杂业务CRUD
 from typing import List
 
 from sqlalchemy.engine.row import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
 from sqlalchemy.orm import Session
 from sqlalchemy.sql import and_, false, func, null
 
@@ -136,6 +138,28 @@ class CRUDClassMember(CRUDBase[ClassMember, ClassMember, ClassMember]):
             .first()
         )
 
+    async def get_current_class_member_async(
+        self, db: AsyncSession, user_id: int, member_id: int
+    ) -> Row:
+        """
+        查询当前用户的班级成员信息，get_current_class_member 的异步版本
+        """
+        result = await db.execute(
+            select(self.model.id, self.model.class_id, self.model.name,
+                   self.model.member_role, self.model.subject_id,
+                   self.model.family_relation, Class.class_, Class.grade)
+            .join(Class, ClassMember.class_id == Class.id)
+            .filter(
+                and_(
+                    ClassMember.id == member_id,
+                    ClassMember.user_id == user_id,
+                    ClassMember.is_delete == false(),
+                    Class.is_delete == false(),
+                )
+            )
+        )
+        return result.first()
+
     def get_class_members(self, db: Session, user_id: int) -> List[Row]:
         """
         根据 user_id 查询该用户的所有作为班级成员的信息
@@ -7,10 +7,12 @@
 CRUD模块 - 页面相关 非复杂业务CRUD
 """
 
-from typing import List
+from typing import Any, Dict, List, Union
 
 from app.constants import DBConst
-from app.crud.base import CRUDBase
+from app.core.response_cache import pages_cache
+from app.crud.base import CRUDBase, CreateSchemaType, ModelType, \
+    UpdateSchemaType
 from app.models import HomepageMenu, EntrancePage
 
 from sqlalchemy.engine.row import Row
@@ -18,7 +20,33 @@ from sqlalchemy.orm import Session
 from sqlalchemy.sql import and_
 
 
-class CRUDHomepageMenu(CRUDBase[HomepageMenu, HomepageMenu, HomepageMenu]):
+class CRUDPage(CRUDBase[ModelType, CreateSchemaType, UpdateSchemaType]):
+    """
+    页面相关CRUD基类，写入后使页面响应缓存失效
+    """
+    def create(self, db: Session, *, obj_in: CreateSchemaType) -> ModelType:
+        db_obj = super().create(db, obj_in=obj_in)
+        pages_cache.bump()
+        return db_obj
+
+    @staticmethod
+    def update(
+        db: Session,
+        *,
+        db_obj: ModelType,
+        obj_in: Union[UpdateSchemaType, Dict[str, Any]]
+    ) -> ModelType:
+        db_obj = CRUDBase.update(db, db_obj=db_obj, obj_in=obj_in)
+        pages_cache.bump()
+        return db_obj
+
+    def remove(self, db: Session, *, id_: int) -> ModelType:
+        obj = super().remove(db, id_=id_)
+        pages_cache.bump()
+        return obj
+
+
+class CRUDHomepageMenu(CRUDPage[HomepageMenu, HomepageMenu, HomepageMenu]):
     """
     首页菜单相关CRUD
     模型类: HomepageMenu
@@ -38,7 +66,7 @@ class CRUDHomepageMenu(CRUDBase[HomepageMenu, HomepageMenu, HomepageMenu]):
         )
 
 
-class CRUDEntrancePage(CRUDBase[EntrancePage, EntrancePage, EntrancePage]):
+class CRUDEntrancePage(CRUDPage[EntrancePage, EntrancePage, EntrancePage]):
     """
     启动页图片相关CRUD
     模型类: EntrancePage
@@ -54,6 +54,17 @@ class CRUDSysConfig(CRUDBase[SysConfig, SysConfig, SysConfig]):
             .all()
         )
 
+    @staticmethod
+    def all(db: Session) -> List[Tuple[int, str, str]]:
+        """
+        获取所有配置项的 配置类型、key、value
+        """
+        return (
+            db.query(SysConfig.type_, SysConfig.key, SysConfig.value)
+            .order_by(SysConfig.id)
+            .all()
+        )
+
     def family_relation_exists(self, db: Session, family_relation: str) -> int:
         """
         查询对应 亲属关系 配置是否存在
@@ -7,9 +7,16 @@
 CRUD模块 - 用户相关 非复杂业务CRUD
 """
 
+from typing import Optional
+
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.engine.row import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy.sql import update
 from sqlalchemy.orm import Session
 
+from app.core.user_context import user_context_cache
 from app.crud.base import CRUDBase
 from app.models import User
 from app.schemas.user import UserCreate
@@ -31,27 +38,79 @@ class CRUDUser(CRUDBase[User, UserCreate, User]):
             .first()
         )
 
+    def get_or_create_by_openid(self, db: Session, openid: str) -> Row:
+        """
+        获取 openid 对应的用户，不存在则新建，单条 INSERT ... ON CONFLICT 语句完成
+        返回 (id, current_member_id, is_delete, ctx_version)
+        """
+        stmt = insert(self.model).values(openid=openid)
+        # 冲突时更新为原值，使 RETURNING 返回已存在的行
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[User.openid],
+            set_={User.openid.name: stmt.excluded.openid},
+        ).returning(
+            User.id, User.current_member_id, User.is_delete, User.ctx_version
+        )
+        try:
+            row = db.execute(stmt).first()
+            db.commit()
+            return row
+        except Exception:
+            db.rollback()
+            raise
+
     def get_basic_info(self, db: Session, user_id: int) -> Row:
         """
         获取用户基本信息
         """
         return (
-            db.query(self.model.current_member_id, self.model.is_delete)
+            db.query(self.model.current_member_id, self.model.is_delete,
+                     self.model.ctx_version)
             .filter(User.id == user_id)
             .first()
         )
 
-    def update_current_member(self, db: Session, user_id: int, member_id: int):
+    async def get_basic_info_async(
+        self, db: AsyncSession, user_id: int
+    ) -> Row:
         """
-        更新用户当前所在班级
+        获取用户基本信息，get_basic_info 的异步版本
         """
-        res = (
-            db.query(self.model)
+        result = await db.execute(
+            select(self.model.current_member_id, self.model.is_delete,
+                   self.model.ctx_version)
             .filter(User.id == user_id)
-            .update({User.current_member_id: member_id})
         )
+        return result.first()
+
+    def update_current_member(self, db: Session, user_id: int, member_id: int):
+        """
+        更新用户当前所在班级
+        """
+        return self._update_context(db, user_id, current_member_id=member_id)
+
+    def disable(self, db: Session, user_id: int):
+        """
+        停用用户（软删除）
+        """
+        return self._update_context(db, user_id, is_delete=True)
+
+    def _update_context(
+        self, db: Session, user_id: int, **values
+    ) -> Optional[int]:
+        """
+        更新用户上下文字段，同时用户上下文版本号加一，返回更新后的版本号
+        """
+        version = db.execute(
+            update(self.model)
+            .where(User.id == user_id)
+            .values(ctx_version=User.ctx_version + 1, **values)
+            .returning(User.ctx_version)
+        ).scalar()
         db.commit()
-        return res
+        if version is not None:
+            user_context_cache.invalidate(user_id, version)
+        return version
 
 
 user = CRUDUser(User)
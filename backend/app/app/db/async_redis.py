@@ -0,0 +1,18 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Date: 2021/8/27
+# Author: gray
+
+"""
+异步Redis连接，供异步路径函数使用
+"""
+
+from redis.asyncio import ConnectionPool, Redis
+
+from app.core.config import settings
+
+
+async_redis_conn_pool = ConnectionPool(
+    host=settings.REDIS_HOST, port=settings.REDIS_PORT, decode_responses=True
+)
+async_redis = Redis(connection_pool=async_redis_conn_pool)
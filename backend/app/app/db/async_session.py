@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Date: 2021/8/27
+# Author: gray
+
+"""
+异步数据库连接，驱动为 asyncpg
+与 app.db.session 连接同一数据库，供异步路径函数使用
+"""
+
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.core.config import settings
+
+
+ASYNC_DATABASE_URI = str(settings.SQLALCHEMY_DATABASE_URI).replace(
+    'postgresql://', 'postgresql+asyncpg://', 1
+)
+
+async_engine = create_async_engine(ASYNC_DATABASE_URI, pool_pre_ping=True)
+AsyncSessionLocal = sessionmaker(
+    bind=async_engine,
+    class_=AsyncSession,
+    autocommit=False,
+    autoflush=False,
+    expire_on_commit=False,
+)
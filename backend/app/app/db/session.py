@@ -1,8 +1,37 @@
+from typing import Any, Optional
+
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 
 from app.core.config import settings
 
 
 engine = create_engine(settings.SQLALCHEMY_DATABASE_URI, pool_pre_ping=True)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+class LazySession(object):
+    """
+    数据库会话代理
+    首次访问 Session 的属性或方法时才创建 Session，未使用数据库的请求不会创建 Session，
+    也不会从连接池取出连接
+    """
+    def __init__(self, session_factory: sessionmaker = SessionLocal) -> None:
+        self._session_factory = session_factory
+        self._session: Optional[Session] = None
+
+    @property
+    def touched(self) -> bool:
+        """
+        是否已创建 Session
+        """
+        return self._session is not None
+
+    def __getattr__(self, name: str) -> Any:
+        if self._session is None:
+            self._session = self._session_factory()
+        return getattr(self._session, name)
+
+    def close(self) -> None:
+        if self._session is not None:
+            self._session.close()
@@ -5,9 +5,16 @@ from fastapi.staticfiles import StaticFiles
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.middleware.cors import CORSMiddleware
 
+from app.api.deps import db_stats
 from app.api.router import api_router
 from app.core.config import settings
 from app.core.middleware import log_requests
+from app.core.rate_limit import RateLimitMiddleware, rate_limiter
+from app.core.reference import reference
+from app.core.stats import stats_reporter
+from app.core.wechat import wechat_client
+from app.db.async_redis import async_redis_conn_pool
+from app.db.async_session import async_engine
 from app.exceptions import (
     BizHTTPException, broad_exception_handler, http_exception_handler
 )
@@ -36,11 +43,26 @@ if settings.BACKEND_CORS_ORIGINS:
     )
 
 
-# 初始化静态文件目录
+# 定期写入日志的进程内计数器
+stats_reporter.register(db_stats, rate_limiter.stats)
+
+
+# 初始化静态文件目录，加载基础数据，启动计数器日志
 @app.on_event('startup')
 def startup_event():
     os.mkdir('static') if not os.path.exists('static') else ...
     os.mkdir('static/pics') if not os.path.exists('static/pics') else ...
+    reference.load()
+    stats_reporter.start()
+
+
+# 释放异步数据库连接池、异步Redis连接池、异步HTTP连接池，停止计数器日志
+@app.on_event('shutdown')
+async def shutdown_event():
+    stats_reporter.stop()
+    await async_engine.dispose()
+    await async_redis_conn_pool.disconnect()
+    await wechat_client.aclose()
 
 
 # 注册API路由
@@ -51,7 +73,8 @@ app.mount('/files', StaticFiles(directory=STATIC_PATH), name='static')
 # 注册自定义异常处理函数
 app.add_exception_handler(BizHTTPException, http_exception_handler)
 app.add_exception_handler(Exception, broad_exception_handler)
-# 注册中间件
+# 注册中间件，后注册的中间件先执行，限流在记录请求日志之后、路由之前
+app.add_middleware(RateLimitMiddleware, limiter=rate_limiter)
 app.add_middleware(BaseHTTPMiddleware, dispatch=log_requests)
 # 初始化日志
 init_logger()
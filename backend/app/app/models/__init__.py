@@ -13,7 +13,7 @@ from app.models.base import Base                                # noqa
 from app.models.classes import Apply4Class, Class, ClassMember  # noqa
 from app.models.feedback import Feedback, FeedbackImage         # noqa
 from app.models.page import HomepageMenu, EntrancePage           # noqa
-from app.models.school import School                            # noqa
+from app.models.school import School, SchoolQuarantine          # noqa
 from app.models.subject import Subject                          # noqa
 from app.models.system import Region, SysConfig                 # noqa
 from app.models.user import User                                # noqa
@@ -7,6 +7,7 @@
 ORM模型类 - 学校
 """
 
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.schema import Column
 from sqlalchemy.sql import text
 from sqlalchemy.types import BigInteger, Boolean, Integer, String
@@ -35,3 +36,25 @@ class School(Base):
     is_delete = Column(
         Boolean, server_default=text('False'), nullable=False, comment='是否删除'
     )
+
+
+class SchoolQuarantine(Base):
+    """
+    无法识别的学校
+    数据表: school_quarantine - 同步学校数据时无法匹配所属地区或学段的学校，
+    保存 API网关 返回的原始数据，地区、学段配置修正后重新匹配，无需再次请求 API网关
+    """
+    __tablename__ = 'school_quarantine'  # noqa
+
+    id = Column(
+        BigInteger, primary_key=True, autoincrement=True, comment='id，主键'
+    )
+    school_id = Column(
+        BigInteger, unique=True, nullable=False, comment='云平台 - 学校id'
+    )
+    reason = Column(
+        String(2), nullable=False,
+        comment='无法识别的原因: 1-所属地区不存在 2-所属地区不唯一 3-学段不存在'
+    )
+    data = Column(JSONB, nullable=False, comment='API网关 返回的学校数据')
+    run_id = Column(String(32), nullable=False, comment='最后一次发现该学校的同步的运行id')
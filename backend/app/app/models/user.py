@@ -9,7 +9,7 @@ ORM模型类 - 用户
 
 from sqlalchemy.schema import Column
 from sqlalchemy.sql import text
-from sqlalchemy.types import BigInteger, Boolean, String
+from sqlalchemy.types import BigInteger, Boolean, Integer, String
 
 from app.models.base import Base
 
@@ -30,5 +30,9 @@ class User(Base):
     is_delete = Column(
         Boolean, server_default=text('False'), nullable=False, comment='是否删除'
     )
+    ctx_version = Column(
+        Integer, server_default=text('0'), nullable=False,
+        comment='用户上下文版本号，当前班级成员id、是否删除变更时加一'
+    )
 
     __idx_list__ = ('openid', 'wx_name')
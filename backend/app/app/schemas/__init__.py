@@ -4,5 +4,5 @@ Schema - 结构体模型类 / 实体类
 
 from .msg import Code2SessionMsg, Msg, WXAccessTokenMsg
 from .response import Response
-from .token import Token, TokenPayload
+from .token import MemberContextClaim, Token, TokenPayload
 from .user import UserCreate
@@ -1,4 +1,4 @@
-from typing import Any
+from typing import Any, Optional
 
 from pydantic import BaseModel
 
@@ -8,10 +8,21 @@ class Token(BaseModel):
     token_type: str
 
 
+class MemberContextClaim(BaseModel):
+    """
+    Token中携带的用户上下文
+    mid: 当前班级成员id  dis: 是否停用  ver: 签发时的用户上下文版本号
+    """
+    mid: Optional[int] = None
+    dis: bool
+    ver: int
+
+
 class TokenPayload(BaseModel):
     iss: str
     aud: str
     sub: str
     flag: str
     sub_sign: str
+    ctx: Optional[MemberContextClaim] = None
     user: Any = None
@@ -7,8 +7,11 @@ from fastapi.testclient import TestClient
 from sqlalchemy.orm import Session
 from sqlalchemy.sql import and_
 
-from app.constants import DBConst
+from app.constants import DBConst, RespError
 from app.core.config import settings
+from app.core.sms_captcha import SmsCaptchaStore
+from app.core.wechat import access_token_provider
+from app.db.redis import redis
 from app.models import Class, ClassMember
 from app.tests.utils.utils import random_lower_string
 
@@ -32,7 +35,8 @@ def test_get_class_id_by_telephone(
 
     if not class_:
         class_ = Class(
-            school_id=fake_school_id, class_=fake_class, grade=fake_grade
+            school_id=fake_school_id, class_=fake_class, grade=fake_grade,
+            contact=fake_phone_no,
         )
         db.add(class_)
         db.commit()
@@ -53,14 +57,48 @@ def test_get_class_id_by_telephone(
         )
         db.add(headteacher)
         db.commit()
-    fake_phone_no = headteacher.telephone
+    # 按班级的联系电话（班主任的电话号码）查询
+    fake_phone_no = class_.contact
 
-    resp = client.get(
-        f'{settings.CLASS_MANAGER_STR}/classes/class_codes/',
+    resp = client.post(
+        f'{settings.CLASS_MANAGER_STR}/classes/class_codes/query',
         headers=token_headers,
-        params={'telephone': fake_phone_no}
+        json=fake_phone_no,
     )
     assert resp.status_code == 200
     content = resp.json()
     assert content
     assert content.get('class_code') == class_.id
+
+
+def test_join_request_captcha_locked(client: TestClient) -> None:
+    telephone = '13122222222'
+    key = f'{SmsCaptchaStore.FAILS_PREFIX}{telephone}'
+    redis.set(key, settings.SMS_CAPTCHA_MAX_ATTEMPTS, ex=60)
+    # 锁定期间在校验Token、查询班级之前拒绝，不携带Token也返回锁定
+    for path in ('teachers', 'students'):
+        resp = client.post(
+            f'{settings.CLASS_MANAGER_STR}/classes/{path}/join_request',
+            json={'name': 'name', 'subject_id': 1, 'family_relation': '1',
+                  'telephone': telephone, 'class_code': 1, 'captcha': 1},
+        )
+        assert resp.json()['statement'] \
+            == RespError.CAPTCHA_ATTEMPTS_EXCEEDED.statement
+    redis.delete(key)
+
+
+def test_invitation_wxacode_access_token(
+    client: TestClient, token_headers: dict, monkeypatch
+) -> None:
+    calls = []
+
+    def get() -> str:
+        calls.append(1)
+        return 'access-token'
+
+    monkeypatch.setattr(access_token_provider, 'get', get)
+    # 小程序码接口从 AccessTokenProvider 获取 access_token，不直接读取 Redis
+    resp = client.get(f'{settings.CLASS_MANAGER_STR}/classes/1/',
+                      headers=token_headers)
+    assert resp.status_code == 200
+    assert calls == [1]
@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Date: 2021/8/16
+# Author: gray
+
+from fastapi.testclient import TestClient
+
+from app.api import deps
+from app.api.deps import db_stats
+from app.core.config import settings
+from app.db.session import LazySession
+
+
+def test_subjects_untouched_db(
+    client: TestClient, token_headers: dict, monkeypatch
+) -> None:
+    sessions = []
+
+    class RecordedSession(LazySession):
+        def __init__(self) -> None:
+            super().__init__()
+            sessions.append(self)
+
+    monkeypatch.setattr(deps, 'LazySession', RecordedSession)
+    untouched = db_stats.get('untouched')
+    resp = client.get(f'{settings.CLASS_MANAGER_STR}/configurations/subjects',
+                      headers=token_headers)
+    assert resp.status_code == 200
+    # Token 携带用户上下文，读取基础数据注册表，整个请求不创建数据库会话
+    assert len(sessions) == 1
+    assert not sessions[0].touched
+    assert db_stats.get('untouched') == untouched + 1
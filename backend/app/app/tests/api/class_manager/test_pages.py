@@ -8,7 +8,7 @@ from sqlalchemy.orm import Session
 
 from app.core.config import settings
 from app.tests.utils.pages import (
-    create_random_slideshow,
+    create_random_guidance_page,
     create_random_homepage_menu,
 )
 
@@ -30,16 +30,31 @@ def test_homepage_menus(
     assert recent['icon'] == homepage_menu.icon
 
 
-def test_slideshows(client: TestClient, db: Session) -> None:
-    slideshow = create_random_slideshow(db)
-    resp = client.get(f'{settings.CLASS_MANAGER_STR}/pages/slideshows')
+def test_homepage_menus_not_modified(
+        client: TestClient, token_headers: dict, db: Session
+) -> None:
+    url = f'{settings.CLASS_MANAGER_STR}/pages/homepage_menus'
+    resp = client.get(url, headers=token_headers)
+    etag = resp.headers['ETag']
+    assert resp.headers['Cache-Control'].startswith('private')
+
+    resp = client.get(url, headers={**token_headers, 'If-None-Match': etag})
+    assert resp.status_code == 304
+
+    # 首页菜单变更后缓存失效
+    create_random_homepage_menu(db)
+    resp = client.get(url, headers={**token_headers, 'If-None-Match': etag})
+    assert resp.status_code == 200
+    assert resp.headers['ETag'] != etag
+
+
+def test_guidance_pages(client: TestClient, db: Session) -> None:
+    guidance_page = create_random_guidance_page(db)
+    resp = client.get(f'{settings.CLASS_MANAGER_STR}/pages/guidance_pages')
 
     assert resp.status_code == 200
     content = resp.json()
     assert content
     recent = content[0]
-    assert recent['src'] == slideshow.src
-    assert recent['desc'] == slideshow.desc
-    assert recent['target'] == slideshow.target
-    assert recent['herf'] == slideshow.herf
-    assert recent['name'] == slideshow.name
+    assert recent['src'] == guidance_page.src
+    assert recent['desc'] == guidance_page.desc
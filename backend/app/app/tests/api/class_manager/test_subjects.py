@@ -7,6 +7,7 @@ from fastapi.testclient import TestClient
 from sqlalchemy.orm import Session
 
 from app.core.config import settings
+from app.core.reference import reference
 from app.models import Subject
 
 
@@ -17,8 +18,11 @@ def test_subjects(client: TestClient, token_headers: dict, db: Session) -> None:
     if not db.query(Subject).filter(Subject.name == '数学').first():
         db.add(Subject(name='数学'))
         db.commit()
+    # 学科数据变更后重新加载基础数据
+    reference.bump()
     resp = client.get(
-        f'{settings.CLASS_MANAGER_STR}/subjects', headers=token_headers
+        f'{settings.CLASS_MANAGER_STR}/configurations/subjects',
+        headers=token_headers,
     )
     assert resp.status_code == 200
     content = resp.json()
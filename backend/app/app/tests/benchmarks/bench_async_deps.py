@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# _*_ coding: utf-8 _*_
+# Date: 2021/8/27
+# Author: gray
+
+"""
+基准测试 - 同步依赖链 与 异步依赖链 的并发能力
+两个路由的依赖链结构与 deps.get_db -> deps.get_token -> deps.get_activated 一致，
+鉴权依赖和路径函数各模拟一次耗时为 latency 的 I/O（数据库 / Redis 查询）：
+    /sync  同步依赖 + 同步路径函数，运行在线程池中，并发数受线程池大小限制
+    /async 异步依赖 + 异步路径函数，运行在事件循环中，并发数不受线程池大小限制
+统计 同时进行中的I/O数的峰值、总耗时、吞吐量
+
+运行: python -m app.tests.benchmarks.bench_async_deps [-c 并发数] [-l 延迟秒数]
+"""
+
+import argparse
+import asyncio
+import time
+
+import httpx
+from fastapi import Depends, FastAPI
+
+
+class InFlight(object):
+    """
+    统计同时进行中的I/O数及其峰值
+    """
+    def __init__(self) -> None:
+        self.current = 0
+        self.peak = 0
+
+    def enter(self) -> None:
+        self.current += 1
+        self.peak = max(self.peak, self.current)
+
+    def exit(self) -> None:
+        self.current -= 1
+
+
+def build_app(latency: float, in_flight: InFlight) -> FastAPI:
+    app = FastAPI()
+
+    def io():
+        in_flight.enter()
+        try:
+            time.sleep(latency)
+        finally:
+            in_flight.exit()
+
+    async def io_async():
+        in_flight.enter()
+        try:
+            await asyncio.sleep(latency)
+        finally:
+            in_flight.exit()
+
+    def get_db():
+        yield None
+
+    def get_token(_=Depends(get_db)):
+        io()
+        return 'token'
+
+    def get_activated(token=Depends(get_token)):
+        return token
+
+    async def get_async_db():
+        yield None
+
+    async def get_token_async(_=Depends(get_async_db)):
+        await io_async()
+        return 'token'
+
+    async def get_activated_async(token=Depends(get_token_async)):
+        return token
+
+    @app.get('/sync')
+    def sync_route(token=Depends(get_activated)):
+        io()
+        return token
+
+    @app.get('/async')
+    async def async_route(token=Depends(get_activated_async)):
+        await io_async()
+        return token
+
+    return app
+
+
+async def run(path: str, concurrency: int, latency: float) -> None:
+    in_flight = InFlight()
+    app = build_app(latency, in_flight)
+    async with httpx.AsyncClient(app=app, base_url='http://bench') as client:
+        started = time.perf_counter()
+        responses = await asyncio.gather(
+            *(client.get(path) for _ in range(concurrency))
+        )
+        elapsed = time.perf_counter() - started
+    assert all(resp.status_code == 200 for resp in responses)
+    print(f'{path:<7} requests={concurrency} '
+          f'peak concurrent I/O={in_flight.peak:<5}'
+          f'elapsed={elapsed:.2f}s throughput={concurrency / elapsed:.0f} req/s')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', type=int, default=400, help='并发请求数')
+    parser.add_argument('-l', type=float, default=0.05, help='每次I/O的延迟秒数')
+    args = parser.parse_args()
+
+    asyncio.run(run('/sync', args.c, args.l))
+    asyncio.run(run('/async', args.c, args.l))
+
+
+if __name__ == '__main__':
+    main()
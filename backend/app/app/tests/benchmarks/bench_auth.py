@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# _*_ coding: utf-8 _*_
+# Date: 2021/8/27
+# Author: gray
+
+"""
+基准测试 - 鉴权依赖 deps.get_token
+对比 每次请求都解析Token（缓存前）和 命中已校验Token缓存（缓存后）的耗时
+用户上下文预先写入进程内缓存，不访问数据库和Redis
+
+运行: python -m app.tests.benchmarks.bench_auth [-n 迭代次数]
+"""
+
+import argparse
+import timeit
+
+from fastapi.security.http import HTTPAuthorizationCredentials
+
+from app.api import deps
+from app.core import security
+from app.core.user_context import UserContext, user_context_cache
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=20000, help='迭代次数')
+    args = parser.parse_args()
+
+    user_id = 1
+    token = security.create_access_token(user_id, 'flag', 'sub_sign')
+    credentials = HTTPAuthorizationCredentials(scheme='Bearer',
+                                               credentials=token)
+    user_context_cache.local.set(user_id, UserContext(1, False), ttl=3600)
+
+    def uncached():
+        security.token_cache.clear()
+        deps.get_token(db=None, credentials=credentials)
+
+    def cached():
+        deps.get_token(db=None, credentials=credentials)
+
+    before = timeit.timeit(uncached, number=args.n)
+    cached()
+    after = timeit.timeit(cached, number=args.n)
+    print(f'iterations: {args.n}')
+    print(f'before (decode every time): {before / args.n * 1e6:.2f} us/call')
+    print(f'after  (token cache hit)  : {after / args.n * 1e6:.2f} us/call')
+    print(f'speedup: {before / after:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
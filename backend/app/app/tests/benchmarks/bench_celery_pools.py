@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# _*_ coding: utf-8 _*_
+# Date: 2021/9/4
+# Author: gray
+
+"""
+基准测试 - I/O 密集型任务在不同 worker 进程池下的吞吐量
+启动一个真实的 Celery worker 子进程（需要本地 Redis 作为 broker），
+微信 access_token 接口由本地模拟服务代替（每个请求延迟 -l 秒），
+发送 -n 个 get_wx_mini_program_access_token 任务，统计全部执行完的耗时，对比:
+    prefork -c 1 : 优化前的 worker（main-queue）
+    threads -c N : io-queue 的 worker
+任务发送到临时队列，不影响正在运行的 worker
+
+运行: python -m app.tests.benchmarks.bench_celery_pools [-n 任务数] [-l 延迟秒数] [-c 线程数]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+import uuid
+
+from app.tests.utils.fake_server import FakeServer
+
+
+def run(pool: str, concurrency: int, n: int, latency: float) -> float:
+    from app.worker import get_wx_mini_program_access_token
+
+    queue = f'bench-{uuid.uuid4().hex[:8]}'
+
+    def handler(*_):
+        return 200, {'access_token': 'bench_token', 'expires_in': 7200}
+
+    with FakeServer(handler, latency=latency) as server:
+        env = dict(os.environ, WX_ACCESS_TOKEN_URL=f'{server.url}/token')
+        worker = subprocess.Popen(
+            [sys.executable, '-m', 'celery', '-A', 'app.worker', 'worker',
+             '-l', 'warning', '-Q', queue, '-P', pool, '-c', str(concurrency),
+             '-n', f'{queue}@%h', '--without-gossip', '--without-mingle',
+             '--without-heartbeat'],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            # 预热：等待 worker 启动并执行完第一个任务
+            get_wx_mini_program_access_token.apply_async(queue=queue)
+            while server.requests < 1:
+                time.sleep(0.01)
+            started = time.perf_counter()
+            for _ in range(n):
+                get_wx_mini_program_access_token.apply_async(queue=queue)
+            while server.requests < n + 1:
+                time.sleep(0.005)
+            return time.perf_counter() - started
+        finally:
+            worker.terminate()
+            worker.wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=200, help='任务数')
+    parser.add_argument('-l', type=float, default=0.1, help='接口延迟秒数')
+    parser.add_argument('-c', type=int, default=50, help='线程池并发数')
+    args = parser.parse_args()
+
+    for pool, concurrency in (('prefork', 1), ('threads', args.c)):
+        elapsed = run(pool, concurrency, args.n, args.l)
+        print(f'{pool:<8} -c {concurrency:<3} tasks={args.n} '
+              f'elapsed={elapsed:.2f}s throughput={args.n / elapsed:.1f}/s')
+
+
+if __name__ == '__main__':
+    main()
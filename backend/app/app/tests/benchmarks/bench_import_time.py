@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# _*_ coding: utf-8 _*_
+# Date: 2021/9/1
+# Author: gray
+
+"""
+基准测试 - API、Celery worker 进程启动时导入模块的耗时
+在新的解释器中以 -X importtime 导入模块，统计:
+    wall   : 不加 -X importtime 时导入模块的总耗时（多次运行取中位数）
+    top    : 按顶层包汇总的导入耗时（各模块自身耗时之和，-X importtime 本身有开销，
+             只用于比较），耗时最多的 -t 个包
+    lazy   : 应在首次使用时才导入的模块，启动时被导入的会列出
+gunicorn worker 启动时导入 app.main，Celery worker 启动时导入 app.worker
+
+运行: python -m app.tests.benchmarks.bench_import_time [-m 模块 ...] [-r 运行次数]
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+from collections import Counter
+from typing import Dict, List, Tuple
+
+
+# 启动时不应导入，首次使用时才导入的模块
+LAZY_MODULES = {
+    'app.main': ['pandas', 'tencentcloud', 'raven', 'ijson', 'httpx',
+                 'app.core.internal'],
+    'app.worker': ['pandas', 'tencentcloud', 'raven', 'ijson', 'fastapi',
+                   'sqlalchemy', 'app.core.internal'],
+}
+
+
+def wall_time(module: str) -> float:
+    """
+    在新的解释器中导入模块，返回总耗时秒数
+    """
+    code = (f'import time; started = time.perf_counter(); import {module}; '
+            f'print(time.perf_counter() - started)')
+    result = subprocess.run([sys.executable, '-c', code],
+                            capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def import_time(module: str) -> List[Tuple[int, str]]:
+    """
+    在新的解释器中以 -X importtime 导入模块，返回 [(自身耗时微秒, 模块名)]
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, check=True,
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        modules.append((int(self_us), name.strip()))
+    return modules
+
+
+def by_package(modules: List[Tuple[int, str]]) -> Dict[str, int]:
+    packages = Counter()
+    for self_us, name in modules:
+        packages[name.split('.')[0]] += self_us
+    return packages
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-m', nargs='+', default=['app.main', 'app.worker'],
+                        help='模块')
+    parser.add_argument('-r', type=int, default=5, help='运行次数')
+    parser.add_argument('-t', type=int, default=10, help='列出耗时最多的包数')
+    args = parser.parse_args()
+
+    for module in args.m:
+        walls = [wall_time(module) for _ in range(args.r)]
+        modules = import_time(module)
+        print(f'{module}: wall={statistics.median(walls) * 1000:.0f}ms '
+              f'modules={len(modules)}')
+        for package, self_us in by_package(modules).most_common(args.t):
+            print(f'    {package:<20} {self_us / 1000:>7.1f}ms')
+        imported = {name for _, name in modules}
+        eager = [name for name in LAZY_MODULES.get(module, ())
+                 if name in imported]
+        print(f'    eagerly imported: {", ".join(eager) or "-"}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# _*_ coding: utf-8 _*_
+# Date: 2021/9/3
+# Author: gray
+
+"""
+基准测试 - 接口限流的开销
+在一个事件循环中并发调用 RateLimiter.hit（每次一次 Lua 脚本调用），
+-u 个用户各自使用一个限流 key，统计:
+    qps      : 每秒处理的限流判断次数
+    p50/p99  : 单次判断耗时
+    limited  : 被拒绝的次数（每个用户窗口内放行 -l 次）
+需要本地 Redis
+
+运行: python -m app.tests.benchmarks.bench_rate_limit [-n 请求数] [-c 并发数] [-u 用户数] [-l 上限]
+"""
+
+import argparse
+import asyncio
+import secrets
+import statistics
+import time
+
+from redis.asyncio import Redis as AsyncRedis
+
+from app.core.config import settings
+from app.core.rate_limit import RateLimiter, RatePolicy
+
+
+async def run(args) -> None:
+    async_redis = AsyncRedis(host=settings.REDIS_HOST,
+                             port=settings.REDIS_PORT,
+                             max_connections=args.c)
+    limiter = RateLimiter(async_redis)
+    policy = RatePolicy(f'bench_{secrets.token_hex(4)}', args.l, 60)
+    latencies = []
+
+    async def worker(index):
+        for i in range(index, args.n, args.c):
+            started = time.perf_counter()
+            await limiter.hit(policy, f'user_{i % args.u}')
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(args.c)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(f'requests={args.n} concurrency={args.c} users={args.u} '
+          f'qps={args.n / elapsed:.0f} '
+          f'p50={statistics.median(latencies) * 1e6:.0f}us '
+          f'p99={latencies[int(len(latencies) * 0.99)] * 1e6:.0f}us '
+          f'stats={limiter.stats.snapshot()}')
+    await async_redis.delete(*(
+        f'{limiter.KEY_PREFIX}{policy.name}_user_{i}' for i in range(args.u)
+    ))
+    await async_redis.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=20000, help='请求数')
+    parser.add_argument('-c', type=int, default=50, help='并发数')
+    parser.add_argument('-u', type=int, default=1000, help='用户数')
+    parser.add_argument('-l', type=int, default=10, help='每个用户窗口内的请求数上限')
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
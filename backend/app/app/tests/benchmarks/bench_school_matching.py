@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# _*_ coding: utf-8 _*_
+# Date: 2021/8/31
+# Author: gray
+
+"""
+基准测试 - 同步学校数据时匹配学校所属地区、学段的耗时
+使用 app/alembic/region.csv 中的全国地区数据，生成合成的学校数据，对比:
+    before : 每个学校用布尔掩码筛选 pandas DataFrame（优化前）
+    index  : AreaIndex、学段索引字典查找
+两种方式的匹配结果须一致，pandas 方式较慢，只运行前 -b 页
+
+运行: python -m app.tests.benchmarks.bench_school_matching [-n 学校数] [-s 每页数量]
+"""
+
+import argparse
+import csv
+import json
+import os
+import random
+import time
+from typing import List, Tuple
+
+import pandas as pd
+
+from app.core.internal import APIGateway, AreaIndex, build_stage_index
+from app.schemas.sync_school import SyncSchoolRespContent
+
+
+REGION_CSV = os.path.join(os.path.dirname(__file__), '..', '..',
+                          'alembic', 'region.csv')
+STAGES = [('1', '小学'), ('2', '初中'), ('3', '高中')]
+
+
+class Page(object):
+    """
+    一页 API网关接口的响应
+    """
+    def __init__(self, text: str) -> None:
+        self.text = text
+
+
+def load_areas() -> List[Tuple[int, str, str]]:
+    with open(REGION_CSV, encoding='utf8') as f:
+        rows = list(csv.DictReader(f))
+    names = {row['code']: row['name'] for row in rows}
+    return [
+        (int(row['code']), row['name'], names.get(row['parent_code']))
+        for row in rows if row['level'] == '3'
+    ]
+
+
+def make_pages(
+    areas: List[Tuple[int, str, str]], n: int, page_size: int
+) -> List[Page]:
+    rnd = random.Random(0)
+    schools = []
+    for i in range(n):
+        _, area_name, city_name = rnd.choice(areas)
+        if rnd.random() < 0.02:
+            area_name = f'未知区{i}'
+        if rnd.random() < 0.02:
+            city_name = '未知市'
+        stages = rnd.sample(['小学', '初中', '高中'], rnd.randint(1, 2))
+        if rnd.random() < 0.01:
+            stages.append('大学')
+        schools.append({
+            'schoolId': i, 'schoolName': f'学校{i}',
+            'periodName': ','.join(stages), 'cityName': city_name,
+            'areaName': area_name, 'status': 0 if i % 50 == 0 else 1,
+        })
+    total_page = (n + page_size - 1) // page_size
+    return [
+        Page(json.dumps({'data': {
+            'totalPage': total_page,
+            'list': schools[i:i + page_size],
+        }}, ensure_ascii=False))
+        for i in range(0, n, page_size)
+    ]
+
+
+def preprocess_resp_pandas(
+    resp: Page, sys_area: pd.DataFrame, sys_stage: pd.DataFrame
+) -> List[dict]:
+    """
+    优化前的 APIGateway.preprocess_resp，只保留匹配逻辑
+    """
+    content = SyncSchoolRespContent(**json.loads(resp.text))
+    valid_list = []
+    for school in content.data.list:
+        if school.status == 0:
+            continue
+        match_area = sys_area[sys_area['name'] == school.areaName]
+        if len(match_area) > 1:
+            match_area = sys_area[
+                (sys_area['name'] == school.areaName)
+                & (sys_area['parent_name'] == school.cityName)
+                ]
+        if len(match_area) != 1:
+            continue
+        region_code = int(match_area.iloc[0]['code'])
+        stages = []
+        for stage in school.periodName.split(','):
+            match_stage = sys_stage[sys_stage['stage_name'] == stage]
+            if len(match_stage) != 1:
+                continue
+            stages.append(match_stage.iloc[0]['key'])
+        valid_list.append((school.schoolId, region_code, ','.join(stages)))
+    return valid_list
+
+
+def match_page(
+    resp: Page, area_index: AreaIndex, stage_index: dict
+) -> List[dict]:
+    """
+    解析一页响应，用 APIGateway.match_school 匹配
+    """
+    content = SyncSchoolRespContent(**json.loads(resp.text))
+    valid_list = []
+    for school in content.data.list:
+        if school.status == 0:
+            continue
+        row, _ = APIGateway.match_school(school, area_index, stage_index)
+        if row is not None:
+            valid_list.append(row)
+    return valid_list
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=100000, help='学校数')
+    parser.add_argument('-s', type=int, default=1000, help='每页数量')
+    parser.add_argument('-b', type=int, default=3, help='pandas方式运行的页数')
+    args = parser.parse_args()
+    areas = load_areas()
+    pages = make_pages(areas, args.n, args.s)
+
+    started = time.perf_counter()
+    sys_area = pd.DataFrame(areas, columns=['code', 'name', 'parent_name'])
+    sys_stage = pd.DataFrame(STAGES, columns=['key', 'stage_name'])
+    before = [preprocess_resp_pandas(page, sys_area, sys_stage)
+              for page in pages[:args.b]]
+    elapsed = time.perf_counter() - started
+    print(f'before  pages={args.b} '
+          f'per page={elapsed / args.b * 1000:.1f}ms')
+
+    started = time.perf_counter()
+    area_index = AreaIndex(areas)
+    stage_index = build_stage_index(STAGES)
+    after = [match_page(page, area_index, stage_index) for page in pages]
+    elapsed = time.perf_counter() - started
+    print(f'index   pages={len(pages)} schools={args.n} '
+          f'per page={elapsed / len(pages) * 1000:.1f}ms '
+          f'total={elapsed:.2f}s')
+
+    # 学段无法识别的学校，优化前只去掉该学段，现在整体隔离
+    for old, new in zip(before, after):
+        new = [(school['school_id'], school['region_code'],
+                school['study_stage']) for school in new]
+        ids = {school_id for school_id, _, _ in new}
+        assert [school for school in old if school[0] in ids] == new
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# _*_ coding: utf-8 _*_
+# Date: 2021/9/1
+# Author: gray
+
+"""
+基准测试 - 同步学校数据时的内存峰值（RSS）与每页数量的关系
+使用本地模拟的 API网关，不写数据库（分批结果直接丢弃），对比:
+    before : 整页读取响应体，json.loads 后构建整页的 pydantic 模型、匹配结果列表（优化前）
+    stream : APIGateway.iter_school_batches，流式解析、按行数分批
+每种方式、每页数量在新的子进程中运行，内存峰值为 VmHWM 减去运行前的 RSS
+（ru_maxrss 在 fork+exec 后保留父进程的峰值，不适用）
+
+运行: python -m app.tests.benchmarks.bench_school_sync_memory [-n 学校数] [-s 每页数量 ...]
+"""
+
+import argparse
+import json
+import multiprocessing
+import time
+from typing import List, Tuple
+
+from app.core.internal import (
+    APIGateway, AreaIndex, SchoolPageFetcher, build_stage_index,
+)
+from app.schemas.sync_school import SyncSchoolRespContent
+from app.tests.utils.fake_server import FakeServer
+
+
+AREAS = [(110101, '东城区', '市辖区'), (320102, '玄武区', '南京市')]
+STAGES = [('1', '小学'), ('2', '初中'), ('3', '高中')]
+
+
+def make_pages(n: int, page_size: int) -> List[bytes]:
+    total_page = (n + page_size - 1) // page_size
+    pages = []
+    for start in range(0, n, page_size):
+        schools = [
+            {
+                'schoolId': i, 'schoolName': f'第{i}学校',
+                'parentOrgId': 1000 + i % 100, 'periodName': '小学,初中',
+                'currCpscode': 100000 + i, 'cityName': '南京市',
+                'areaName': '玄武区', 'address': f'玄武区某某路{i}号',
+                'status': 1, 'telephone': '025-12345678',
+            }
+            for i in range(start, min(start + page_size, n))
+        ]
+        pages.append(json.dumps(
+            {'data': {'totalPage': total_page, 'list': schools}},
+            ensure_ascii=False,
+        ).encode('utf8'))
+    return pages
+
+
+def read_status_kb(field: str) -> int:
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(f'{field}:'):
+                return int(line.split()[1])
+    return 0
+
+
+def run_before(fetcher: SchoolPageFetcher, area_index, stage_index) -> int:
+    def preprocess(resp) -> Tuple[int, int]:
+        content = SyncSchoolRespContent(**json.loads(resp.text))
+        valid_list = [
+            APIGateway.match_school(school, area_index, stage_index)
+            for school in content.data.list
+        ]
+        return content.data.totalPage, len(valid_list)
+
+    total_page, rows = preprocess(fetcher.fetch(1))
+    for _, resp in fetcher.iter_pages(2, total_page):
+        rows += preprocess(resp)[1]
+    return rows
+
+
+def run_stream(fetcher: SchoolPageFetcher, area_index, stage_index) -> int:
+    return sum(
+        len(batch.rows) for batch in APIGateway.iter_school_batches(
+            fetcher, area_index, stage_index
+        )
+    )
+
+
+def measure(mode: str, url: str, page_size: int, concurrency: int,
+            queue: multiprocessing.Queue) -> None:
+    area_index = AreaIndex(AREAS)
+    stage_index = build_stage_index(STAGES)
+    fetcher = SchoolPageFetcher(url=url, page_size=page_size,
+                                concurrency=concurrency, max_retries=0)
+    run = run_before if mode == 'before' else run_stream
+    baseline = read_status_kb('VmRSS')
+    started = time.perf_counter()
+    rows = run(fetcher, area_index, stage_index)
+    elapsed = time.perf_counter() - started
+    peak = read_status_kb('VmHWM')
+    queue.put((rows, elapsed, peak - baseline))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=100000, help='学校数')
+    parser.add_argument('-s', type=int, nargs='+',
+                        default=[1000, 10000, 50000], help='每页数量')
+    parser.add_argument('-c', type=int, default=8, help='并发获取的分页数')
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    for page_size in args.s:
+        pages = make_pages(args.n, page_size)
+
+        def handler(method, path, query, body):
+            return 200, pages[int(query['currPage']) - 1]
+
+        with FakeServer(handler) as server:
+            for mode in ('before', 'stream'):
+                queue = context.Queue()
+                process = context.Process(
+                    target=measure,
+                    args=(mode, server.url, page_size, args.c, queue),
+                )
+                process.start()
+                rows, elapsed, peak_kb = queue.get()
+                process.join()
+                print(f'{mode:<7} page size={page_size:<6} rows={rows} '
+                      f'elapsed={elapsed:.2f}s '
+                      f'peak rss delta={peak_kb / 1024:.1f}MB')
+
+
+if __name__ == '__main__':
+    main()
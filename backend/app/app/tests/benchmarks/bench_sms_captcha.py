@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# _*_ coding: utf-8 _*_
+# Date: 2021/9/2
+# Author: gray
+
+"""
+基准测试 - 短信验证码的发送、校验
+发送: 多个线程同时为同一批手机号请求验证码，对比:
+    before : GET send_flag，不存在时 SETEX send_flag、SETEX 验证码（优化前，3次往返）
+    lua    : SmsCaptchaStore.issue，Lua 脚本原子地检查并写入（1次往返）
+    统计:
+        qps       : 每秒处理的请求数
+        sent      : 判定为应发送短信的次数，每个手机号应只有 1 次
+        duplicate : 重复发送的次数（sent - 手机号数）
+校验: 多个线程对同一批手机号逐个猜测验证码（-g 次），对比:
+    before : GET 验证码，比较，正确时 DEL（优化前，2次往返，不限制错误次数）
+    lua    : SmsCaptchaStore.verify，Lua 脚本比较、删除并记录失败次数（1次往返）
+    统计:
+        qps     : 每秒处理的请求数
+        checked : 与验证码比较的猜测次数（锁定后的猜测不比较）
+需要本地 Redis
+
+运行: python -m app.tests.benchmarks.bench_sms_captcha [-p 手机号数] [-t 线程数]
+    [-r 每个线程每个手机号的请求数] [-g 每个线程每个手机号的猜测次数]
+"""
+
+import argparse
+import threading
+import time
+
+from app.core.sms_captcha import SmsCaptchaStore, VerifyResult
+from app.db.redis import redis
+
+
+SEND_INTERVAL = 60
+EXPIRE = 300
+MAX_ATTEMPTS = 5
+LOCKOUT = 900
+# 发送的验证码，猜测的验证码从 0 开始，不会猜中
+CAPTCHA = 999999
+
+
+def issue_before(telephone: str, captcha: int) -> bool:
+    if redis.get(f'send_flag_{telephone}'):
+        return False
+    redis.setex(f'send_flag_{telephone}', SEND_INTERVAL, 1)
+    redis.setex(f'sms_captcha_{telephone}', EXPIRE, captcha)
+    return True
+
+
+def verify_before(telephone: str, captcha: int) -> bool:
+    correct_captcha = redis.get(f'sms_captcha_{telephone}')
+    if not correct_captcha or str(captcha) != correct_captcha:
+        return True
+    redis.delete(f'sms_captcha_{telephone}')
+    return True
+
+
+def run(call, telephones, threads: int, repeat: int):
+    """
+    每个线程对每个手机号调用 repeat 次 call(手机号, 序号)，返回 (耗时, call 返回真的次数)
+    """
+    barrier = threading.Barrier(threads)
+    counts = [0] * threads
+
+    def worker(index):
+        barrier.wait()
+        for i in range(repeat):
+            for telephone in telephones:
+                if call(telephone, index * repeat + i):
+                    counts[index] += 1
+
+    workers = [threading.Thread(target=worker, args=(i,))
+               for i in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return time.perf_counter() - started, sum(counts)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-p', type=int, default=2000, help='手机号数')
+    parser.add_argument('-t', type=int, default=16, help='线程数')
+    parser.add_argument('-r', type=int, default=1,
+                        help='每个线程每个手机号的请求数')
+    parser.add_argument('-g', type=int, default=10,
+                        help='每个线程每个手机号的猜测次数')
+    args = parser.parse_args()
+
+    store = SmsCaptchaStore(redis, SEND_INTERVAL, EXPIRE,
+                            MAX_ATTEMPTS, LOCKOUT)
+    telephones = [f'1990000{i:04d}' for i in range(args.p)]
+
+    def clear():
+        for telephone in telephones:
+            store.revoke(telephone)
+            redis.delete(f'sms_captcha_fails_{telephone}')
+
+    def verify_lua(telephone: str, captcha: int) -> bool:
+        return store.verify(telephone, captcha) != VerifyResult.LOCKED
+
+    print('issue:')
+    for mode, issue in {'before': issue_before, 'lua': store.issue}.items():
+        clear()
+        elapsed, sent = run(issue, telephones, args.t, args.r)
+        requests = args.p * args.t * args.r
+        print(f'    {mode:<6} requests={requests} '
+              f'qps={requests / elapsed:.0f} '
+              f'sent={sent} duplicate={sent - args.p}')
+
+    print('verify:')
+    for mode, verify in {'before': verify_before, 'lua': verify_lua}.items():
+        clear()
+        for telephone in telephones:
+            store.issue(telephone, CAPTCHA)
+        elapsed, checked = run(verify, telephones, args.t, args.g)
+        requests = args.p * args.t * args.g
+        print(f'    {mode:<6} requests={requests} '
+              f'qps={requests / elapsed:.0f} checked={checked}')
+    clear()
+
+
+if __name__ == '__main__':
+    main()
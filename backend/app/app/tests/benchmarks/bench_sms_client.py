@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# _*_ coding: utf-8 _*_
+# Date: 2021/9/3
+# Author: gray
+
+"""
+基准测试 - 发送一条短信的任务耗时
+使用本地模拟的腾讯云短信接口（HTTP，不含 TLS 握手，实际环境中新建连接的开销更大），对比:
+    before : 每次任务新建 Credential、HttpProfile、ClientProfile、SmsClient 和连接（优化前）
+    after  : SmsClientFactory.get，复用当前线程的客户端和长连接
+统计 单次任务耗时的 p50/p99、其中获取客户端的耗时、建立的连接数
+
+运行: python -m app.tests.benchmarks.bench_sms_client [-n 任务数] [-l 接口延迟秒数]
+"""
+
+import argparse
+import statistics
+import time
+from urllib.parse import urlparse
+
+from tencentcloud.sms.v20210111 import models
+
+from app.core.sms import SmsClientFactory, create_sms_client
+from app.tests.utils.fake_server import FakeServer
+from app.tests.utils.sms import FakeSms
+
+
+def send(client, i: int) -> None:
+    req = models.SendSmsRequest()
+    req.SmsSdkAppId = '1400000000'
+    req.SignName = 'sign'
+    req.TemplateId = 'tpl'
+    req.TemplateParamSet = [f'{i:06d}', '5']
+    req.PhoneNumberSet = [f'+86131{i:08d}']
+    client.SendSms(req)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=2000, help='任务数')
+    parser.add_argument('-l', type=float, default=0, help='接口延迟秒数')
+    args = parser.parse_args()
+
+    for mode in ('before', 'after'):
+        with FakeServer(FakeSms(), latency=args.l) as server:
+            endpoint = urlparse(server.url).netloc
+            factory = SmsClientFactory(endpoint=endpoint, protocol='http')
+            if mode == 'before':
+                def get_client():
+                    return create_sms_client(endpoint=endpoint,
+                                             protocol='http')
+            else:
+                get_client = factory.get
+            totals, setups = [], []
+            for i in range(args.n):
+                started = time.perf_counter()
+                client = get_client()
+                setups.append(time.perf_counter() - started)
+                send(client, i)
+                totals.append(time.perf_counter() - started)
+        totals.sort()
+        print(f'{mode:<7} tasks={args.n} '
+              f'p50={statistics.median(totals) * 1e6:.0f}us '
+              f'p99={totals[int(len(totals) * 0.99)] * 1e6:.0f}us '
+              f'client setup p50={statistics.median(setups) * 1e6:.0f}us '
+              f'connections={server.connections}')
+
+
+if __name__ == '__main__':
+    main()
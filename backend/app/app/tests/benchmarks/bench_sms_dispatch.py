@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# _*_ coding: utf-8 _*_
+# Date: 2021/9/3
+# Author: gray
+
+"""
+基准测试 - 单个 Celery worker 发送一批短信的耗时
+使用本地模拟的腾讯云短信接口（每个请求延迟 -l 秒），发送 -n 条短信，对比:
+    before : 每条短信新建客户端、一次 SendSms 请求（优化前）
+    batch  : SmsDispatcher，模板参数相同的合并为一次请求，不同组的请求并发发送
+分两种场景:
+    captcha : 每条短信的验证码不同（模板参数各不相同）
+    notice  : 所有短信的模板参数相同
+统计 耗时、SendSms 请求数、建立的连接数
+
+运行: python -m app.tests.benchmarks.bench_sms_dispatch [-n 短信数] [-l 延迟秒数]
+"""
+
+import argparse
+import time
+from urllib.parse import urlparse
+
+from tencentcloud.sms.v20210111 import models
+
+from app.core.sms import (
+    SmsClientFactory, SmsDispatcher, SmsJob, create_sms_client,
+)
+from app.tests.utils.fake_server import FakeServer
+from app.tests.utils.sms import FakeSms
+
+
+def run_before(endpoint: str, jobs) -> None:
+    for job in jobs:
+        client = create_sms_client(endpoint=endpoint, protocol='http')
+        req = models.SendSmsRequest()
+        req.SmsSdkAppId = '1400000000'
+        req.SignName = 'sign'
+        req.TemplateId = job.template_id
+        req.TemplateParamSet = list(job.params)
+        req.PhoneNumberSet = [f'+86{job.telephone}']
+        client.SendSms(req)
+
+
+def run_batch(endpoint: str, jobs) -> None:
+    dispatcher = SmsDispatcher(
+        SmsClientFactory(endpoint=endpoint, protocol='http'),
+        sdk_app_id='1400000000', sign_name='sign', max_wait=0.3,
+    )
+    for job in jobs:
+        dispatcher.submit(job)
+    dispatcher.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=1000, help='短信数')
+    parser.add_argument('-l', type=float, default=0.02, help='接口延迟秒数')
+    args = parser.parse_args()
+
+    scenarios = {
+        'captcha': [SmsJob(f'rid{i}', f'131{i:08d}', 'tpl', (f'{i:06d}', '5'))
+                    for i in range(args.n)],
+        'notice': [SmsJob(f'rid{i}', f'131{i:08d}', 'tpl', ('1', '5'))
+                   for i in range(args.n)],
+    }
+    for scenario, jobs in scenarios.items():
+        for mode, run in (('before', run_before), ('batch', run_batch)):
+            fake_sms = FakeSms()
+            with FakeServer(fake_sms, latency=args.l) as server:
+                started = time.perf_counter()
+                run(urlparse(server.url).netloc, jobs)
+                elapsed = time.perf_counter() - started
+            print(f'{scenario:<8} {mode:<7} messages={args.n} '
+                  f'elapsed={elapsed:.2f}s requests={server.requests} '
+                  f'connections={server.connections}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# _*_ coding: utf-8 _*_
+# Date: 2021/8/31
+# Author: gray
+
+"""
+基准测试 - 登录时签发Token的吞吐量
+对比:
+    before : AESCrypto.encrypt 加密 openid、session_key + create_access_token（优化前）
+    issue  : TokenIssuer.issue 逐个签发
+    batch  : TokenIssuer.issue_many 批量签发
+
+运行: python -m app.tests.benchmarks.bench_token_minting [-n 签发数]
+"""
+
+import argparse
+import time
+from typing import Callable
+
+from app import schemas
+from app.core import security
+from app.core.config import settings
+
+
+def report(name: str, n: int, func: Callable[[], None]) -> None:
+    started = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - started
+    print(f'{name:<7} tokens={n} elapsed={elapsed:.2f}s '
+          f'throughput={n / elapsed:.0f}/s')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=20000, help='签发数')
+    args = parser.parse_args()
+
+    context = schemas.MemberContextClaim(mid=1, dis=False, ver=1)
+    claims = [
+        security.TokenClaims(i, f'openid_{i:022d}', 'session_key_base64==',
+                             context)
+        for i in range(args.n)
+    ]
+
+    def before():
+        for claim in claims:
+            flag = security.AESCrypto.encrypt(
+                claim.openid, settings.AES_KEY, settings.AES_IV
+            )
+            sub_sign = security.AESCrypto.encrypt(
+                claim.session_key, settings.AES_KEY, settings.AES_IV
+            )
+            security.create_access_token(
+                claim.user_id, flag, sub_sign, context=claim.context
+            )
+
+    def issue():
+        for claim in claims:
+            security.token_issuer.issue(*claim)
+
+    def batch():
+        security.token_issuer.issue_many(claims)
+
+    report('before', args.n, before)
+    report('issue', args.n, issue)
+    report('batch', args.n, batch)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# _*_ coding: utf-8 _*_
+# Date: 2021/8/30
+# Author: gray
+
+"""
+基准测试 - 登录时请求微信 auth.code2Session 的吞吐量
+使用本地模拟的微信服务，对比:
+    before : 每次请求新建连接、无超时（优化前的 requests.get）
+    pooled : WeChatClient 同步方法，连接池复用长连接
+    async  : WeChatClient 异步方法
+sync 的两种方式使用线程池模拟路径函数所在的线程池
+
+运行: python -m app.tests.benchmarks.bench_wechat_login [-n 请求数] [-c 并发数]
+"""
+
+import argparse
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from app.core.wechat import CircuitBreaker, WeChatClient
+from app.tests.utils.fake_server import FakeServer
+
+
+def code2session(method, path, query, body):
+    return 200, {'openid': f'openid_{query["js_code"]}',
+                 'session_key': 'session_key'}
+
+
+def report(name: str, n: int, elapsed: float, server: FakeServer) -> None:
+    print(f'{name:<7} logins={n} elapsed={elapsed:.2f}s '
+          f'throughput={n / elapsed:.0f}/s connections={server.connections}')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=2000, help='请求数')
+    parser.add_argument('-c', type=int, default=40, help='并发数')
+    parser.add_argument('-l', type=float, default=0.005, help='微信接口延迟秒数')
+    args = parser.parse_args()
+
+    with FakeServer(code2session, latency=args.l) as server:
+        url = f'{server.url}/sns/jscode2session'
+
+        def before(i):
+            resp = requests.get(url, params={'js_code': i})
+            assert resp.json()['openid']
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(args.c) as executor:
+            list(executor.map(before, range(args.n)))
+        report('before', args.n, time.perf_counter() - started, server)
+
+    with FakeServer(code2session, latency=args.l) as server:
+        client = WeChatClient(
+            'appid', 'secret', f'{server.url}/sns/jscode2session',
+            connect_timeout=3, read_timeout=5, max_retries=2,
+            pool_size=args.c, breaker=CircuitBreaker(5, 30),
+        )
+
+        def pooled(i):
+            assert client.code2session(str(i)).openid
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(args.c) as executor:
+            list(executor.map(pooled, range(args.n)))
+        report('pooled', args.n, time.perf_counter() - started, server)
+
+    with FakeServer(code2session, latency=args.l) as server:
+        client = WeChatClient(
+            'appid', 'secret', f'{server.url}/sns/jscode2session',
+            connect_timeout=3, read_timeout=5, max_retries=2,
+            pool_size=args.c, breaker=CircuitBreaker(5, 30),
+        )
+
+        async def run():
+            semaphore = asyncio.Semaphore(args.c)
+
+            async def login(i):
+                async with semaphore:
+                    msg = await client.code2session_async(str(i))
+                    assert msg.openid
+
+            await asyncio.gather(*(login(i) for i in range(args.n)))
+            await client.aclose()
+
+        started = time.perf_counter()
+        asyncio.run(run())
+        report('async', args.n, time.perf_counter() - started, server)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# _*_ coding: utf-8 _*_
+# Date: 2021/9/4
+# Author: gray
+
+"""
+基准测试 - 获取微信 access_token
+冷启动（Redis 中没有 access_token）时 -p 个进程各 -t 个线程同时获取，
+微信接口由本地模拟服务代替（每个请求延迟 -l 秒），对比:
+    naive    : 读取 Redis，不存在时直接请求微信并写入（无锁、无 single-flight）
+    provider : AccessTokenProvider
+统计 请求微信接口的次数（每次请求都会使之前的 access_token 在 5 分钟后失效）、
+全部获取完成的耗时，以及 provider 命中进程内缓存、Redis 时单次获取的耗时
+需要本地 Redis
+
+运行: python -m app.tests.benchmarks.bench_wx_access_token [-p 进程数] [-t 线程数] [-l 延迟秒数]
+"""
+
+import argparse
+import multiprocessing
+import threading
+import time
+import timeit
+
+from app.core.wechat import AccessTokenProvider, CircuitBreaker, WeChatClient
+from app.db.redis import redis
+from app.tests.utils.fake_server import FakeServer
+
+
+KEY = 'bench_wx_access_token'
+
+
+class BenchAccessTokenProvider(AccessTokenProvider):
+    KEY = KEY
+    LOCK_KEY = 'bench_wx_access_token_lock'
+
+
+def build_provider(url: str) -> AccessTokenProvider:
+    client = WeChatClient(
+        'appid', 'secret', f'{url}/sns/jscode2session',
+        connect_timeout=3, read_timeout=3, max_retries=0, pool_size=50,
+        breaker=CircuitBreaker(failure_threshold=100, reset_timeout=1),
+        access_token_url=f'{url}/cgi-bin/token',
+    )
+    return BenchAccessTokenProvider(client, redis, refresh_ahead=300,
+                                    lock_timeout=30, wait_timeout=10)
+
+
+def naive_get(provider: AccessTokenProvider) -> str:
+    token = redis.get(KEY)
+    if token:
+        return token
+    msg = provider.client.get_access_token()
+    redis.set(KEY, msg.access_token, ex=msg.expires_in - 300)
+    return msg.access_token
+
+
+def process(mode: str, url: str, threads: int, start) -> None:
+    provider = build_provider(url)
+    get = provider.get if mode == 'provider' else \
+        (lambda: naive_get(provider))
+    barrier = threading.Barrier(threads)
+
+    def worker():
+        barrier.wait()
+        get()
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start.wait()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-p', type=int, default=8, help='进程数')
+    parser.add_argument('-t', type=int, default=20, help='每个进程的线程数')
+    parser.add_argument('-l', type=float, default=0.1, help='接口延迟秒数')
+    args = parser.parse_args()
+
+    def handler(*_):
+        return 200, {'access_token': 'token', 'expires_in': 7200}
+
+    context = multiprocessing.get_context('fork')
+    with FakeServer(handler, latency=args.l) as server:
+        for mode in ('naive', 'provider'):
+            redis.delete(KEY)
+            requests = server.requests
+            start = context.Event()
+            processes = [
+                context.Process(target=process,
+                                args=(mode, server.url, args.t, start))
+                for _ in range(args.p)
+            ]
+            for p in processes:
+                p.start()
+            time.sleep(0.5)
+            started = time.perf_counter()
+            start.set()
+            for p in processes:
+                p.join()
+            elapsed = time.perf_counter() - started
+            print(f'{mode:<9} callers={args.p * args.t} '
+                  f'wx requests={server.requests - requests} '
+                  f'elapsed={elapsed:.2f}s')
+
+        provider = build_provider(server.url)
+        n = 20000
+        local = timeit.timeit(provider.get, number=n) / n
+        provider._local = None
+        redis_hit = timeit.timeit(
+            lambda: (setattr(provider, '_local', None), provider.get()),
+            number=n // 10,
+        ) / (n // 10)
+        print(f'provider  local hit={local * 1e6:.2f}us '
+              f'redis hit={redis_hit * 1e6:.0f}us')
+    redis.delete(KEY)
+
+
+if __name__ == '__main__':
+    main()
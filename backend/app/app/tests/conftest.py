@@ -1,11 +1,17 @@
+import os
 from typing import Dict, Generator
 
 import pytest
 from fastapi.testclient import TestClient
 
-from app.db.session import SessionLocal
-from app.main import app
-from app.tests.utils.utils import get_access_token
+# 接口测试照常经过限流中间件，但使用较高的限流上限，短时间内重复运行测试时，
+# 之前运行的请求仍在滑动窗口内计数，不应使测试请求被拒绝；须在导入 app 之前设置
+for name in ('LOGIN', 'JOIN_REQUEST', 'CLASS_CODE_QUERY', 'SMS_CAPTCHA'):
+    os.environ.setdefault(f'RATE_LIMIT_{name}', '10000')
+
+from app.db.session import SessionLocal  # noqa: E402
+from app.main import app  # noqa: E402
+from app.tests.utils.utils import get_access_token  # noqa: E402
 
 
 @pytest.fixture(scope="session")
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# _*_ coding: utf-8 _*_
+# Date: 2021/8/27
+# Author: gray
+
+import time
+
+from app.core.cache import LocalCache
+from app.core.user_context import UserContext, UserContextCache
+from app.db.async_redis import async_redis
+from app.db.redis import redis
+from app.schemas import MemberContextClaim
+
+
+def test_local_cache_lru() -> None:
+    cache = LocalCache('test', maxsize=2, ttl=60)
+    cache.set(1, 'a')
+    cache.set(2, 'b')
+    assert cache.get(1) == 'a'
+    cache.set(3, 'c')
+    assert cache.get(2) is None
+    assert cache.get(1) == 'a'
+    assert cache.get(3) == 'c'
+    assert cache.stats.snapshot() == {'hit': 3, 'miss': 1}
+
+
+def test_local_cache_ttl() -> None:
+    cache = LocalCache('test', maxsize=2, ttl=0.01)
+    cache.set(1, 'a')
+    time.sleep(0.02)
+    assert cache.get(1) is None
+    cache.set(1, 'a', ttl=60)
+    assert cache.get(1) == 'a'
+
+
+def clear_user_context(cache: UserContextCache, user_id: int) -> None:
+    redis.delete(f'{cache.KEY_PREFIX}{user_id}',
+                 f'{cache.VERSION_KEY_PREFIX}{user_id}')
+
+
+def test_user_context_cache() -> None:
+    user_id = -1
+    loaded = []
+
+    def loader():
+        loaded.append(user_id)
+        return UserContext(current_member_id=100, is_delete=False,
+                           ctx_version=len(loaded))
+
+    cache = UserContextCache(redis, async_redis, local_size=10, local_ttl=60,
+                             redis_ttl=60)
+    clear_user_context(cache, user_id)
+    assert cache.get(user_id, loader) == (100, False, 1)
+    assert cache.get(user_id, loader) == (100, False, 1)
+    assert len(loaded) == 1
+    # 查询数据库后写入版本号
+    assert cache.get_version(user_id) == 1
+    # 进程内缓存失效后从Redis读取
+    cache.local.clear()
+    assert cache.get(user_id, loader) == (100, False, 1)
+    assert len(loaded) == 1
+    # invalidate 后重新查询数据库
+    cache.invalidate(user_id, 2)
+    assert cache.get(user_id, loader) == (100, False, 2)
+    assert len(loaded) == 2
+    assert cache.stats.snapshot() == {
+        'local_hit': 1, 'redis_hit': 1, 'db_load': 2
+    }
+    clear_user_context(cache, user_id)
+
+
+def test_user_context_claim() -> None:
+    user_id = -2
+    loaded = []
+
+    def loader():
+        loaded.append(user_id)
+        return UserContext(current_member_id=200, is_delete=False,
+                           ctx_version=2)
+
+    cache = UserContextCache(redis, async_redis, local_size=10, local_ttl=60,
+                             redis_ttl=60)
+    clear_user_context(cache, user_id)
+    claim = MemberContextClaim(mid=100, dis=False, ver=1)
+    # Redis 中没有版本号时不使用 claim
+    assert cache.get_version(user_id) is None
+    cache.publish_version(user_id, 1)
+    assert cache.get(user_id, loader, claim=claim) == (100, False, 1)
+    assert not loaded
+    # 版本号增加后 claim 失效，旧版本号不会覆盖新版本号
+    cache.invalidate(user_id, 2)
+    cache.publish_version(user_id, 1)
+    assert cache.get_version(user_id) == 2
+    assert cache.get(user_id, loader, claim=claim) == (200, False, 2)
+    assert len(loaded) == 1
+    assert cache.stats.get('claim_hit') == 1
+    clear_user_context(cache, user_id)
@@ -0,0 +1,22 @@
+#!/usr/bin/env python
+# _*_ coding: utf-8 _*_
+# Date: 2021/9/4
+# Author: gray
+
+from app import worker
+from app.core.celery_app import celery_app
+
+
+def route(name: str) -> str:
+    return celery_app.amqp.router.route({}, name)['queue'].name
+
+
+def test_task_routes() -> None:
+    assert route(worker.send_sms_captcha.name) == 'io-queue'
+    assert route(worker.get_wx_mini_program_access_token.name) == 'io-queue'
+    assert route(worker.sync_school_data.name) == 'cpu-queue'
+    assert route(worker.retry_quarantined_schools.name) == 'cpu-queue'
+    # app.worker 中的任务都须配置路由
+    tasks = {name for name in celery_app.tasks
+             if name.startswith('app.worker.')}
+    assert tasks == set(celery_app.conf.task_routes)
@@ -3,11 +3,436 @@
 # Date: 2021/8/3
 # Author: gray
 
+import json
+import random
+import threading
 
+import pytest
 from sqlalchemy.orm import Session
 
-from app.core.internal import APIGateway
+from app.core.internal import (
+    APIGateway, AreaIndex, ResumableSchoolSync, SchoolPageFetcher,
+    SyncSchoolError, build_stage_index, copy_text,
+)
+from app.constants import DBConst
+from app.db.redis import redis
+from app.models import School, SchoolQuarantine
+from app.tests.utils.fake_server import FakeServer
 
 
 def test_sync_school_data(db: Session) -> None:
     APIGateway.sync_school_data(db)
+
+
+def test_update_school_data_unchanged(db: Session) -> None:
+    base_id = -random.randint(1, 10 ** 12) * 10
+    schools = [
+        {
+            'name': f'学校{i}', 'region_code': 110101, 'address': None,
+            'study_stage': '1', 'school_id': base_id - i,
+            'parent_org_id': None, 'curr_cpscode': None, 'data_source': '1',
+        }
+        for i in range(3)
+    ]
+    counts = APIGateway.update_school_data(db, schools)
+    assert counts == {'inserted': 3, 'updated': 0, 'unchanged': 0}
+    # 只更新同步字段有变化的学校
+    schools[0]['address'] = '地址'
+    counts = APIGateway.update_school_data(db, schools)
+    assert counts == {'inserted': 0, 'updated': 1, 'unchanged': 2}
+    counts = APIGateway.update_school_data(db, schools)
+    assert counts == {'inserted': 0, 'updated': 0, 'unchanged': 3}
+
+    db.query(School).filter(
+        School.school_id.in_([school['school_id'] for school in schools])
+    ).delete(synchronize_session=False)
+    db.commit()
+
+
+def test_area_index() -> None:
+    index = AreaIndex([
+        (110101, '东城区', '市辖区'),
+        (320102, '玄武区', '南京市'),
+        (330102, '鼓楼区', '杭州市'),
+        (320106, '鼓楼区', '南京市'),
+    ])
+    assert index.match('东城区', '其他') == 110101
+    assert index.match('鼓楼区', '南京市') == 320106
+    assert index.match('鼓楼区', '其他') is None
+    assert index.match('未知区', '南京市') is None
+    assert index.candidates('鼓楼区', '其他') == (330102, 320106)
+    assert index.candidates('未知区', '南京市') == ()
+
+
+def test_build_stage_index() -> None:
+    index = build_stage_index([('1', '小学'), ('2', '初中'), ('3', '初中')])
+    assert index == {'小学': '1'}
+
+
+class FakeAPIGateway(object):
+    """
+    模拟 API网关 列出学校信息 接口，fail_pages 中的页码返回 503 的次数
+    """
+    def __init__(self, total_page: int, fail_pages: dict) -> None:
+        self.total_page = total_page
+        self.fail_pages = dict(fail_pages)
+        self._lock = threading.Lock()
+
+    def __call__(self, method, path, query, body):
+        page_no = int(query['currPage'])
+        with self._lock:
+            if self.fail_pages.get(page_no, 0) > 0:
+                self.fail_pages[page_no] -= 1
+                return 503, {}
+        return 200, {'data': {'totalPage': self.total_page, 'list': []},
+                     'page': page_no}
+
+
+def test_school_page_fetcher() -> None:
+    gateway = FakeAPIGateway(2000, fail_pages={7: 1, 1500: 2})
+    with FakeServer(gateway, latency=0.002) as server:
+        fetcher = SchoolPageFetcher(url=server.url, page_size=10,
+                                    concurrency=16, max_retries=2, backoff=0)
+        pages = [
+            (page_no, resp.json()['page'])
+            for page_no, resp in fetcher.iter_pages(2, 2000)
+        ]
+    assert pages == [(i, i) for i in range(2, 2001)]
+    assert fetcher.stats.get('retry') == 3
+    # 复用长连接
+    assert server.connections <= 16
+
+
+def test_school_page_fetcher_failure() -> None:
+    gateway = FakeAPIGateway(100, fail_pages={50: 10, 80: 10})
+    with FakeServer(gateway, latency=0.002) as server:
+        fetcher = SchoolPageFetcher(url=server.url, page_size=10,
+                                    concurrency=8, max_retries=1, backoff=0)
+        fetched = []
+        with pytest.raises(SyncSchoolError, match='page 50'):
+            for page_no, _ in fetcher.iter_pages(2, 100):
+                fetched.append(page_no)
+    # 失败页之前的分页按顺序全部返回
+    assert fetched == list(range(2, 50))
+
+
+def test_iter_school_batches() -> None:
+    def handler(method, path, query, body):
+        page_no = int(query['currPage'])
+        schools = [
+            {
+                'schoolId': page_no * 10 + i, 'schoolName': f'学校{i}',
+                'periodName': '小学', 'cityName': '市辖区',
+                'areaName': '未知区' if i == 0 else '东城区',
+                'status': 0 if i == 1 else 1,
+            }
+            for i in range(5)
+        ]
+        # 总页数在学校列表之后
+        return 200, json.dumps({
+            'data': {'list': schools, 'totalPage': 3}
+        }).encode('utf8')
+
+    area_index = AreaIndex([(110101, '东城区', '市辖区')])
+    with FakeServer(handler) as server:
+        fetcher = SchoolPageFetcher(url=server.url, page_size=5,
+                                    concurrency=2, max_retries=0)
+        batches = list(APIGateway.iter_school_batches(
+            fetcher, area_index, {'小学': '1'}, batch_size=3
+        ))
+    # 每页 1 所停用、1 所无法匹配地区、3 所已识别，按行数分批
+    assert [batch.size for batch in batches] == [3, 3, 3, 3, 0]
+    # 分页的最后一行所在的批次之后才完成
+    assert [batch.pages for batch in batches] == [
+        [], [(1, 3)], [(2, 3)], [], [(3, 3)],
+    ]
+    rows = [row['school_id'] for batch in batches for row in batch.rows]
+    assert rows == [i * 10 + j for i in (1, 2, 3) for j in (2, 3, 4)]
+    quarantined = [
+        (school['school_id'], school['reason'], school['data']['areaName'])
+        for batch in batches for school in batch.quarantined
+    ]
+    assert quarantined == [
+        (i * 10, DBConst.AREA_NOT_FOUND, '未知区') for i in (1, 2, 3)
+    ]
+
+
+def test_iter_school_batches_read_retry() -> None:
+    attempts = []
+
+    def handler(method, path, query, body):
+        schools = [
+            {
+                'schoolId': i, 'schoolName': f'学校{i}', 'periodName': '小学',
+                'cityName': '市辖区', 'areaName': '东城区', 'status': 1,
+            }
+            for i in range(4)
+        ]
+        content = json.dumps({
+            'data': {'totalPage': 1, 'list': schools}
+        }).encode('utf8')
+        attempts.append(query['currPage'])
+        if len(attempts) == 1:
+            # 响应体在第三所学校中间中断
+            content = content[:content.index(b'"schoolId": 2') + 5]
+        return 200, content
+
+    area_index = AreaIndex([(110101, '东城区', '市辖区')])
+    with FakeServer(handler) as server:
+        fetcher = SchoolPageFetcher(url=server.url, page_size=4,
+                                    concurrency=1, max_retries=1, backoff=0)
+        batches = list(APIGateway.iter_school_batches(
+            fetcher, area_index, {'小学': '1'}
+        ))
+    # 重新获取该页，跳过已返回的学校
+    assert attempts == ['1', '1']
+    assert fetcher.stats.get('retry') == 1
+    assert [row['school_id'] for row in batches[0].rows] == [0, 1, 2, 3]
+    assert batches[0].pages == [(1, 1)]
+
+
+def test_sync_school_data_duplicated(db: Session) -> None:
+    base_id = -random.randint(1, 10 ** 12) * 10
+
+    def school(i, name):
+        return {
+            'schoolId': base_id - i, 'schoolName': name, 'periodName': '小学',
+            'cityName': '市辖区', 'areaName': '东城区', 'status': 1,
+        }
+
+    # 学校0 跨页重复出现，两页在同一批中更新
+    pages = [
+        [school(0, '学校0'), school(1, '学校1')],
+        [school(0, '学校0新'), school(2, '学校2')],
+    ]
+
+    def handler(method, path, query, body):
+        page = pages[int(query['currPage']) - 1]
+        return 200, {'data': {'totalPage': len(pages), 'list': page}}
+
+    with FakeServer(handler) as server:
+        fetcher = SchoolPageFetcher(url=server.url, page_size=2,
+                                    concurrency=1, max_retries=0)
+        counts = APIGateway.sync_school_data(db, fetcher)
+    assert counts == {'inserted': 3, 'updated': 0, 'unchanged': 0,
+                      'quarantined': 0}
+    # 以最后一页的数据为准
+    assert db.query(School.name).filter(
+        School.school_id == base_id
+    ).scalar() == '学校0新'
+
+    db.query(School).filter(
+        School.school_id.between(base_id - 9, base_id)
+    ).delete(synchronize_session=False)
+    db.commit()
+
+
+def test_copy_text() -> None:
+    assert copy_text(None) == '\\N'
+    assert copy_text(True) == 't'
+    assert copy_text(12) == '12'
+    assert copy_text('a\tb\\c\n') == 'a\\tb\\\\c\\n'
+
+
+def test_resync_school_data(db: Session) -> None:
+    base_id = -random.randint(1, 10 ** 12) * 10
+
+    def school(i, name=None, area='东城区', status=1):
+        return {
+            'schoolId': base_id - i, 'schoolName': name or f'学校{i}',
+            'periodName': '小学', 'cityName': '市辖区', 'areaName': area,
+            'status': status,
+        }
+
+    def row(i, name=None):
+        return {
+            'name': name or f'学校{i}', 'region_code': 110101,
+            'address': None, 'study_stage': '1', 'school_id': base_id - i,
+            'parent_org_id': None, 'curr_cpscode': None, 'data_source': '1',
+        }
+
+    # 0: 未变化 1: 有变化 2: 已不存在 3: 无法匹配地区 4: 已停用 5: 新增
+    APIGateway.update_school_data(db, [row(i) for i in range(5)])
+    pages = [
+        [school(0), school(1, name='新名称')],
+        [school(3, area='未知区'), school(4, status=0)],
+        [school(5), school(5, name='学校5\t新')],
+    ]
+
+    def handler(method, path, query, body):
+        page = pages[int(query['currPage']) - 1]
+        if page is None:
+            return 500, {}
+        return 200, {'data': {'totalPage': len(pages), 'list': page}}
+
+    def query_schools():
+        return {
+            base_id - school_.school_id: (school_.name, school_.is_delete)
+            for school_ in db.query(School).filter(
+                School.school_id.between(base_id - 9, base_id)
+            ).populate_existing()
+        }
+
+    before = query_schools()
+    with FakeServer(handler) as server:
+        # 获取分页失败时回滚
+        fetcher = SchoolPageFetcher(url=server.url, page_size=2,
+                                    concurrency=2, max_retries=0)
+        pages.append(None)
+        with pytest.raises(SyncSchoolError, match='page 4'):
+            APIGateway.resync_school_data(
+                db, soft_delete=True, fetcher=fetcher
+            )
+        assert query_schools() == before
+        pages.pop()
+
+        counts = APIGateway.resync_school_data(
+            db, soft_delete=True, fetcher=fetcher
+        )
+    assert counts['rows'] == 5
+    assert counts['inserted'] == 1
+    assert counts['updated'] == 1
+    assert counts['unchanged'] == 1
+    assert counts['deleted'] >= 2
+    assert counts['quarantined'] == 1
+    assert query_schools() == {
+        0: ('学校0', False),
+        1: ('新名称', False),
+        2: ('学校2', True),
+        3: ('学校3', False),
+        4: ('学校4', True),
+        5: ('学校5\t新', False),
+    }
+    quarantined = db.query(SchoolQuarantine).filter(
+        SchoolQuarantine.school_id.between(base_id - 9, base_id)
+    ).all()
+    assert [(base_id - school.school_id, school.reason)
+            for school in quarantined] == [(3, DBConst.AREA_NOT_FOUND)]
+    assert quarantined[0].data['areaName'] == '未知区'
+
+    db.query(School).filter(
+        School.school_id.between(base_id - 9, base_id)
+    ).delete(synchronize_session=False)
+    db.query(SchoolQuarantine).filter(
+        SchoolQuarantine.school_id.between(base_id - 9, base_id)
+    ).delete(synchronize_session=False)
+    db.commit()
+
+
+def test_resumable_school_sync(db: Session) -> None:
+    base_id = -random.randint(1, 10 ** 12) * 10
+    total_page = 6
+    requested = []
+    failing = {4}
+
+    def handler(method, path, query, body):
+        page_no = int(query['currPage'])
+        requested.append(page_no)
+        if page_no in failing:
+            return 500, {}
+        school = {
+            'schoolId': base_id - page_no, 'schoolName': f'学校{page_no}',
+            'periodName': '小学', 'cityName': '市辖区', 'areaName': '东城区',
+            'status': 1,
+        }
+        return 200, {'data': {'totalPage': total_page, 'list': [school]}}
+
+    sync = ResumableSchoolSync(redis, lock_timeout=60, checkpoint_expire=60)
+    redis.delete(sync.CHECKPOINT_KEY, sync.LOCK_KEY)
+    with FakeServer(handler) as server:
+        fetcher = SchoolPageFetcher(url=server.url, page_size=1,
+                                    concurrency=1, max_retries=0)
+        # 中断时保留最后完成的页码
+        with pytest.raises(SyncSchoolError, match='page 4'):
+            sync.run(db, fetcher)
+        checkpoint = redis.hgetall(sync.CHECKPOINT_KEY)
+        assert checkpoint['last_page'] == '3'
+        assert checkpoint['inserted'] == '3'
+        run_id = checkpoint['run_id']
+
+        # 已有同步在运行时跳过
+        lock = redis.lock(sync.LOCK_KEY, timeout=60)
+        assert lock.acquire(blocking=False)
+        assert sync.run(db, fetcher) is None
+        lock.release()
+
+        # 从中断处继续，不再请求已完成的分页
+        failing.clear()
+        requested.clear()
+        assert sync.load_checkpoint()[0] == run_id
+        counts = sync.run(db, fetcher)
+    assert sorted(requested) == [4, 5, 6]
+    assert counts == {'inserted': 6, 'updated': 0, 'unchanged': 0,
+                      'quarantined': 0}
+    assert not redis.exists(sync.CHECKPOINT_KEY)
+    assert not redis.exists(sync.LOCK_KEY)
+
+    db.query(School).filter(
+        School.school_id.between(base_id - 9, base_id)
+    ).delete(synchronize_session=False)
+    db.commit()
+
+
+def test_quarantine(db: Session) -> None:
+    base_id = -random.randint(1, 10 ** 12) * 10
+
+    def school(i, area='东城区', stage='小学'):
+        return {
+            'schoolId': base_id - i, 'schoolName': f'学校{i}',
+            'periodName': stage, 'cityName': '市辖区', 'areaName': area,
+            'status': 1,
+        }
+
+    # 1: 地区不存在 2: 学段不存在，同一次同步中重复出现
+    pages = [
+        [school(0), school(1, area='未知区'), school(2, stage='大学')],
+        [school(2, stage='大学,小学')],
+    ]
+
+    def handler(method, path, query, body):
+        page = pages[int(query['currPage']) - 1]
+        return 200, {'data': {'totalPage': len(pages), 'list': page}}
+
+    def query_quarantine():
+        return {
+            base_id - school_.school_id: (school_.reason, school_.run_id)
+            for school_ in db.query(SchoolQuarantine).filter(
+                SchoolQuarantine.school_id.between(base_id - 9, base_id)
+            ).populate_existing()
+        }
+
+    with FakeServer(handler) as server:
+        fetcher = SchoolPageFetcher(url=server.url, page_size=3,
+                                    concurrency=1, max_retries=0)
+        counts = APIGateway.sync_school_data(db, fetcher, run_id='run1')
+    assert counts['inserted'] == 1
+    assert counts['quarantined'] == 3
+    assert query_quarantine() == {
+        1: (DBConst.AREA_NOT_FOUND, 'run1'),
+        2: (DBConst.STAGE_NOT_FOUND, 'run1'),
+    }
+    # 同一次同步中只写入第一次出现的数据
+    data = db.query(SchoolQuarantine.data).filter(
+        SchoolQuarantine.school_id == base_id - 2
+    ).scalar()
+    assert data['periodName'] == '大学'
+
+    # 学段修正后重新匹配，不请求 API网关
+    db.query(SchoolQuarantine).filter(
+        SchoolQuarantine.school_id == base_id - 2
+    ).update({'data': school(2)}, synchronize_session=False)
+    db.commit()
+    counts = APIGateway.retry_quarantined_schools(db)
+    assert counts['resolved'] >= 1
+    assert query_quarantine() == {1: (DBConst.AREA_NOT_FOUND, 'run1')}
+    assert db.query(School.name).filter(
+        School.school_id == base_id - 2
+    ).scalar() == '学校2'
+
+    db.query(School).filter(
+        School.school_id.between(base_id - 9, base_id)
+    ).delete(synchronize_session=False)
+    db.query(SchoolQuarantine).filter(
+        SchoolQuarantine.school_id.between(base_id - 9, base_id)
+    ).delete(synchronize_session=False)
+    db.commit()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# _*_ coding: utf-8 _*_
+# Date: 2021/9/3
+# Author: gray
+
+import secrets
+
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from redis.asyncio import Redis as AsyncRedis
+from starlette.types import ASGIApp
+
+from app.core import security
+from app.core.config import Settings, settings
+from app.core.rate_limit import RateLimiter, RateLimitMiddleware, RatePolicy
+from app.db.redis import redis
+
+
+def make_app(
+    limiter: RateLimiter, redis_: AsyncRedis, calls: list,
+    client: tuple = None,
+) -> ASGIApp:
+    app = FastAPI()
+    app.add_middleware(RateLimitMiddleware, limiter=limiter)
+
+    def get_db():
+        # 模拟创建数据库会话的依赖，被拒绝的请求不应执行
+        calls.append(1)
+
+    @app.get('/codes/{code}')
+    def get_code(code: str, _=Depends(get_db)):
+        return {'code': code}
+
+    @app.get('/free')
+    def free(_=Depends(get_db)):
+        return {}
+
+    async def asgi(scope, receive, send):
+        # TestClient 每个请求使用新的事件循环，请求结束后断开异步Redis连接
+        if client is not None:
+            # 模拟经反向代理转发的请求
+            scope['client'] = client
+        try:
+            await app(scope, receive, send)
+        finally:
+            await redis_.connection_pool.disconnect()
+
+    return asgi
+
+
+def test_rate_limit() -> None:
+    name = f'test_{secrets.token_hex(4)}'
+    async_redis = AsyncRedis(host=settings.REDIS_HOST,
+                             port=settings.REDIS_PORT)
+    limiter = RateLimiter(async_redis)
+    limiter.add('GET', '/codes/{code}', RatePolicy(name, 3, 60))
+    calls = []
+    token = security.create_access_token(1, 'flag', 'sub_sign')
+    headers = {'Authorization': f'Bearer {token}'}
+
+    with TestClient(make_app(limiter, async_redis, calls)) as client:
+        for i in range(3):
+            assert client.get(f'/codes/{i}', headers=headers).status_code == 200
+        resp = client.get('/codes/3', headers=headers)
+        assert resp.status_code == 403
+        assert resp.json()['statement'] == 'User requests too frequently'
+        assert 0 < int(resp.headers['Retry-After']) <= 60
+        assert len(calls) == 3
+        # 按用户计数，无Token的请求按客户端IP计数
+        assert client.get('/codes/4').status_code == 200
+        # 未配置限流策略的接口不限流
+        for _ in range(5):
+            assert client.get('/free', headers=headers).status_code == 200
+
+    assert limiter.stats.snapshot() == {
+        'allowed': 4, 'limited': 1, f'limited_{name}': 1,
+    }
+    assert redis.zcard(f'rate_limit_{name}_user_1') == 3
+    redis.delete(f'rate_limit_{name}_user_1',
+                 f'rate_limit_{name}_ip_testclient')
+
+
+def test_forwarded_client() -> None:
+    name = f'test_{secrets.token_hex(4)}'
+    async_redis = AsyncRedis(host=settings.REDIS_HOST,
+                             port=settings.REDIS_PORT)
+    limiter = RateLimiter(async_redis, trusted_proxies=['172.16.0.0/12'])
+    limiter.add('GET', '/codes/{code}', RatePolicy(name, 1, 60, by_user=False))
+    app = make_app(limiter, async_redis, [], client=('172.18.0.5', 40000))
+
+    with TestClient(app) as client:
+        # 经可信代理转发的不同客户端分别计数
+        for ip in ('1.1.1.1', '2.2.2.2'):
+            headers = {'X-Forwarded-For': f'10.0.0.1, {ip}'}
+            assert client.get('/codes/1', headers=headers).status_code == 200
+            assert client.get('/codes/1', headers=headers).status_code == 403
+        assert client.get(
+            '/codes/1', headers={'X-Real-IP': '3.3.3.3'}
+        ).status_code == 200
+
+    assert limiter.stats.snapshot() == {
+        'allowed': 3, 'limited': 2, f'limited_{name}': 2,
+    }
+    redis.delete(*(f'rate_limit_{name}_ip_{ip}'
+                   for ip in ('1.1.1.1', '2.2.2.2', '3.3.3.3')))
+
+
+def test_client_ip() -> None:
+    limiter = RateLimiter(AsyncRedis(),
+                          trusted_proxies=['127.0.0.1', '10.0.0.0/8'])
+
+    def client_ip(client, headers):
+        return limiter.client_ip({
+            'client': client,
+            'headers': [(k.encode(), v.encode()) for k, v in headers],
+        })
+
+    forwarded = [('x-forwarded-for', '9.9.9.9, 1.1.1.1, 10.0.0.2')]
+    # 从右向左跳过可信代理，左侧可由客户端伪造的地址不使用
+    assert client_ip(('127.0.0.1', 1), forwarded) == '1.1.1.1'
+    # 直接连接的地址不是可信代理时不读取转发请求头
+    assert client_ip(('8.8.8.8', 1), forwarded) == '8.8.8.8'
+    assert client_ip(('127.0.0.1', 1), [('x-real-ip', '1.1.1.1')]) \
+        == '1.1.1.1'
+    assert client_ip(('127.0.0.1', 1), []) == '127.0.0.1'
+    assert client_ip(None, forwarded) == 'unknown'
+
+
+def test_default_trusted_proxies() -> None:
+    default = Settings.__fields__['RATE_LIMIT_TRUSTED_PROXIES'].default
+    limiter = RateLimiter(AsyncRedis(), trusted_proxies=default)
+    headers = [(b'x-forwarded-for', b'1.1.1.1')]
+    # 默认只信任本机，内网中其他主机、容器携带的 X-Forwarded-For 不使用
+    assert limiter.client_ip({'client': ('127.0.0.1', 1),
+                              'headers': headers}) == '1.1.1.1'
+    assert limiter.client_ip({'client': ('10.0.0.5', 1),
+                              'headers': headers}) == '10.0.0.5'
+
+
+def test_match() -> None:
+    limiter = RateLimiter(AsyncRedis())
+    policy = RatePolicy('login', 1, 60, by_user=False)
+    limiter.add('GET', '/api/access_tokens/{code}', policy)
+    assert limiter.match('GET', '/api/access_tokens/abc') is policy
+    assert limiter.match('POST', '/api/access_tokens/abc') is None
+    assert limiter.match('GET', '/api/access_tokens/abc/x') is None
+    assert limiter.match('GET', '/api/access_tokens') is None
+
+
+def test_disabled() -> None:
+    limiter = RateLimiter(AsyncRedis(), enabled=False)
+    limiter.add('GET', '/codes/{code}', RatePolicy('codes', 1, 60))
+    assert limiter.match('GET', '/codes/1') is None
@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+# _*_ coding: utf-8 _*_
+# Date: 2021/8/31
+# Author: gray
+
+import pytest
+
+from app.constants import DBConst
+from app.core.reference import ReferenceData
+
+
+def test_reference_data() -> None:
+    data = ReferenceData(
+        1,
+        subjects=[(1, '语文'), (2, '数学')],
+        configs=[(2, 'father', '父亲'), (1, '1', '小学')],
+        areas=[(110101, '东城区', '市辖区')],
+    )
+    assert data.subject_ids == {1, 2}
+    assert data.subjects[0] == {'code': 1, 'name': '语文'}
+    assert data.config_exists(DBConst.FAMILY_RELATION, 'father')
+    assert not data.config_exists(DBConst.FAMILY_RELATION, '1')
+    assert data.get_configs(DBConst.SCHOOL_STUDY_STAGE) == (
+        {'key': '1', 'value': '小学'},
+    )
+    assert data.get_configs('unknown') == ()
+    assert data.areas[110101] == ('东城区', '市辖区')
+    assert data.area_exists(110101)
+    assert not data.area_exists(110102)
+    # 基础数据不可修改
+    with pytest.raises(TypeError):
+        data.subjects[0]['name'] = '英语'
+    with pytest.raises(TypeError):
+        data.areas[110102] = ('西城区', '市辖区')
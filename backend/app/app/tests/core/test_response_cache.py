@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# _*_ coding: utf-8 _*_
+# Date: 2021/8/31
+# Author: gray
+
+from starlette.requests import Request
+
+from app.core.response_cache import ResponseCache
+from app.db.redis import redis
+
+
+def make_request(etag: str = None) -> Request:
+    headers = [(b'if-none-match', etag.encode())] if etag else []
+    return Request({'type': 'http', 'headers': headers})
+
+
+def test_response_cache() -> None:
+    version_key = 'test_response_cache_version'
+    redis.delete(version_key)
+    loaded = []
+
+    def loader():
+        loaded.append(1)
+        return [{'id': len(loaded), 'title': '首页'}]
+
+    cache = ResponseCache('test', redis, version_key=version_key,
+                          version_ttl=60, max_age=60)
+    resp = cache.response(make_request(), 'menus', loader)
+    assert resp.status_code == 200
+    assert resp.body == '[{"id":1,"title":"首页"}]'.encode('utf8')
+    assert resp.headers['Cache-Control'] == 'public, max-age=60'
+    etag = resp.headers['ETag']
+
+    # 命中缓存，If-None-Match 与 ETag 一致时返回 304
+    resp = cache.response(make_request(etag), 'menus', loader)
+    assert resp.status_code == 304
+    assert resp.headers['ETag'] == etag
+    assert len(loaded) == 1
+
+    # 版本号增加后重新查询
+    cache.bump()
+    resp = cache.response(make_request(etag), 'menus', loader)
+    assert resp.status_code == 200
+    assert resp.headers['ETag'] != etag
+    assert len(loaded) == 2
+    assert cache.stats.snapshot() == {'miss': 2, 'hit': 1, 'not_modified': 1}
+    redis.delete(version_key)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# _*_ coding: utf-8 _*_
+# Date: 2021/8/27
+# Author: gray
+
+from datetime import timedelta
+
+import pytest
+from jose import jwt
+
+from app import schemas
+from app.core import security
+
+
+def test_decode_access_token_cached() -> None:
+    token = security.create_access_token(1, 'flag', 'sub_sign')
+    security.token_cache.clear()
+    security.token_cache.stats.reset()
+    payload = security.decode_access_token(token)
+    payload.user = 'modified'
+    cached = security.decode_access_token(token)
+    assert cached.sub == '1'
+    assert cached.user is None
+    assert security.token_cache.stats.get('hit') == 1
+
+
+def test_decode_expired_access_token() -> None:
+    token = security.create_access_token(
+        1, 'flag', 'sub_sign', expires_delta=timedelta(seconds=-1)
+    )
+    security.token_cache.clear()
+    with pytest.raises(jwt.ExpiredSignatureError):
+        security.decode_access_token(token)
+    assert len(security.token_cache) == 0
+
+
+def test_token_issuer() -> None:
+    issuer = security.TokenIssuer(
+        'secret', 'k' * 16, 'i' * 16, expires_delta=timedelta(minutes=5)
+    )
+    # 与 AESCrypto.encrypt 结果一致
+    for raw in ('openid', 'o' * 16, 'session_key=='):
+        assert issuer.encrypt(raw) == security.AESCrypto.encrypt(
+            raw, 'k' * 16, 'i' * 16
+        )
+
+    context = schemas.MemberContextClaim(mid=1, dis=False, ver=2)
+    token = issuer.issue(1, 'openid', 'session_key', context)
+    claims = jwt.decode(token, 'secret', algorithms=[security.ALGORITHM],
+                        audience=security.AUDIENCE)
+    assert claims['sub'] == '1'
+    assert claims['ctx'] == context.dict()
+    assert security.AESCrypto.decrypt(
+        claims['flag'], 'k' * 16, 'i' * 16
+    ) == 'openid'
+
+    tokens = issuer.issue_many(
+        security.TokenClaims(i, f'openid_{i}', 'session_key')
+        for i in range(3)
+    )
+    assert [
+        jwt.get_unverified_claims(token)['sub'] for token in tokens
+    ] == ['0', '1', '2']
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# _*_ coding: utf-8 _*_
+# Date: 2021/9/3
+# Author: gray
+
+import threading
+import time
+from urllib.parse import urlparse
+
+from app.core.config import settings
+from app.core.sms import SmsClientFactory, SmsDispatcher, SmsJob, SmsResult
+from app.tests.utils.fake_server import FakeServer
+from app.tests.utils.sms import FakeSms
+
+
+def make_dispatcher(server: FakeServer, **kwargs) -> SmsDispatcher:
+    endpoint = urlparse(server.url).netloc
+    return SmsDispatcher(
+        SmsClientFactory(endpoint=endpoint, protocol='http'),
+        sdk_app_id='1400000000', sign_name='sign', **kwargs,
+    )
+
+
+def test_flush() -> None:
+    fake_sms = FakeSms()
+    with FakeServer(fake_sms) as server:
+        dispatcher = make_dispatcher(server, max_wait=10, batch_size=2)
+        jobs = [
+            SmsJob('rid0', '13100000000', 'tpl', ('1', '5')),
+            SmsJob('rid1', '13100000001', 'tpl', ('1', '5')),
+            SmsJob('rid2', '13000000000', 'tpl', ('1', '5')),
+            SmsJob('rid3', '13100000003', 'tpl', ('2', '5')),
+            # 同一手机号、同一模板参数的重复任务只发送一次
+            SmsJob('rid4', '13100000003', 'tpl', ('2', '5')),
+        ]
+        for job in jobs:
+            dispatcher.submit(job)
+        results = dispatcher.flush()
+        dispatcher.close()
+
+    assert sorted(fake_sms.requests) == [
+        (('1', '5'), ['+8613000000000']),
+        (('1', '5'), ['+8613100000000', '+8613100000001']),
+        (('2', '5'), ['+8613100000003']),
+    ]
+    assert sorted(results) == [
+        SmsResult('rid0', '13100000000', 'Ok', 'send success'),
+        SmsResult('rid1', '13100000001', 'Ok', 'send success'),
+        SmsResult('rid2', '13000000000',
+                  'LimitExceeded.PhoneNumberDailyLimit', 'send success'),
+        SmsResult('rid3', '13100000003', 'Ok', 'send success'),
+        SmsResult('rid4', '13100000003', 'Ok', 'send success'),
+    ]
+    assert dispatcher.stats.snapshot() == {
+        'submitted': 5, 'requests': 3, 'sent': 4, 'failed': 1,
+    }
+
+
+def test_background_flush() -> None:
+    fake_sms = FakeSms()
+    with FakeServer(fake_sms) as server:
+        dispatcher = make_dispatcher(server, max_wait=10)
+        for i in range(300):
+            dispatcher.submit(
+                SmsJob(f'rid{i}', f'131{i:08d}', 'tpl', ('1', '5'))
+            )
+        # close 前发送缓冲区中的任务
+        dispatcher.close()
+
+    # 缓冲区满 200 个手机号时后台线程不等待 max_wait 立即发送，
+    # 后台线程取出任务前可能又提交了几个，其余的分组与线程调度有关
+    sizes = [len(numbers) for _, numbers in fake_sms.requests]
+    assert 200 in sizes
+    assert max(sizes) == 200
+    assert sum(sizes) == 300
+    assert dispatcher.stats.get('sent') == 300
+
+
+def test_server_error() -> None:
+    def handler(*_):
+        return 200, {'Response': {
+            'Error': {'Code': 'InternalError', 'Message': 'internal error'},
+            'RequestId': 'request-id',
+        }}
+
+    with FakeServer(handler) as server:
+        dispatcher = make_dispatcher(server, max_wait=10)
+        dispatcher.submit(SmsJob('rid0', '13100000000', 'tpl', ('1', '5')))
+        results = dispatcher.flush()
+
+    assert results == [SmsResult('rid0', '13100000000',
+                                 'InternalError', 'internal error')]
+    assert dispatcher.stats.get('failed') == 1
+
+
+def test_client_factory(monkeypatch) -> None:
+    fake_sms = FakeSms()
+    with FakeServer(fake_sms) as server:
+        factory = SmsClientFactory(endpoint=urlparse(server.url).netloc,
+                                   protocol='http', idle_timeout=60)
+        dispatcher = SmsDispatcher(factory, sdk_app_id='1400000000',
+                                   sign_name='sign', max_wait=10)
+        for i in range(3):
+            dispatcher.send_batch('tpl', ('1', '5'),
+                                  [SmsJob(f'rid{i}', '13100000000', 'tpl',
+                                          ('1', '5'))])
+        # 同一线程复用客户端和连接
+        assert server.connections == 1
+        assert factory.stats.snapshot() == {'created': 1, 'reused': 2}
+        client = factory.get()
+
+        # 空闲超时后重新创建
+        factory.idle_timeout = 0
+        assert factory.get() is not client
+        assert factory.stats.get('reconnect') == 1
+        factory.idle_timeout = 60
+        client = factory.get()
+
+        # 网络错误后丢弃
+        factory.discard()
+        assert factory.get() is not client
+        client = factory.get()
+
+        # 配置变更后重新创建
+        monkeypatch.setattr(settings, 'TENCENT_CLOUD_SECRET_KEY', 'new_key')
+        assert factory.get() is not client
+        client = factory.get()
+
+        # fork 后的子进程重新创建
+        factory._pid = -1
+        assert factory.get() is not client
+        assert factory.stats.get('created') == 4
+
+
+def test_unexpected_error(monkeypatch) -> None:
+    fake_sms = FakeSms()
+    with FakeServer(fake_sms) as server:
+        dispatcher = make_dispatcher(server, max_wait=0.01)
+        send_batch = dispatcher.send_batch
+        calls = []
+
+        def broken_send_batch(*args):
+            calls.append(args)
+            if len(calls) == 1:
+                raise AttributeError('conn')
+            return send_batch(*args)
+
+        monkeypatch.setattr(dispatcher, 'send_batch', broken_send_batch)
+        dispatcher.submit(SmsJob('rid0', '13100000000', 'tpl', ('1', '5')))
+        while not calls:
+            time.sleep(0.01)
+        # 后台线程未退出，之后提交的任务继续发送
+        dispatcher.submit(SmsJob('rid1', '13100000001', 'tpl', ('1', '5')))
+        dispatcher.close()
+
+    assert fake_sms.requests == [(('1', '5'), ['+8613100000001'])]
+    assert dispatcher.stats.snapshot() == {
+        'submitted': 2, 'requests': 1, 'sent': 1, 'failed': 1,
+    }
+
+
+def test_restart_dead_thread() -> None:
+    fake_sms = FakeSms()
+    with FakeServer(fake_sms) as server:
+        dispatcher = make_dispatcher(server, max_wait=0.01)
+        dispatcher._thread = threading.Thread(target=lambda: None)
+        dispatcher._thread.start()
+        dispatcher._thread.join()
+        # 后台线程已退出时，submit 重新启动
+        dispatcher.submit(SmsJob('rid0', '13100000000', 'tpl', ('1', '5')))
+        assert dispatcher._thread.is_alive()
+        dispatcher.close()
+
+    assert dispatcher.stats.get('sent') == 1
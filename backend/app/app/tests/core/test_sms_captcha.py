@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# _*_ coding: utf-8 _*_
+# Date: 2021/9/2
+# Author: gray
+
+import random
+import threading
+
+from app.core.sms_captcha import SmsCaptchaStore, VerifyResult
+from app.db.redis import redis
+
+
+def random_telephone() -> str:
+    return f'1{random.randint(3000000000, 8999999999)}'
+
+
+def make_store() -> SmsCaptchaStore:
+    return SmsCaptchaStore(redis, send_interval=60, expire=300,
+                           max_attempts=3, lockout=900)
+
+
+def test_issue() -> None:
+    store = make_store()
+    telephone = random_telephone()
+    assert store.issue(telephone, 123456)
+    assert redis.get(f'sms_captcha_{telephone}') == '123456'
+    assert 55 < redis.ttl(f'send_flag_{telephone}') <= 60
+    assert 295 < redis.ttl(f'sms_captcha_{telephone}') <= 300
+    # 发送过于频繁时不覆盖验证码
+    assert not store.issue(telephone, 654321)
+    assert redis.get(f'sms_captcha_{telephone}') == '123456'
+    assert store.stats.snapshot() == {'issued': 1, 'throttled': 1}
+
+    store.revoke(telephone)
+    assert not redis.exists(f'send_flag_{telephone}',
+                            f'sms_captcha_{telephone}')
+
+
+def test_issue_concurrently() -> None:
+    store = make_store()
+    telephone = random_telephone()
+    barrier = threading.Barrier(32)
+    results = []
+
+    def request(captcha):
+        barrier.wait()
+        results.append((store.issue(telephone, captcha), captcha))
+
+    threads = [threading.Thread(target=request, args=(i,))
+               for i in range(32)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # 同时请求只发送一次，保存的验证码为发送的验证码
+    issued = [captcha for ok, captcha in results if ok]
+    assert len(issued) == 1
+    assert redis.get(f'sms_captcha_{telephone}') == str(issued[0])
+    store.revoke(telephone)
+
+
+def test_verify() -> None:
+    store = make_store()
+    telephone = random_telephone()
+    store.issue(telephone, 123456)
+    assert store.verify(telephone, 111111) == VerifyResult.INCORRECT
+    assert redis.get(f'sms_captcha_fails_{telephone}') == '1'
+    assert 895 < redis.ttl(f'sms_captcha_fails_{telephone}') <= 900
+    # 验证成功后验证码作废，失败次数清零
+    assert store.verify(telephone, 123456) == VerifyResult.CORRECT
+    assert not redis.exists(f'sms_captcha_{telephone}',
+                            f'sms_captcha_fails_{telephone}')
+    assert store.verify(telephone, 123456) == VerifyResult.INCORRECT
+    store.revoke(telephone)
+    redis.delete(f'sms_captcha_fails_{telephone}')
+
+
+def test_verify_lockout() -> None:
+    store = make_store()
+    telephone = random_telephone()
+    store.issue(telephone, 123456)
+    for _ in range(3):
+        assert not store.is_locked(telephone)
+        assert store.verify(telephone, 111111) == VerifyResult.INCORRECT
+    # 达到上限后验证码作废，锁定期间正确的验证码也验证失败
+    assert not redis.exists(f'sms_captcha_{telephone}')
+    assert store.is_locked(telephone)
+    assert store.verify(telephone, 123456) == VerifyResult.LOCKED
+    store.revoke(telephone)
+    store.issue(telephone, 123456)
+    assert store.verify(telephone, 123456) == VerifyResult.LOCKED
+    assert store.stats.snapshot() == {
+        'issued': 2, 'incorrect': 3, 'locked': 3,
+    }
+    store.revoke(telephone)
+    redis.delete(f'sms_captcha_fails_{telephone}')
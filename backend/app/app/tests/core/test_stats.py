@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Date: 2021/8/27
+# Author: gray
+
+import os
+import time
+
+from loguru import logger
+
+from app.core.stats import Stats, StatsReporter
+
+
+def test_reporter() -> None:
+    messages = []
+    sink_id = logger.add(messages.append, format='{message}')
+    stats = Stats('test_reporter')
+    stats.incr('hit', 2)
+    reporter = StatsReporter(interval=0.01)
+    reporter.register(stats)
+    try:
+        reporter.start()
+        time.sleep(0.05)
+        reporter.stop()
+    finally:
+        logger.remove(sink_id)
+
+    expected = f"stats pid={os.getpid()} name=test_reporter counters={{'hit': 2}}\n"
+    # 定期输出，停止时再输出一次
+    assert len(messages) >= 2
+    assert all(message == expected for message in messages)
+    count = len(messages)
+    reporter.stop()
+    assert len(messages) == count
+
+
+def test_reporter_disabled() -> None:
+    reporter = StatsReporter(interval=0)
+    reporter.start()
+    assert reporter._thread is None
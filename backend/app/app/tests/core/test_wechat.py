@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# _*_ coding: utf-8 _*_
+# Date: 2021/8/30
+# Author: gray
+
+import threading
+
+import pytest
+
+from app.constants import RespError
+from app.core.wechat import AccessTokenProvider, CircuitBreaker, WeChatClient
+from app.db.redis import redis
+from app.exceptions import BizHTTPException
+from app.tests.utils.fake_server import FakeServer
+
+
+def build_client(url: str) -> WeChatClient:
+    return WeChatClient(
+        'appid', 'secret', f'{url}/sns/jscode2session',
+        connect_timeout=1, read_timeout=1, max_retries=1, pool_size=2,
+        breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60),
+        access_token_url=f'{url}/cgi-bin/token',
+    )
+
+
+class IsolatedAccessTokenProvider(AccessTokenProvider):
+    # 使用单独的 Redis key，不影响本地开发环境中的 access_token
+    KEY = 'test_wx_access_token'
+    LOCK_KEY = 'test_wx_access_token_lock'
+
+
+def build_provider(url: str) -> AccessTokenProvider:
+    return IsolatedAccessTokenProvider(build_client(url), redis,
+                                       refresh_ahead=300, lock_timeout=5,
+                                       wait_timeout=5)
+
+
+def get_concurrently(providers, threads: int) -> list:
+    barrier = threading.Barrier(len(providers) * threads)
+    results = []
+
+    def get(provider):
+        barrier.wait()
+        try:
+            results.append(provider.get())
+        except BizHTTPException as e:
+            results.append(e.statement)
+
+    workers = [threading.Thread(target=get, args=(provider,))
+               for provider in providers for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return results
+
+
+def test_code2session() -> None:
+    def handler(method, path, query, body):
+        return 200, {'openid': query['js_code'], 'session_key': 'key'}
+
+    with FakeServer(handler) as server:
+        client = build_client(server.url)
+        for code in ('code1', 'code2', 'code3'):
+            assert client.code2session(code).openid == code
+        assert server.connections == 1
+
+
+def test_code2session_circuit_breaker() -> None:
+    def handler(method, path, query, body):
+        return 200, {'errcode': -1, 'errmsg': 'system error'}
+
+    with FakeServer(handler) as server:
+        client = build_client(server.url)
+        # 系统繁忙重试一次后仍返回系统繁忙，连续失败两次后熔断
+        assert client.code2session('code').errcode == '-1'
+        assert server.requests == 2
+        with pytest.raises(BizHTTPException) as exc_info:
+            client.code2session('code')
+        assert exc_info.value.statement == RespError.SERVER_TOO_BUSY.statement
+        assert server.requests == 2
+        assert client.stats.snapshot() == {
+            'request': 2, 'retry': 1, 'failure': 2, 'rejected': 1
+        }
+
+
+def test_circuit_breaker_gateway_error() -> None:
+    def handler(method, path, query, body):
+        return 502, b'<html>502 Bad Gateway</html>'
+
+    with FakeServer(handler) as server:
+        client = build_client(server.url)
+        # HTTP 错误状态码、无法解析的响应报文记为失败
+        for _ in range(2):
+            assert client.code2session('code').errcode is None
+        assert client.breaker.state == CircuitBreaker.OPEN
+        with pytest.raises(BizHTTPException):
+            client.code2session('code')
+        assert server.requests == 2
+
+
+def test_circuit_breaker_probe_error(monkeypatch) -> None:
+    client = build_client('http://127.0.0.1:1')
+    client.breaker.state = CircuitBreaker.OPEN
+
+    def get(*args, **kwargs):
+        raise RuntimeError('unexpected')
+
+    monkeypatch.setattr(client.session, 'get', get)
+    # 熔断时间已过，试探请求抛出其他异常时继续熔断，不停留在半开状态
+    client.breaker.reset_timeout = 0
+    with pytest.raises(RuntimeError):
+        client.code2session('code')
+    assert client.breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(RuntimeError):
+        client.code2session('code')
+    assert client.stats.get('failure') == 2
+
+
+def test_access_token() -> None:
+    tokens = []
+
+    def handler(method, path, query, body):
+        assert path == '/cgi-bin/token'
+        assert query['grant_type'] == 'client_credential'
+        tokens.append(f'token{len(tokens)}')
+        return 200, {'access_token': tokens[-1], 'expires_in': 7200}
+
+    redis.delete(IsolatedAccessTokenProvider.KEY)
+    with FakeServer(handler, latency=0.05) as server:
+        # 两个进程各 10 个线程同时获取，只请求一次微信接口
+        providers = [build_provider(server.url) for _ in range(2)]
+        results = get_concurrently(providers, 10)
+        assert results == ['token0'] * 20
+        assert server.requests == 1
+        assert 6895 < redis.ttl(IsolatedAccessTokenProvider.KEY) <= 6900
+        assert providers[0].stats.get('shared') \
+            + providers[1].stats.get('shared') == 18
+        assert providers[0].get() == 'token0'
+        assert providers[0].stats.get('local_hit') == 1
+
+        # 新进程从 Redis 读取
+        provider = build_provider(server.url)
+        assert provider.get() == 'token0'
+        assert provider.stats.snapshot() == {'redis_hit': 1}
+
+        # 剩余有效时间充足时定时任务不刷新
+        assert provider.refresh() == 'token0'
+        assert server.requests == 1
+        # 剩余有效时间少于 refresh_ahead 时刷新，其他进程的进程内缓存过期后读取新的 access_token
+        redis.pexpire(IsolatedAccessTokenProvider.KEY, 299000)
+        assert provider.refresh() == 'token1'
+        assert redis.get(IsolatedAccessTokenProvider.KEY) == 'token1'
+        providers[0]._local = None
+        assert providers[0].get() == 'token1'
+    redis.delete(IsolatedAccessTokenProvider.KEY)
+
+
+def test_access_token_failure() -> None:
+    def handler(method, path, query, body):
+        return 200, {'errcode': 40013, 'errmsg': 'invalid appid'}
+
+    redis.delete(IsolatedAccessTokenProvider.KEY)
+    with FakeServer(handler, latency=0.05) as server:
+        provider = build_provider(server.url)
+        # 同时等待的线程共享同一次失败
+        results = get_concurrently([provider], 10)
+        assert results == [RespError.SERVER_TOO_BUSY.statement] * 10
+        assert server.requests == 1
+        assert not redis.exists(IsolatedAccessTokenProvider.KEY)
+        assert not redis.exists(IsolatedAccessTokenProvider.LOCK_KEY)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# _*_ coding: utf-8 _*_
+# Date: 2021/8/30
+# Author: gray
+
+"""
+本地模拟的外部 HTTP 服务（微信、API网关、腾讯云短信等），供测试和基准测试使用
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Tuple
+from urllib.parse import parse_qs, urlparse
+
+
+# handler(method, path, query, body) -> (status_code, 响应报文)
+Handler = Callable[[str, str, Dict[str, str], bytes], Tuple[int, Any]]
+
+
+class FakeServer(object):
+    """
+    在后台线程运行的 HTTP 服务，支持长连接，每个请求延迟 latency 秒后响应
+
+    Examples
+    --------
+    with FakeServer(lambda *_: (200, {'errcode': 0}), latency=0.01) as server:
+        requests.get(f'{server.url}/path')
+    """
+    def __init__(self, handler: Handler, latency: float = 0) -> None:
+        self.handler = handler
+        self.latency = latency
+        self.requests = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0),
+                                          self._build_handler())
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever,
+                                        daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address
+        return f'http://{host}:{port}'
+
+    def __enter__(self) -> 'FakeServer':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _build_handler(self):
+        server = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # 响应头和响应体分两次写入，禁用 Nagle 算法避免长连接上的延迟确认等待
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                server._count('connections')
+
+            def do_GET(self):
+                self._handle('GET')
+
+            def do_POST(self):
+                self._handle('POST')
+
+            def _handle(self, method: str) -> None:
+                server._count('requests')
+                url = urlparse(self.path)
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                if server.latency:
+                    time.sleep(server.latency)
+                status_code, content = server.handler(method, url.path,
+                                                      query, body)
+                if not isinstance(content, bytes):
+                    content = json.dumps(content).encode('utf8')
+                self.send_response(status_code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *_):
+                ...
+
+        return RequestHandler
@@ -6,20 +6,20 @@
 from sqlalchemy.orm import Session
 
 from app import crud
-from app.models import HomepageMenu, Slideshow
+from app.constants import DBConst
+from app.models import HomepageMenu, EntrancePage
 from app.tests.utils.utils import random_lower_string
 
 
-def create_random_slideshow(db: Session) -> Slideshow:
+def create_random_guidance_page(db: Session) -> EntrancePage:
     src = random_lower_string()
     desc = random_lower_string()
     target = random_lower_string()
-    herf = random_lower_string()
-    name = random_lower_string()
 
-    slideshow = Slideshow(src=src, desc=desc, target=target, herf=herf, name=name)  # noqa
-    crud.entrance_page.create(db, obj_in=slideshow)
-    return slideshow
+    guidance_page = EntrancePage(src=src, desc=desc, target=target,
+                                 type=DBConst.GUIDANCE)
+    crud.entrance_page.create(db, obj_in=guidance_page)
+    return guidance_page
 
 
 def create_random_homepage_menu(db: Session) -> HomepageMenu:
@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+# _*_ coding: utf-8 _*_
+# Date: 2021/9/3
+# Author: gray
+
+import json
+
+
+FAILED_NUMBER = '+8613000000000'
+
+
+class FakeSms(object):
+    """
+    本地模拟的腾讯云短信 SendSms 接口，记录每次请求的模板参数和手机号，
+    FAILED_NUMBER 返回发送失败，配合 FakeServer 使用
+    """
+    def __init__(self) -> None:
+        self.requests = []
+
+    def __call__(self, method, path, query, body):
+        params = json.loads(body)
+        self.requests.append((tuple(params['TemplateParamSet']),
+                              params['PhoneNumberSet']))
+        statuses = [
+            {
+                'SerialNo': '', 'PhoneNumber': number, 'Fee': 1,
+                'SessionContext': '', 'IsoCode': 'CN',
+                'Code': 'LimitExceeded.PhoneNumberDailyLimit'
+                if number == FAILED_NUMBER else 'Ok',
+                'Message': 'send success',
+            }
+            for number in params['PhoneNumberSet']
+        ]
+        return 200, {'Response': {'SendStatusSet': statuses,
+                                  'RequestId': 'request-id'}}
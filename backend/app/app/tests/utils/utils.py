@@ -25,8 +25,9 @@ def get_access_token(client: TestClient) -> str:
     if TOKEN:
         return TOKEN
     resp = client.get(f'{settings.CLASS_MANAGER_STR}/access_tokens/{CODE}')
-    tokens = resp.json()
     assert resp.status_code == 200
+    # 响应报文 {'statement': ..., 'message': ..., 'data': Token}
+    tokens = resp.json()['data']
     assert 'access_token' in tokens
     assert tokens['access_token']
     TOKEN = tokens['access_token']
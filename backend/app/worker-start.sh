@@ -3,4 +3,15 @@ set -e
 
 python /app/app/celeryworker_pre_start.py
 
-celery -A app.worker worker -l info -Q main-queue -c 1
+# io-queue: I/O 密集型任务，线程池（安装 gevent 后可设置 CELERY_IO_POOL=gevent）
+celery -A app.worker worker -l info -n io@%h -Q io-queue \
+    -P "${CELERY_IO_POOL:-threads}" -c "${CELERY_IO_CONCURRENCY:-50}" &
+# cpu-queue: CPU 密集型任务，prefork 进程池
+celery -A app.worker worker -l info -n cpu@%h -Q cpu-queue \
+    -P prefork -c "${CELERY_CPU_CONCURRENCY:-1}" &
+
+# 转发停止信号，任一 worker 退出时停止容器
+trap 'kill -TERM $(jobs -p) 2>/dev/null; wait' TERM INT
+wait -n
+kill -TERM $(jobs -p) 2>/dev/null || true
+wait